@@ -1,5 +1,37 @@
-import webapp2
+import base64
 import json
+import os
+import urllib
+
+import webapp2
+
+import oauth
+
+# the most test users that one POST can create
+MAX_TEST_USERS = 50000
+# the most friends that each new test user can have
+MAX_FRIENDS = 5000
+# the most friends connection rows that one POST can create, so that it
+# doesn't hold SQLite's write lock for too long
+MAX_FRIEND_ROWS = 1000000
+# new test user ids are bigger than this, like Facebook's
+TEST_USER_ID_START = 100000000000000
+# the number of test users that GET reads from SQLite and writes at a time
+ROWS_PER_WRITE = 1000
+# SQLite integers are signed 64 bit. GET reads limit + 1 rows, so limit has to
+# be one less than this.
+SQLITE_MAX_INT = 2 ** 63 - 1
+
+# test users in insertion order, after a rowid. tokens that were inserted more
+# than once, e.g. by download.py, are only returned the first time. the token
+# index makes that check cheap.
+LIST_SQL = """
+    SELECT rowid, user_id, token FROM oauth_access_tokens AS t
+    WHERE rowid > ? AND NOT EXISTS (
+      SELECT 1 FROM oauth_access_tokens
+      WHERE token = t.token AND user_id = t.user_id AND rowid < t.rowid)
+    ORDER BY rowid LIMIT ?
+"""
 
 
 class TestUsersHandler(webapp2.RequestHandler):
@@ -15,17 +47,232 @@ class TestUsersHandler(webapp2.RequestHandler):
         cls.conn = conn
 
     def get(self, app_id):
-        sql = """
-            SELECT DISTINCT user_id, token
-            FROM oauth_access_tokens;
+        """Lists test users and their access tokens, oldest first.
+
+        The response is generated by list_users() as rows are read from
+        SQLite, so big listings aren't built up in memory first.
+
+        Query parameters:
+          limit: optional page size. if there are more users, the response's
+            paging has a next link.
+          after: cursor from a previous page's paging.cursors.after
+        """
+        self.response.headers['Content-Type'] = 'text/plain; charset=utf-8'
+        try:
+            limit = self.get_int('limit', None, 1, SQLITE_MAX_INT - 1)
+            after = self.get_cursor('after')
+        except ValueError, e:
+            self.response.set_status(400)
+            self.response.write(oauth.ERROR_JSON % unicode(e))
+            return
+
+        # read one extra row to tell whether there's a next page
+        cursor = self.conn.execute(
+            LIST_SQL, (after, limit + 1 if limit is not None else -1))
+        self.response.app_iter = self.list_users(cursor, app_id, limit)
+
+    def list_users(self, cursor, app_id, limit):
+        """Generates the test users listing's JSON, a few rows at a time.
+
+        This is the response's app_iter, so the server sends each chunk as
+        it's generated, after get() has returned.
+
+        Args:
+          cursor: sqlite3.Cursor over LIST_SQL, with one more row than limit
+          app_id: string
+          limit: integer page size, or None
         """
-        cursor = self.conn.execute(sql)
-        rows = cursor.fetchall()
+        yield '{\n  "data": ['
+        written = 0
+        last = None
+        more = False
+        while not more:
+            rows = cursor.fetchmany(ROWS_PER_WRITE)
+            if not rows:
+                break
+            if limit is not None and written + len(rows) > limit:
+                rows = rows[:limit - written]
+                more = True
+            if rows:
+                yield '%s\n    %s' % (',' if written else '', ',\n    '.join(
+                    json.dumps({'id': user_id, 'access_token': token})
+                    for _, user_id, token in rows))
+                written += len(rows)
+                last = rows[-1][0]
+        yield '\n  ]'
+
+        if last is not None:
+            paging = {'cursors': {'after': self.encode_cursor(last)}}
+            if more:
+                paging['next'] = self.page_url(app_id, limit,
+                                               paging['cursors']['after'])
+            yield ',\n  "paging": %s' % json.dumps(paging)
+        yield '\n}'
 
-        results = {'data': []}
-        for row in rows:
-            user_id, token = row
-            results['data'].append({'id': user_id, 'access_token': token})
+    def post(self, app_id):
+        """Creates test users, each with a graph object, auth code, and token.
 
+        All of the users are inserted in one transaction with executemany().
+        The transaction takes SQLite's write lock before allocating ids, so
+        concurrent requests, even in other processes, get different ids.
+
+        Query parameters:
+          count: number of users to create, up to MAX_TEST_USERS. if provided,
+            the response is {"data": [...]}. otherwise, one user is created
+            and returned, like Facebook.
+          name: optional name. numbered if more than one user is created.
+          friends: the new users are arranged in a ring, and each one is
+            friends with this many users on each side of it. friends are
+            added to the Graph API friends connection. default 0. the total
+            number of friend connections is limited to MAX_FRIEND_ROWS.
+        """
         self.response.headers['Content-Type'] = 'text/plain; charset=utf-8'
-        json.dump(results, self.response.out, indent=2)
+        try:
+            count = self.get_int('count', 1, 1, MAX_TEST_USERS)
+            friends = self.get_int('friends', 0, 0, MAX_FRIENDS)
+            friend_rows = count * min(2 * friends, count - 1)
+            if friend_rows > MAX_FRIEND_ROWS:
+                raise ValueError(
+                    '(#100) count and friends would create %d friend '
+                    'connections. The maximum is %d' %
+                    (friend_rows, MAX_FRIEND_ROWS))
+        except ValueError, e:
+            self.response.set_status(400)
+            self.response.write(oauth.ERROR_JSON % unicode(e))
+            return
+
+        name = self.request.get('name') or 'Test User'
+        if count > 1:
+            names = ['%s %d' % (name, i + 1) for i in range(count)]
+        else:
+            names = [name]
+
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            start = self.next_user_id()
+            ids = [str(start + i) for i in range(count)]
+            codes = [base64.urlsafe_b64encode(os.urandom(oauth.RANDOM_BYTES))
+                     for id in ids]
+            tokens = [oauth.BaseHandler.make_token(id, app_id) for id in ids]
+
+            self.conn.executemany(
+                'INSERT INTO graph_objects (id, alias, data) '
+                'VALUES (?, NULL, ?)',
+                ((id, json.dumps({'id': id, 'name': name, 'type': 'user'}))
+                 for id, name in zip(ids, names)))
+            self.conn.executemany(
+                'INSERT INTO oauth_codes (code, client_id, redirect_uri) '
+                "VALUES (?, ?, '')",
+                ((code, app_id) for code in codes))
+            self.conn.executemany(
+                'INSERT INTO oauth_access_tokens (user_id, code, token) '
+                'VALUES (?, ?, ?)',
+                zip(ids, codes, tokens))
+            if friends:
+                self.conn.executemany(
+                    'INSERT INTO graph_connections '
+                    "(id, connection, data, position, time) "
+                    "VALUES (?, 'friends', ?, ?, ?)",
+                    self.friend_rows(ids, names, friends))
+            self.conn.commit()
+        except:
+            self.conn.rollback()
+            raise
+
+        users = [{'id': id, 'access_token': token}
+                 for id, token in zip(ids, tokens)]
+        # json.dump() writes lots of small chunks, which is slow for big
+        # responses, so write it all at once
+        if 'count' in self.request.arguments():
+            self.response.write(json.dumps({'data': users}, indent=2))
+        else:
+            self.response.write(json.dumps(users[0], indent=2))
+
+    def get_int(self, arg, default, min, max):
+        """Returns an integer query parameter.
+
+        Raises: ValueError if it's not an integer between min and max
+        """
+        value = self.request.get(arg)
+        if not value:
+            return default
+        try:
+            value = int(value)
+        except ValueError:
+            value = None
+        if value is None or not min <= value <= max:
+            raise ValueError('(#100) %s must be an integer between %d and %d' %
+                             (arg, min, max))
+        return value
+
+    def encode_cursor(self, rowid):
+        return base64.urlsafe_b64encode(str(rowid))
+
+    def get_cursor(self, arg):
+        """Returns the rowid in a cursor query parameter, or 0 if it's not set.
+
+        Raises: ValueError if the cursor is malformed
+        """
+        cursor = self.request.get(arg)
+        if not cursor:
+            return 0
+        try:
+            rowid = int(base64.urlsafe_b64decode(str(cursor)))
+        except (TypeError, ValueError, UnicodeError):
+            rowid = None
+        if rowid is None or not 0 <= rowid <= SQLITE_MAX_INT:
+            raise ValueError('(#100) Invalid cursor: %s' % cursor)
+        return rowid
+
+    def page_url(self, app_id, limit, after):
+        """Returns the URL for the page after a cursor.
+
+        Keeps the request's other query parameters, e.g. access_token.
+        """
+        args = [(key, val.encode('utf-8'))
+                for key, val in self.request.GET.items()
+                if key not in ('limit', 'after')]
+        args += [('limit', limit), ('after', after)]
+        return '%s/%s/accounts/test-users?%s' % (
+            self.request.host_url, app_id, urllib.urlencode(args))
+
+    def next_user_id(self):
+        """Returns the first unused test user id.
+
+        The integer id indexes let SQLite find each maximum without scanning.
+        """
+        row = self.conn.execute("""
+            SELECT MAX(id) FROM (
+              SELECT MAX(CAST(id AS INTEGER)) AS id FROM graph_objects
+              UNION ALL
+              SELECT MAX(CAST(user_id AS INTEGER)) FROM oauth_access_tokens)
+            """).fetchone()
+        return max(row[0] or 0, TEST_USER_ID_START) + 1
+
+    def friend_rows(self, ids, names, friends):
+        """Generates graph_connections rows for friends in a ring.
+
+        Each user is friends with the friends users on each side of it, so
+        every friendship is mutual.
+
+        Args:
+          ids: list of string user ids
+          names: list of string user names
+          friends: integer
+
+        Returns: generator of (id, data, position, time) tuples. time is
+          always None, since friends rows have no created_time or
+          updated_time.
+        """
+        count = len(ids)
+        data = [json.dumps({'id': id, 'name': name})
+                for id, name in zip(ids, names)]
+        for i, id in enumerate(ids):
+            seen = set([i])
+            position = 0
+            for offset in range(1, min(friends, count // 2) + 1):
+                for j in ((i + offset) % count, (i - offset) % count):
+                    if j not in seen:
+                        seen.add(j)
+                        yield (id, data[j], position, None)
+                        position += 1
@@ -0,0 +1,170 @@
+#!/usr/bin/python
+"""Unit tests for app.py.
+"""
+
+__author__ = ['Ryan Barrett <mockfacebook@ryanb.org>']
+
+import base64
+import json
+import multiprocessing
+import unittest
+
+import app
+import graph
+import oauth
+import testutil
+
+
+class TestUsersHandlerTest(testutil.HandlerTest):
+
+  def setUp(self):
+    super(TestUsersHandlerTest, self).setUp(app.TestUsersHandler,
+                                            graph.GraphHandler)
+
+  def post(self, **args):
+    resp = self.app.get_response('/123/accounts/test-users', POST=args)
+    return resp.status_int, json.loads(resp.body)
+
+  def test_create_one(self):
+    status, user = self.post(name='Alice')
+    self.assertEquals(200, status)
+    self.assertEquals(str(app.TEST_USER_ID_START + 1), user['id'])
+    self.assertEquals(user['id'], oauth.TokenCache(self.conn).get_user(
+        user['access_token']))
+    self.expect('/' + user['id'], {'id': user['id'], 'name': 'Alice',
+                                   'type': 'user'},
+                args={'access_token': user['access_token']})
+
+  def test_create_many_with_friends(self):
+    status, resp = self.post(count='5', friends='1')
+    self.assertEquals(200, status)
+    ids = [user['id'] for user in resp['data']]
+    self.assertEquals(5, len(set(ids)))
+    self.assertEquals(5, len(set(user['access_token'] for user in resp['data'])))
+
+    friends = json.loads(self.get_response('/%s/friends' % ids[0]).body)['data']
+    self.assertEquals([{'id': ids[1], 'name': 'Test User 2'},
+                       {'id': ids[4], 'name': 'Test User 5'}], friends)
+
+    # more users get new ids
+    status, resp = self.post(count='2', friends='9')
+    self.assertEquals([str(int(ids[-1]) + 1), str(int(ids[-1]) + 2)],
+                      [user['id'] for user in resp['data']])
+    friends = json.loads(self.get_response(
+        '/%s/friends' % resp['data'][0]['id']).body)['data']
+    self.assertEquals([resp['data'][1]['id']], [f['id'] for f in friends])
+
+  def test_next_user_id_uses_indexes(self):
+    self.conn.execute("INSERT INTO graph_objects VALUES('200000000000000', "
+                      "NULL, '{}')")
+    self.assertEquals(200000000000001,
+                      app.TestUsersHandler().next_user_id())
+
+    plan = ' '.join(row[-1] for row in self.conn.execute(
+        'EXPLAIN QUERY PLAN SELECT MAX(CAST(id AS INTEGER)) FROM graph_objects'))
+    self.assertIn('graph_objects_int_id_index', plan)
+    plan = ' '.join(row[-1] for row in self.conn.execute(
+        'EXPLAIN QUERY PLAN SELECT MAX(CAST(user_id AS INTEGER)) '
+        'FROM oauth_access_tokens'))
+    self.assertIn('oauth_access_tokens_int_user_id_index', plan)
+
+  def test_friends_since_until(self):
+    status, resp = self.post(count='3', friends='1')
+    id = resp['data'][0]['id']
+    for args in {'since': '1'}, {'until': '2000000000'}:
+      friends = json.loads(self.get_response('/%s/friends' % id,
+                                             args=args).body)['data']
+      self.assertEquals(2, len(friends), args)
+
+  def test_list(self):
+    status, resp = self.post(count='5')
+    users = resp['data']
+    # duplicate tokens are only listed once
+    self.conn.execute('INSERT INTO oauth_access_tokens(user_id, code, token) '
+                      'VALUES(?, "asdf", ?)', (users[0]['id'], users[0]['access_token']))
+    self.conn.commit()
+    self.assertEquals(users, json.loads(self.get_response(
+          '/123/accounts/test-users').body)['data'])
+
+    listed = []
+    url = '/123/accounts/test-users?limit=2&access_token=x'
+    while url:
+      resp = json.loads(self.get_response(url).body)
+      self.assertTrue(1 <= len(resp['data']) <= 2)
+      listed += resp['data']
+      url = resp['paging'].get('next')
+      if url:
+        self.assertIn('access_token=x', url)
+        url = url[len('http://localhost'):]
+    self.assertEquals(users, listed)
+
+    # past the end
+    resp = json.loads(self.get_response(
+        '/123/accounts/test-users?after=' + resp['paging']['cursors']['after']).body)
+    self.assertEquals({'data': []}, resp)
+
+    too_big = 2 ** 63 - 1
+    for args in ('limit=0', 'limit=x', 'limit=%d' % too_big, 'after=foo',
+                 'after=' + base64.urlsafe_b64encode('9' * 25),
+                 'after=' + base64.urlsafe_b64encode('-1')):
+      resp = self.get_response('/123/accounts/test-users?' + args)
+      self.assertEquals(400, resp.status_int)
+
+  def test_list_streams(self):
+    self.post(count='3')
+    orig_rows = app.ROWS_PER_WRITE
+    app.ROWS_PER_WRITE = 1
+    try:
+      resp = self.get_response('/123/accounts/test-users')
+    finally:
+      app.ROWS_PER_WRITE = orig_rows
+
+    # the body is generated in chunks, not buffered, so it has no length
+    self.assertIsNone(resp.content_length)
+    chunks = list(resp.app_iter)
+    self.assertTrue(len(chunks) > 3, chunks)
+    self.assertEquals(3, len(json.loads(''.join(chunks))['data']))
+
+  def test_bad_params(self):
+    for args in ({'count': '0'}, {'count': 'x'},
+                 {'count': str(app.MAX_TEST_USERS + 1)}, {'friends': '-1'},
+                 {'count': str(app.MAX_TEST_USERS),
+                  'friends': str(app.MAX_FRIENDS)}):
+      status, resp = self.post(**args)
+      self.assertEquals(400, status)
+      self.assertEquals('OAuthException', resp['error']['type'])
+    self.assertEquals(0, self.conn.execute(
+        'SELECT COUNT(*) FROM oauth_access_tokens').fetchone()[0])
+
+
+
+class ConcurrentTestUsersTest(testutil.ThreadLocalDbTest):
+  """Creates test users concurrently in separate processes, like --workers.
+  """
+
+  def setUp(self):
+    super(ConcurrentTestUsersTest, self).setUp(app.TestUsersHandler)
+
+  def test_concurrent(self):
+    queue = multiprocessing.Queue()
+    def create():
+      resp = self.app.get_response('/123/accounts/test-users',
+                                   POST={'count': '300'})
+      queue.put((resp.status_int, resp.body))
+
+    workers = [multiprocessing.Process(target=create) for i in range(4)]
+    for worker in workers:
+      worker.start()
+    results = [queue.get(timeout=30) for worker in workers]
+    for worker in workers:
+      worker.join()
+
+    ids = []
+    for status, body in results:
+      self.assertEquals(200, status, body)
+      ids += [user['id'] for user in json.loads(body)['data']]
+    self.assertEquals(1200, len(set(ids)))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,421 @@
+"""An event driven HTTP server that runs a WSGI application in a thread pool.
+
+wsgiref's servers use a blocking socket and (at best) a thread per connection,
+so they can't hold many mostly idle keep-alive connections. This server uses
+asyncore to handle all connections in a single thread and only hands complete
+requests to a bounded pool of threads to run the WSGI application, which does
+the SQLite work.
+
+Connections are persistent by default for HTTP/1.1 clients and for HTTP/1.0
+clients that send Connection: keep-alive. Pipelined requests are handled one at
+a time, in order. Idle connections are closed after the server's idle_timeout.
+"""
+
+__author__ = ['Ryan Barrett <mockfacebook@ryanb.org>']
+
+import asynchat
+import asyncore
+import collections
+import cStringIO
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+import urllib
+import wsgiref.handlers
+
+import executor
+
+# the maximum size of a request's headers, in bytes
+MAX_HEADER_SIZE = 65536
+
+SERVER_SOFTWARE = 'mockfacebook'
+
+
+class Trigger(asyncore.file_dispatcher):
+  """Runs callbacks in the asyncore loop thread on behalf of other threads.
+
+  Other threads call call_soon(), which queues the callback and wakes up the
+  loop by writing to a pipe.
+
+  Attributes:
+    callbacks: deque of (function, args) tuples
+    write_fd: integer, the write end of the pipe
+  """
+
+  def __init__(self, map):
+    read_fd, self.write_fd = os.pipe()
+    asyncore.file_dispatcher.__init__(self, read_fd, map=map)
+    os.close(read_fd)  # file_dispatcher dup()s it
+    self.callbacks = collections.deque()
+
+  def call_soon(self, fn, *args):
+    self.callbacks.append((fn, args))
+    os.write(self.write_fd, 'x')
+
+  def writable(self):
+    return False
+
+  def handle_read(self):
+    self.recv(8192)
+    while self.callbacks:
+      fn, args = self.callbacks.popleft()
+      try:
+        fn(*args)
+      except:
+        logging.exception('Error in callback.')
+
+  def close(self):
+    asyncore.file_dispatcher.close(self)
+    os.close(self.write_fd)
+
+
+class Request(object):
+  """A parsed HTTP request.
+
+  Attributes:
+    method, path, version: strings from the request line
+    headers: list of (string name, string value) tuples
+    body: string
+  """
+
+  def __init__(self, method, path, version, headers):
+    self.method = method
+    self.path = path
+    self.version = version
+    self.headers = headers
+    self.body = ''
+
+  def get_header(self, name, default=None):
+    name = name.lower()
+    for header, value in self.headers:
+      if header.lower() == name:
+        return value
+    return default
+
+  def keep_alive(self):
+    """Returns True if the connection should be kept open after this request.
+    """
+    connection = self.get_header('Connection', '').lower()
+    if self.version == 'HTTP/1.1':
+      return connection != 'close'
+    else:
+      return connection == 'keep-alive'
+
+
+class Channel(asynchat.async_chat):
+  """A single client connection.
+
+  Reads requests and queues them, then runs them through the server's WSGI
+  application one at a time so that responses are written in order.
+
+  Attributes:
+    server: AsyncWSGIServer
+    client_address: (host, port) tuple
+    buffer: list of strings, the data read so far for the current request
+    request: the Request currently being read, or None if reading headers
+    pending: deque of Requests that have been read but not yet run
+    running: True if a request is currently running in the executor
+    closing: True if the connection will be closed after the current response
+    last_activity: float Unix timestamp of the last read or response
+  """
+
+  def __init__(self, server, sock, client_address):
+    asynchat.async_chat.__init__(self, sock, map=server.map)
+    self.server = server
+    self.client_address = client_address
+    self.buffer = []
+    self.request = None
+    self.pending = collections.deque()
+    self.running = False
+    self.closing = False
+    self.last_activity = time.time()
+    self.set_terminator('\r\n\r\n')
+
+  def collect_incoming_data(self, data):
+    self.last_activity = time.time()
+    self.buffer.append(data)
+    if (self.request is None and
+        sum(len(chunk) for chunk in self.buffer) > MAX_HEADER_SIZE):
+      self.send_error('431 Request Header Fields Too Large')
+
+  def found_terminator(self):
+    data = ''.join(self.buffer)
+    self.buffer = []
+
+    if self.request is not None:
+      # this was the body
+      self.request.body = data
+      self.request_done()
+      return
+
+    lines = data.lstrip('\r\n').split('\r\n')
+    try:
+      method, path, version = lines[0].split()
+      headers = [tuple(s.strip() for s in line.split(':', 1))
+                 for line in lines[1:]]
+    except ValueError:
+      self.send_error('400 Bad Request')
+      return
+    if not all(len(header) == 2 for header in headers):
+      self.send_error('400 Bad Request')
+      return
+
+    self.request = Request(method, path, version, headers)
+    if 'chunked' in self.request.get_header('Transfer-Encoding', '').lower():
+      # we don't support chunked request bodies
+      self.send_error('411 Length Required')
+      return
+
+    try:
+      length = int(self.request.get_header('Content-Length') or 0)
+    except ValueError:
+      self.send_error('400 Bad Request')
+      return
+
+    expect = self.request.get_header('Expect', '').lower()
+    if expect and expect != '100-continue':
+      self.send_error('417 Expectation Failed')
+      return
+
+    if length > 0:
+      if expect and version == 'HTTP/1.1':
+        # the client is waiting for this before it sends the body
+        self.push('HTTP/1.1 100 Continue\r\n\r\n')
+      self.set_terminator(length)
+    else:
+      self.request_done()
+
+  def request_done(self):
+    """Called when a request has been completely read.
+    """
+    self.pending.append(self.request)
+    self.request = None
+    self.set_terminator('\r\n\r\n')
+    self.run_next()
+
+  def readable(self):
+    # stop reading while responses are backed up. asynchat will pick up any
+    # pipelined requests that are already buffered when it reads again.
+    return (not self.closing and len(self.pending) < self.server.max_pipelined and
+            asynchat.async_chat.readable(self))
+
+  def run_next(self):
+    """Runs the next pending request in the executor, if any.
+    """
+    if self.running or self.closing or not self.pending:
+      return
+
+    self.running = True
+    request = self.pending.popleft()
+    self.server.executor.submit(self.run_app, request)
+
+  def run_app(self, request):
+    """Runs the WSGI application on a request. Called in an executor thread.
+    """
+    response = []
+
+    def start_response(status, headers, exc_info=None):
+      if exc_info and response:
+        raise exc_info[0], exc_info[1], exc_info[2]
+      response[:] = [status, headers]
+      return lambda data: body.append(data)
+
+    body = []
+    try:
+      result = self.server.app(self.make_environ(request), start_response)
+      try:
+        for data in result:
+          body.append(data)
+      finally:
+        if hasattr(result, 'close'):
+          result.close()
+      if not response:
+        raise RuntimeError("application didn't call start_response()")
+    except:
+      logging.exception('Error running %s %s' % (request.method, request.path))
+      response[:] = ['500 Internal Server Error',
+                     [('Content-Type', 'text/plain')]]
+      body = ['Internal Server Error']
+
+    self.server.trigger.call_soon(self.send_response, request, response[0],
+                                  response[1], ''.join(body))
+
+  def make_environ(self, request):
+    """Returns the WSGI environ dict for a request.
+    """
+    path, _, query = request.path.partition('?')
+    host, port = self.server.server_address[:2]
+    environ = {
+      'REQUEST_METHOD': request.method,
+      'SCRIPT_NAME': '',
+      'PATH_INFO': urllib.unquote(path),
+      'QUERY_STRING': query,
+      'SERVER_NAME': host or socket.gethostname(),
+      'SERVER_PORT': str(port),
+      'SERVER_PROTOCOL': request.version,
+      'REMOTE_ADDR': self.client_address[0],
+      'SERVER_SOFTWARE': SERVER_SOFTWARE,
+      'wsgi.version': (1, 0),
+      'wsgi.url_scheme': 'http',
+      'wsgi.input': cStringIO.StringIO(request.body),
+      'wsgi.errors': sys.stderr,
+      'wsgi.multithread': True,
+      'wsgi.multiprocess': False,
+      'wsgi.run_once': False,
+      }
+
+    for name, value in request.headers:
+      key = name.upper().replace('-', '_')
+      if key in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+        environ[key] = value
+      else:
+        key = 'HTTP_' + key
+        if key in environ:
+          value = environ[key] + ',' + value
+        environ[key] = value
+
+    return environ
+
+  def send_response(self, request, status, headers, body):
+    """Writes a response and starts the next request, if any.
+
+    Called in the asyncore loop thread.
+    """
+    self.running = False
+    self.last_activity = time.time()
+    if not self.connected:
+      # the client went away while the request was running
+      return
+
+    keep_alive = request.keep_alive()
+    if request.method == 'HEAD':
+      body = ''
+
+    names = set(name.lower() for name, _ in headers)
+    headers = list(headers)
+    if 'content-length' not in names:
+      headers.append(('Content-Length', str(len(body))))
+    if 'date' not in names:
+      headers.append(('Date', wsgiref.handlers.format_date_time(time.time())))
+    if 'server' not in names:
+      headers.append(('Server', SERVER_SOFTWARE))
+    headers.append(('Connection', 'keep-alive' if keep_alive else 'close'))
+
+    self.push(''.join(
+        ['HTTP/1.1 %s\r\n' % status] +
+        ['%s: %s\r\n' % header for header in headers] +
+        ['\r\n', body]))
+    logging.debug('%s - "%s %s %s" %s' % (self.client_address[0], request.method,
+                                         request.path, request.version,
+                                         status.split()[0]))
+
+    if keep_alive:
+      self.run_next()
+    else:
+      self.closing = True
+      self.close_when_done()
+
+  def is_idle(self, now, timeout):
+    """Returns True if nothing has happened on this connection for timeout
+    seconds and it's not running a request or writing a response.
+    """
+    return (not self.running and not self.pending and not self.producer_fifo
+            and now - self.last_activity > timeout)
+
+  def send_error(self, status):
+    self.closing = True
+    self.push('HTTP/1.1 %s\r\nContent-Length: 0\r\nConnection: close\r\n\r\n' %
+              status)
+    self.close_when_done()
+
+  def handle_error(self):
+    logging.exception('Error on connection from %s' % (self.client_address,))
+    self.close()
+
+
+class AsyncWSGIServer(asyncore.dispatcher):
+  """The server. Listens for connections and creates a Channel for each one.
+
+  Supports the serve_forever(), shutdown(), and server_close() methods from
+  SocketServer.BaseServer, so it can be used in place of wsgiref's servers.
+
+  Attributes:
+    app: WSGI application
+    server_address: (host, port) tuple
+    num_threads: integer, the size of the executor's thread pool
+    max_pipelined: integer, the maximum number of requests to buffer per
+      connection before waiting for responses
+    idle_timeout: number of seconds to keep an idle connection open
+    map: dict, the asyncore socket map
+    executor: executor.Executor
+    trigger: Trigger
+    stopping: Event, set when shutdown() is called
+    stopped: Event, set when serve_forever() returns
+  """
+  num_threads = 10
+  max_pipelined = 10
+  idle_timeout = 15
+  request_queue_size = 1024
+
+  def __init__(self, server_address, app):
+    self.map = {}
+    asyncore.dispatcher.__init__(self, map=self.map)
+    self.app = app
+    self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+    self.set_reuse_addr()
+    self.bind(server_address)
+    self.server_address = self.socket.getsockname()
+    self.listen(self.request_queue_size)
+    self.executor = None
+    self.trigger = None
+    self.stopping = threading.Event()
+    self.stopped = threading.Event()
+
+  def handle_accept(self):
+    pair = self.accept()
+    if pair is not None:
+      sock, client_address = pair
+      Channel(self, sock, client_address)
+
+  def serve_forever(self, poll_interval=0.5):
+    # start these here instead of in the constructor so that forked workers
+    # (see server.PreforkServer) each get their own.
+    if self.executor is None:
+      self.executor = executor.Executor(self.num_threads)
+    if self.trigger is None:
+      self.trigger = Trigger(self.map)
+
+    self.stopping.clear()
+    self.stopped.clear()
+    next_idle_check = time.time() + poll_interval
+    try:
+      while not self.stopping.is_set():
+        asyncore.loop(timeout=poll_interval, use_poll=True, map=self.map,
+                      count=1)
+        now = time.time()
+        if now >= next_idle_check:
+          self.close_idle(now)
+          next_idle_check = now + poll_interval
+    finally:
+      self.stopped.set()
+
+  def close_idle(self, now):
+    """Closes connections that have been idle for more than idle_timeout.
+    """
+    for channel in self.map.values():
+      if (isinstance(channel, Channel) and
+          channel.is_idle(now, self.idle_timeout)):
+        channel.close()
+
+  def shutdown(self):
+    self.stopping.set()
+    if self.trigger:
+      self.trigger.call_soon(lambda: None)
+    self.stopped.wait()
+
+  def server_close(self):
+    for channel in self.map.values():
+      channel.close()
@@ -0,0 +1,309 @@
+"""Graph API batch request handler.
+
+Based on https://developers.facebook.com/docs/reference/api/batch/ .
+
+Each request in the batch is run through the same WSGI application as a normal
+HTTP request, so it's handled by the usual GraphHandler, FqlHandler, etc.
+Requests that don't depend on each other run concurrently if the SQLite
+connection supports it (see schemautil.ThreadLocalConnection).
+"""
+
+__author__ = ['Ryan Barrett <mockfacebook@ryanb.org>']
+
+import json
+import re
+import threading
+import types
+import urllib
+
+import webapp2
+
+import executor
+import graph
+import schemautil
+
+# http://developers.facebook.com/docs/reference/api/batch/#limits
+MAX_REQUESTS = 50
+
+# matches a JSONPath reference to another request's result, e.g.
+# {result=get-friends:$.data.*.id}
+RESULT_REF_RE = re.compile(r'{result=([^:}]+):([^}]+)}')
+
+
+class MissingBatchError(graph.JsonError):
+  message = '(#100) The parameter batch is required'
+
+class InvalidBatchError(graph.JsonError):
+  message = '(#100) The parameter batch must be a JSON array of requests'
+
+class TooManyRequestsError(graph.JsonError):
+  message = ('(#1) Too many requests in batch message. Maximum batch size is '
+             '%d')
+
+
+def jsonpath(object, path):
+  """Evaluates a simple JSONPath expression.
+
+  Supports child names and array indices in dot or bracket notation and *
+  wildcards, e.g. $.data.0.id, $.data[*].id. Filters and recursive descent
+  aren't supported, just like Facebook.
+
+  Args:
+    object: decoded JSON value
+    path: string
+
+  Returns: list of matching values
+  """
+  parts = re.findall(r'[^.\[\]$]+', path)
+  matches = [object]
+  for part in parts:
+    next = []
+    for match in matches:
+      if isinstance(match, dict):
+        if part == '*':
+          next.extend(match.values())
+        elif part in match:
+          next.append(match[part])
+      elif isinstance(match, list):
+        if part == '*':
+          next.extend(match)
+        elif part.isdigit() and int(part) < len(match):
+          next.append(match[int(part)])
+    matches = next
+  return matches
+
+
+class Operation(object):
+  """A single request in a batch.
+
+  Attributes:
+    method: string HTTP method
+    relative_url: string
+    body: string, urlencoded POST body
+    name: string, or None
+    depends_on: set of string names of other requests that must run first,
+      including any that relative_url or body refer to
+    omit_response_on_success: boolean
+    result: dict, the response to return, or None if the request didn't run
+    decoded: decoded JSON response body, or None if the request failed or
+      hasn't run. only set for named requests.
+  """
+
+  def __init__(self, request):
+    """Args:
+      request: dict from the batch parameter
+
+    Raises: InvalidBatchError
+    """
+    if (not isinstance(request, dict) or
+        not isinstance(request.get('relative_url'), basestring) or
+        not isinstance(request.get('body', ''), basestring) or
+        not isinstance(request.get('name'), (basestring, types.NoneType)) or
+        not isinstance(request.get('depends_on'), (basestring, types.NoneType))):
+      raise InvalidBatchError()
+
+    self.method = str(request.get('method', 'GET')).upper()
+    # URLs and bodies are byte strings
+    self.relative_url = request['relative_url'].encode('utf-8')
+    self.body = request.get('body', '').encode('utf-8')
+    self.name = request.get('name')
+    self.omit_response_on_success = request.get('omit_response_on_success', True)
+    self.result = None
+    self.decoded = None
+
+    self.depends_on = set(name for name, _ in RESULT_REF_RE.findall(
+        self.relative_url + self.body))
+    if request.get('depends_on'):
+      self.depends_on.add(request['depends_on'])
+
+
+class BatchHandler(webapp2.RequestHandler):
+  """The batch request handler.
+
+  Class attributes:
+    conn: sqlite3.Connection or schemautil.ThreadLocalConnection
+    num_threads: integer, the number of threads that run batched requests
+      concurrently. only used with a ThreadLocalConnection, since each thread
+      needs its own SQLite connection. set before calling init().
+    executor: executor.LazyExecutor
+  """
+
+  num_threads = 10
+
+  # only handle POST /. GET / is GraphHandler's front page.
+  ROUTES = [webapp2.Route('/', 'batch.BatchHandler', methods=['POST'])]
+
+  # set in executor threads, so that batches inside batches don't wait on the
+  # executor they're running in
+  local = threading.local()
+
+  @classmethod
+  def init(cls, conn, me=None):
+    # me is unused
+    cls.conn = conn
+    cls.executor = executor.LazyExecutor(cls.num_threads)
+
+  def get_executor(self):
+    """Returns the executor, starting it if necessary, or None if batched
+    requests should run sequentially.
+    """
+    if (not isinstance(self.conn, schemautil.ThreadLocalConnection) or
+        getattr(self.local, 'in_executor', False)):
+      return None
+    return self.executor.get()
+
+  def post(self):
+    self.response.headers['Content-Type'] = 'text/plain; charset=utf-8'
+    try:
+      ops = self.parse_batch()
+    except graph.GraphError, e:
+      self.response.write(e.message)
+      self.response.set_status(e.status)
+      return
+
+    self.run(ops)
+
+    referenced = set().union(*[op.depends_on for op in ops])
+    results = []
+    for op in ops:
+      if (op.result and op.result['code'] == 200 and op.name in referenced and
+          op.omit_response_on_success):
+        results.append(None)
+      else:
+        results.append(op.result)
+    json.dump(results, self.response.out, indent=2)
+
+  def parse_batch(self):
+    """Returns the requests in the batch parameter.
+
+    Returns: list of Operations
+
+    Raises: GraphError
+    """
+    batch = self.request.get('batch')
+    if not batch:
+      raise MissingBatchError()
+
+    try:
+      requests = json.loads(batch)
+    except ValueError:
+      raise InvalidBatchError()
+    if not isinstance(requests, list):
+      raise InvalidBatchError()
+    elif len(requests) > MAX_REQUESTS:
+      raise TooManyRequestsError(MAX_REQUESTS)
+
+    return [Operation(request) for request in requests]
+
+  def run(self, ops):
+    """Runs requests in dependency order, concurrently when possible.
+
+    Each round runs all of the requests whose dependencies have finished.
+    Requests whose dependencies failed, or are missing or circular, don't run.
+
+    Args:
+      ops: list of Operations
+    """
+    self.ops_by_name = dict((op.name, op) for op in ops if op.name)
+    pending = list(ops)
+    done = set()
+
+    while pending:
+      ready = [op for op in pending if op.depends_on <= done]
+      if not ready:
+        break
+      pending = [op for op in pending if op not in ready]
+
+      executor = self.get_executor() if len(ready) > 1 else None
+      if executor:
+        executor.map(self.run_in_executor, [(op,) for op in ready])
+      else:
+        for op in ready:
+          self.run_one(op)
+
+      done.update(op.name for op in ready
+                  if op.name and op.result and op.result['code'] == 200)
+
+  def run_in_executor(self, op):
+    """Runs a request in an executor thread.
+
+    Args:
+      op: Operation
+    """
+    # the executor may be shared, so restore the thread's previous state for
+    # whatever it runs next
+    in_executor = getattr(self.local, 'in_executor', False)
+    self.local.in_executor = True
+    try:
+      self.run_one(op)
+    finally:
+      self.local.in_executor = in_executor
+
+  def run_one(self, op):
+    """Runs a single request through the WSGI application and stores its result.
+
+    Args:
+      op: Operation
+    """
+    try:
+      url = self.resolve(op.relative_url, urllib.quote)
+      body = self.resolve(op.body, urllib.quote_plus)
+    except KeyError:
+      # a reference to a request that failed
+      return
+
+    token = self.request.get('access_token')
+    if op.method == 'POST':
+      if token and 'access_token=' not in body:
+        body += '%saccess_token=%s' % ('&' if body else '', urllib.quote_plus(token))
+    elif token and 'access_token=' not in url:
+      url += '%saccess_token=%s' % ('&' if '?' in url else '?',
+                                    urllib.quote_plus(token))
+
+    request = webapp2.Request.blank('/' + url.lstrip('/'),
+                                    environ={'REQUEST_METHOD': op.method})
+    if op.method == 'POST':
+      request.body = body
+      request.content_type = 'application/x-www-form-urlencoded'
+
+    # self.app is a thread local proxy, which isn't set in executor threads
+    app = self.request.app
+    response = request.get_response(app)
+    if not getattr(self.local, 'in_executor', False):
+      # the nested request cleared this thread's webapp2 globals
+      app.set_globals(app=app, request=self.request)
+    op.result = {
+      'code': response.status_int,
+      'headers': [{'name': name, 'value': value}
+                  for name, value in response.headerlist],
+      'body': response.body,
+      }
+
+    if op.name and response.status_int == 200:
+      try:
+        op.decoded = json.loads(response.body)
+      except ValueError:
+        pass
+
+  def resolve(self, value, quote):
+    """Replaces {result=name:$.path} references with other requests' results.
+
+    Multiple matches are joined with commas, e.g. for ?ids=.
+
+    Args:
+      value: string
+      quote: function that quotes each result for use in value
+
+    Returns: string
+
+    Raises: KeyError if a referenced request didn't return JSON
+    """
+    def replace(match):
+      name, path = match.groups()
+      op = self.ops_by_name.get(name)
+      if op is None or op.decoded is None:
+        raise KeyError(name)
+      return ','.join(quote(unicode(result).encode('utf-8'))
+                      for result in jsonpath(op.decoded, path))
+
+    return RESULT_REF_RE.sub(replace, value)
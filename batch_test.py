@@ -0,0 +1,159 @@
+#!/usr/bin/python
+"""Unit tests for batch.py.
+"""
+
+__author__ = ['Ryan Barrett <mockfacebook@ryanb.org>']
+
+import json
+import unittest
+
+import batch
+import graph
+import graph_test
+import testutil
+
+
+class BatchTest(testutil.HandlerTest):
+
+  def setUp(self):
+    super(BatchTest, self).setUp(graph.GraphHandler, batch.BatchHandler)
+    graph_test.insert_test_data(self.conn)
+
+  def post_batch(self, requests, **args):
+    """Runs a batch request and returns the decoded response.
+    """
+    args['batch'] = json.dumps(requests)
+    resp = self.app.get_response('/', POST=args)
+    self.assertEquals(200, resp.status_int)
+    return json.loads(resp.body)
+
+  def assert_result(self, expected_body, result, code=200):
+    self.assertEquals(code, result['code'])
+    self.assertEquals(expected_body, json.loads(result['body']))
+    self.assertIn({'name': 'Content-Type', 'value': 'text/plain; charset=utf-8'},
+                  result['headers'])
+
+  def test_get(self):
+    results = self.post_batch([{'method': 'GET', 'relative_url': 'alice'},
+                               {'relative_url': '/bob/albums?fields=id'},
+                               {'relative_url': 'foo'}])
+    self.assertEquals(3, len(results))
+    self.assert_result({'id': '1', 'foo': 'bar'}, results[0])
+    self.assert_result({'data': [{'id': '5'}]}, results[1])
+    self.assertEquals(404, results[2]['code'])
+
+  def test_post(self):
+    self.conn.execute("""INSERT INTO graph_objects VALUES('4', null,
+      '{"id": "4", "type": "photo"}')""")
+    self.conn.commit()
+    results = self.post_batch([{'method': 'POST', 'relative_url': '4/likes',
+                                'body': 'foo=bar'},
+                               {'relative_url': '4'}])
+    self.assertEquals('true', results[0]['body'])
+    self.assertEquals(1, len(json.loads(results[1]['body'])['likes']['data']))
+
+  def test_front_page_still_works(self):
+    self.assertEquals(graph.FRONT_PAGE, self.app.get_response('/').body)
+
+  def test_bad_batch(self):
+    for args, error in (({}, batch.MissingBatchError()),
+                        ({'batch': 'foo'}, batch.InvalidBatchError()),
+                        ({'batch': '{}'}, batch.InvalidBatchError()),
+                        ({'batch': '[{"method": "GET"}]'},
+                         batch.InvalidBatchError()),
+                        ({'batch': '[{"relative_url": "alice", "name": 0}]'},
+                         batch.InvalidBatchError()),
+                        ({'batch': '[{"relative_url": "alice", '
+                                   '"depends_on": ["x"]}]'},
+                         batch.InvalidBatchError()),
+                        ({'batch': '[{"relative_url": "alice", '
+                                   '"depends_on": {"x": 1}}]'},
+                         batch.InvalidBatchError()),
+                        ({'batch': json.dumps([{'relative_url': 'alice'}] * 51)},
+                         batch.TooManyRequestsError(50))):
+      resp = self.app.get_response('/', POST=args)
+      self.assertEquals(error.status, resp.status_int)
+      self.assertEquals(error.message, resp.body)
+
+  def test_depends_on_and_jsonpath(self):
+    results = self.post_batch([
+        {'relative_url': 'alice/albums', 'name': 'albums'},
+        {'relative_url': '?ids={result=albums:$.data.*.id}&fields=id'},
+        {'relative_url': '{result=albums:$.data[0].id}'},
+        {'relative_url': 'bob', 'name': 'bob', 'omit_response_on_success': False},
+        {'relative_url': 'alice', 'depends_on': 'bob'},
+        ])
+    self.assertIsNone(results[0])
+    # album 4 doesn't exist
+    self.assertEquals(200, results[1]['code'])
+    self.assertEquals('[\n\n]', results[1]['body'])
+    self.assert_result({'id': '3', 'type': 'page', 'inner': {'foo': 'baz'}},
+                       results[2])
+    self.assert_result({'id': '2', 'inner': {'foo': 'baz'}}, results[3])
+    self.assert_result({'id': '1', 'foo': 'bar'}, results[4])
+
+  def test_failed_dependencies(self):
+    results = self.post_batch([
+        {'relative_url': 'nope', 'name': 'nope'},
+        {'relative_url': 'alice', 'depends_on': 'nope'},
+        {'relative_url': '{result=nope:$.id}'},
+        {'relative_url': 'alice', 'depends_on': 'missing'},
+        {'relative_url': 'alice', 'name': 'a', 'depends_on': 'b'},
+        {'relative_url': 'alice', 'name': 'b', 'depends_on': 'a'},
+        ])
+    self.assertEquals(404, results[0]['code'])
+    self.assertEquals([None] * 5, results[1:])
+
+  def test_access_token(self):
+    results = self.post_batch([{'relative_url': 'alice'},
+                               {'relative_url': 'alice?access_token=x'}],
+                              access_token='bad')
+    for result in results:
+      self.assertEquals(graph.ValidationError().message, result['body'])
+
+  def test_jsonpath(self):
+    obj = {'data': [{'id': 1, 'x': {'y': 2}}, {'id': 3}]}
+    self.assertEquals([1, 3], batch.jsonpath(obj, '$.data.*.id'))
+    self.assertEquals([1, 3], batch.jsonpath(obj, '$.data[*].id'))
+    self.assertEquals([2], batch.jsonpath(obj, '$.data.0.x.y'))
+    self.assertEquals([], batch.jsonpath(obj, '$.data.5.id'))
+    self.assertEquals([obj], batch.jsonpath(obj, '$'))
+
+
+class ConcurrentBatchTest(testutil.ThreadLocalDbTest):
+  """Runs batches with a ThreadLocalConnection, so requests run concurrently.
+  """
+
+  def setUp(self):
+    super(ConcurrentBatchTest, self).setUp(graph.GraphHandler,
+                                           batch.BatchHandler)
+
+  def insert_test_data(self, conn):
+    graph_test.insert_test_data(conn)
+
+  def test_concurrent(self):
+    requests = ([{'relative_url': 'alice'}, {'relative_url': 'bob/albums'}] * 10 +
+                [{'relative_url': 'alice/albums', 'name': 'albums'},
+                 {'relative_url': '{result=albums:$.data.0.id}'}])
+    resp = self.app.get_response('/', POST={'batch': json.dumps(requests)})
+    results = json.loads(resp.body)
+
+    self.assertIsNotNone(batch.BatchHandler.executor.executor)
+    for result in results[:20:2]:
+      self.assertEquals({'id': '1', 'foo': 'bar'}, json.loads(result['body']))
+    for result in results[1:20:2]:
+      self.assertEquals({'data': [{'id': '5'}]}, json.loads(result['body']))
+    self.assertIsNone(results[20])
+    self.assertEquals('3', json.loads(results[21]['body'])['id'])
+
+    # the executor threads are left as they were
+    executor = batch.BatchHandler.executor.get()
+    self.assertEquals(
+      [False] * executor.num_threads,
+      executor.map(lambda: getattr(batch.BatchHandler.local, 'in_executor',
+                                   False),
+                   [()] * executor.num_threads))
+
+
+if __name__ == '__main__':
+  unittest.main()
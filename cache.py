@@ -0,0 +1,103 @@
+"""A bounded, thread safe, least recently used cache.
+"""
+
+__author__ = ['Ryan Barrett <mockfacebook@ryanb.org>']
+
+import collections
+import threading
+
+
+class LruCache(object):
+  """Maps keys to values. Evicts the least recently used entries when full.
+
+  Attributes:
+    max_size: integer, the maximum total size of the entries
+    sizeof: function that takes a value and returns its size. by default,
+      every value has size 1, so max_size is the maximum number of entries.
+    size: integer, the current total size of the entries
+    hits: integer, number of get() calls that found their key
+    misses: integer, number of get() calls that didn't
+    entries: OrderedDict, least recently used first
+    sizes: dict mapping key to the size of its value
+    lock: Lock
+  """
+
+  def __init__(self, max_size, sizeof=None):
+    self.max_size = max_size
+    self.sizeof = sizeof or (lambda value: 1)
+    self.size = 0
+    self.hits = 0
+    self.misses = 0
+    self.entries = collections.OrderedDict()
+    self.sizes = {}
+    self.lock = threading.Lock()
+
+  def get(self, key, default=None, valid=None):
+    """Returns the value for key, or default if it's not in the cache.
+
+    Args:
+      key: the key to look up
+      default: returned if the key isn't found
+      valid: optional function that takes a cached value and returns False if
+        it's stale. stale values count as misses.
+    """
+    with self.lock:
+      value = self.entries.get(key, default)
+      if key not in self.entries or (valid and not valid(value)):
+        self.misses += 1
+        return default
+      del self.entries[key]
+      self.entries[key] = value
+      self.hits += 1
+      return value
+
+  def put(self, key, value):
+    """Adds or replaces a value. Values bigger than max_size aren't cached.
+    """
+    size = self.sizeof(value)
+    with self.lock:
+      self._remove(key)
+      if size > self.max_size:
+        return
+      self.entries[key] = value
+      self.sizes[key] = size
+      self.size += size
+      while self.size > self.max_size:
+        self._remove(next(iter(self.entries)))
+
+  def pop(self, key, default=None):
+    """Removes and returns the value for key, or default if it's not present.
+    """
+    with self.lock:
+      value = self.entries.get(key, default)
+      self._remove(key)
+      return value
+
+  def _remove(self, key):
+    """Removes a key if it's present. The lock must be held.
+    """
+    if key in self.entries:
+      del self.entries[key]
+      self.size -= self.sizes.pop(key)
+
+  def clear(self):
+    with self.lock:
+      self.entries.clear()
+      self.sizes.clear()
+      self.size = 0
+
+  def __len__(self):
+    return len(self.entries)
+
+  def __contains__(self, key):
+    return key in self.entries
+
+  def stats(self):
+    """Returns a dict with the size, hit count, and miss count.
+    """
+    return {'entries': len(self.entries),
+            'size': self.size,
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            }
@@ -0,0 +1,107 @@
+"""A fixed size thread pool.
+
+Used by the HTTP servers and by request handlers that run work concurrently,
+e.g. batch requests and fql.multiquery queries.
+"""
+
+__author__ = ['Ryan Barrett <mockfacebook@ryanb.org>']
+
+import logging
+import os
+import Queue
+import sys
+import threading
+
+
+class Executor(object):
+  """A fixed size pool of threads that runs functions.
+
+  Attributes:
+    num_threads: integer
+    tasks: Queue of (function, args) tuples waiting to be run
+  """
+
+  def __init__(self, num_threads):
+    self.num_threads = num_threads
+    self.tasks = Queue.Queue()
+    for i in range(num_threads):
+      thread = threading.Thread(target=self.run, name='executor %d' % i)
+      thread.daemon = True
+      thread.start()
+
+  def submit(self, fn, *args):
+    self.tasks.put((fn, args))
+
+  def map(self, fn, args_list):
+    """Runs a function concurrently on each of a list of arguments.
+
+    Waits for all of the calls to finish. Must not be called from one of this
+    executor's own threads, since it could wait forever for a free thread.
+
+    Args:
+      fn: function
+      args_list: sequence of argument tuples, one per call
+
+    Returns: list of fn's return values, in the same order as args_list
+
+    Raises: the exception from the first call in args_list that raised one
+    """
+    done = Queue.Queue()
+
+    def call(i, args):
+      try:
+        done.put((i, fn(*args), None))
+      except:
+        done.put((i, None, sys.exc_info()))
+
+    for i, args in enumerate(args_list):
+      self.submit(call, i, args)
+
+    results = [None] * len(args_list)
+    errors = [None] * len(args_list)
+    for _ in args_list:
+      i, results[i], errors[i] = done.get()
+
+    for exc_info in errors:
+      if exc_info:
+        raise exc_info[0], exc_info[1], exc_info[2]
+    return results
+
+  def run(self):
+    """Worker thread loop. Runs forever.
+    """
+    while True:
+      fn, args = self.tasks.get()
+      try:
+        fn(*args)
+      except:
+        logging.exception('Error in executor thread.')
+
+
+class LazyExecutor(object):
+  """Starts an Executor the first time it's needed, once per process.
+
+  Threads don't survive fork, so forked workers (see server.PreforkServer)
+  need their own executor.
+
+  Attributes:
+    num_threads: integer
+    executor: Executor, or None if it hasn't been started
+    pid: integer, the process id that started executor
+    lock: Lock, held while starting the executor
+  """
+
+  def __init__(self, num_threads):
+    self.num_threads = num_threads
+    self.executor = None
+    self.pid = None
+    self.lock = threading.Lock()
+
+  def get(self):
+    """Returns this process's Executor, starting it if necessary.
+    """
+    with self.lock:
+      if self.executor is None or self.pid != os.getpid():
+        self.executor = Executor(self.num_threads)
+        self.pid = os.getpid()
+      return self.executor
@@ -5,17 +5,18 @@ Based on https://developers.facebook.com/docs/reference/fql/ .
 
 __author__ = ['Ryan Barrett <mockfacebook@ryanb.org>']
 
+import collections
 import logging
 import re
 import json
 import sqlite3
 import time
 
-import sqlparse
-from sqlparse import sql
-from sqlparse import tokens
 import webapp2
 
+import cache
+import executor
+import fql_parser
 import oauth
 import schemautil
 
@@ -69,17 +70,54 @@ class InvalidAccessTokenError(FqlError):
   code = 190
   msg = 'Invalid access token signature.'
 
+class InvalidQueriesError(FqlError):
+  code = 100
+  msg = 'The parameter queries must be a JSON object mapping query names to queries.'
+
+class UnknownQueryError(FqlError):
+  code = 601
+  msg = "Parser error: unknown query reference '#%s'."
+
+class CircularQueryError(FqlError):
+  code = 601
+  msg = 'Parser error: circular query references between %s.'
+
+# fql.multiquery query names. they're referred to as #name in other queries.
+QUERY_NAME_RE = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+def normalize(query):
+  """Normalizes an FQL query's whitespace for the translation cache.
+  """
+  return re.sub(' +', ' ', query).replace('\n', '').strip()
+
+
+def _substr(string, start, length):
+  """FQL's substr(). Like PHP's, since FQL came from there.
+
+  start is 0-based. A negative start counts back from the end of the string,
+  and a negative length leaves off that many characters from the end.
+  """
+  if start < 0:
+    start = max(len(string) + start, 0)
+  end = start + length if length >= 0 else len(string) + length
+  return string[start:max(end, start)]
+
 
 class Fql(object):
-  """A parsed FQL statement. Just a thin wrapper around sqlparse.sql.Statement.
+  """A parsed FQL statement. A thin wrapper around fql_parser.Select.
+
+  The SQLite query returned by to_sqlite() has named parameters instead of
+  per-request values, so that the same FQL query always maps to the same SQLite
+  query and sqlite3 can reuse its prepared statement. Pass params() as the
+  parameters when executing it.
 
   Attributes:
     query: original FQL query string
-    me: integer, the user id that me() should return
     schema: schemautil.FqlSchema
-    Statement: sqlparse.sql.Statement
-    table: sql.Token or None
-    where: sql.Where or None
+    statement: fql_parser.Select
+    table: fql_parser.Token or None
+    where: fql_parser.Group or None
   """
 
   # FQL functions. Maps function name to expected number of parameters.
@@ -91,148 +129,268 @@ class Fql(object):
     'strpos': 2,
     }
 
-  def __init__(self, schema, query, me):
+  # FQL functions that are replaced with SQLite named parameters. Maps function
+  # name to parameter name.
+  PARAM_FUNCTIONS = {
+    'me': ':me',
+    'now': ':now',
+    }
+
+  # FQL functions that are implemented as SQLite user-defined functions. Maps
+  # function name to Python implementation. They're registered on each
+  # connection by create_functions() with SQLITE_FUNCTION_PREFIX, so that they
+  # don't replace SQLite's own functions, e.g. its 1-based substr(), for other
+  # queries on the same connection.
+  SQLITE_FUNCTIONS = {
+    'strlen': lambda string: (None if string is None else len(unicode(string))),
+    'substr': lambda string, start, length: (
+      None if None in (string, start, length)
+      else _substr(unicode(string), int(start), int(length))),
+    'strpos': lambda string, sub: (
+      None if None in (string, sub) else unicode(string).find(unicode(sub))),
+    }
+  SQLITE_FUNCTION_PREFIX = 'fql_'
+
+  def __init__(self, schema, query):
     """Args:
       query: FQL statement
-      me: integer, the user id that me() should return
+
+    Raises: UnexpectedError or UnexpectedEndError if the query can't be parsed
     """
     logging.debug('parsing %s' % query)
     self.schema = schema
     self.query = query
-    self.me = me
-    self.statement = stmt = sqlparse.parse(query)[0]
+    try:
+      self.statement = fql_parser.parse(query)
+    except fql_parser.ParseError, e:
+      if e.token:
+        raise UnexpectedError(e.token.value)
+      else:
+        raise UnexpectedEndError()
+
+    self.table = self.statement.table
+    self.where = self.statement.where
+    logging.debug('table %s, where %s' % (self.table, self.where))
 
-    # extract table and WHERE clause, if any
-    self.table = None
-    self.where = None
+  def query_refs(self):
+    """Returns the names of the other queries that this query refers to.
 
-    from_ = stmt.token_next_match(0, tokens.Keyword, 'FROM')
-    if from_:
-      index = stmt.token_index(from_)
-      self.table = stmt.token_next(index)
-      if self.table.is_group():
-        self.table = self.table.token_first()
+    In fql.multiquery, queries can use #name in place of a table name to refer
+    to another query's results.
 
-    self.where = stmt.token_next_by_instance(0, sql.Where)
+    Returns: frozenset of string query names, without the #s
+    """
+    refs = set()
+
+    def find(group):
+      for node in group.children:
+        if isinstance(node, fql_parser.Token):
+          # to_sqlite() quotes table names with backticks
+          name = node.value.strip('`')
+          if node.kind == fql_parser.NAME and name.startswith('#'):
+            refs.add(name[1:])
+        else:
+          find(node)
 
-    logging.debug('table %s, where %s' % (self.table, self.where))
+    find(self.statement)
+    return frozenset(refs)
 
   def table_name(self):
     """Returns the table name, or '' if None.
     """
     if self.table:
-      return self.table.value
+      return self.table.value.strip('`')
     else:
       return ''
 
   def validate(self):
     """Checks the query for Facebook API semantic errors.
 
-    Returns the error response string if there is an error, otherwise None.
+    Raises: FqlError
     """
-    first = self.statement.tokens[0].value
-    if first != 'SELECT':
-      raise UnexpectedError(first)
-    elif self.statement.token_next(1).match(tokens.Wildcard, '*'):
+    keyword = self.statement.keyword
+    if not keyword:
+      raise UnexpectedEndError()
+    elif keyword.value != 'SELECT':
+      raise UnexpectedError(keyword.value)
+    elif (self.statement.items and
+          self.statement.items[0].to_sqlite().strip() == '*'):
       raise WildcardError()
     elif not self.where:
       raise UnexpectedEndError()
     elif not self.table:
       raise UnexpectedError('WHERE')
 
-    def check_indexable(token_list):
+    table = self.table_name()
+    if table not in self.schema.tables:
+      # let SQLite report it
+      return
+
+    def check_indexable(group):
       """Recursive function that checks for non-indexable columns."""
-      for tok in token_list.tokens:
-        if tok.ttype == tokens.Name:
-          col = self.schema.get_column(self.table.value, tok.value)
-          if col and not col.indexable:
-            raise NotIndexableError()
-        elif isinstance(tok, (sql.Comparison, sql.Identifier)):
-          check_indexable(tok)
+      for node in group.children:
+        if isinstance(node, fql_parser.Token):
+          if node.kind == fql_parser.NAME:
+            col = self.schema.get_column(table, node.value)
+            if col and not col.indexable:
+              raise NotIndexableError()
+        elif isinstance(node, fql_parser.Function):
+          for param in node.params:
+            check_indexable(param)
+        elif not isinstance(node, fql_parser.Select):
+          # subselects are on other tables
+          check_indexable(node)
 
     check_indexable(self.where)
 
+  @staticmethod
+  def create_functions(conn):
+    """Registers the FQL functions in SQLITE_FUNCTIONS on a connection.
+
+    Args:
+      conn: sqlite3.Connection
+    """
+    for name, fn in Fql.SQLITE_FUNCTIONS.items():
+      conn.create_function(Fql.SQLITE_FUNCTION_PREFIX + name,
+                           Fql.FUNCTIONS[name], fn)
+
+  @staticmethod
+  def params(me):
+    """Returns the parameters for executing a query from to_sqlite().
+
+    Args:
+      me: the user id that me() should return
+
+    Returns: dict mapping parameter name to value
+    """
+    try:
+      me = int(me)
+    except (TypeError, ValueError):
+      pass
+    return {'me': me, 'now': int(time.time())}
+
   def to_sqlite(self):
     """Converts to a SQLite query.
 
     Specifically:
     - validates
     - processes functions
-    - prefixes table names with underscores
+    - quotes table names with backticks
     """
     self.validate()
-    self.process_functions()
-    self.table.value = '`%s`' % self.table.value
-    return self.statement.to_unicode()
+    self.process(self.statement)
+    return self.statement.to_sqlite()
 
-  def process_functions(self, group=None):
-    """Recursively parse and process FQL functions in the given group token.
+  def process(self, node):
+    """Recursively processes FQL functions and table names.
 
-    TODO: switch to sqlite3.Connection.create_function().
+    Validates function calls and replaces the ones in PARAM_FUNCTIONS. The rest
+    are renamed to their SQLite user-defined functions; see create_functions().
 
-    Currently handles: me(), now()
+    Args:
+      node: fql_parser.Group
     """
-    if group is None:
-      group = self.statement
-
-    for tok in group.tokens:
-      if isinstance(tok, sql.Function):
-        assert isinstance(tok.tokens[0], sql.Identifier)
-        name = tok.tokens[0].tokens[0]
-        if name.value not in Fql.FUNCTIONS:
-          raise InvalidFunctionError(name.value)
-
-        # check number of params
-        #
-        # i wish i could use tok.get_parameters() here, but it doesn't work
-        # with string parameters for some reason. :/
-        assert isinstance(tok.tokens[1], sql.Parenthesis)
-        params = [t for t in tok.tokens[1].flatten()
-                  if t.ttype not in (tokens.Punctuation, tokens.Whitespace)]
-        actual_num = len(params)
-        expected_num = Fql.FUNCTIONS[name.value]
-        if actual_num != expected_num:
-          raise ParamMismatchError(name.value, expected_num, actual_num)
-
-        # handle each function
-        replacement = None
-        if name.value == 'me':
-          replacement = str(self.me)
-        elif name.value == 'now':
-          replacement = str(int(time.time()))
-        elif name.value == 'strlen':
-          # pass through to sqlite's length() function
-          name.value = 'length'
-        elif name.value == 'substr':
-          # the index param is 0-based in FQL but 1-based in sqlite
-          params[1].value = str(int(params[1].value) + 1)
-        elif name.value == 'strpos':
-          # strip quote chars
-          string = params[0].value[1:-1]
-          sub = params[1].value[1:-1]
-          replacement = str(string.find(sub))
-        else:
-          # shouldn't happen
-          assert False, 'unknown function: %s' % name.value
+    if isinstance(node, fql_parser.Select):
+      if node.table and not node.table.value.startswith('`'):
+        node.table.value = '`%s`' % node.table.value
+      for item in node.items:
+        self.process_select_item(item)
+
+    for child in node.children:
+      if isinstance(child, fql_parser.Function):
+        self.process_function(child)
+      elif isinstance(child, fql_parser.Group):
+        self.process(child)
+
+  def process_select_item(self, item):
+    """Names a SELECT list item's result column after its FQL text.
 
-        if replacement is not None:
-          tok.tokens = [sql.Token(tokens.Number, replacement)]
+    SQLite names result columns after their expressions, so without this,
+    items that include function calls would be named after their rewritten
+    SQLite, e.g. :me or fql_strlen(...).
 
-      elif tok.is_group():
-        self.process_functions(tok)
+    Args:
+      item: fql_parser.Group
+    """
+    text = item.to_sqlite().strip()
+    if (not self.has_function(item) or
+        any(tok.is_keyword('AS') for tok in item.tokens()
+            if isinstance(tok, fql_parser.Token))):
+      return
+    item.children.append(fql_parser.Token(
+        fql_parser.OTHER, ' AS "%s"' % text.replace('"', '""')))
+
+  def has_function(self, node):
+    """Returns True if node contains an FQL function call, outside subselects.
+    """
+    for child in node.children:
+      if isinstance(child, fql_parser.Function):
+        return True
+      if (isinstance(child, fql_parser.Group) and
+          not isinstance(child, fql_parser.Select) and
+          self.has_function(child)):
+        return True
+    return False
+
+  def process_function(self, function):
+    """Validates a function call and replaces it if it's in PARAM_FUNCTIONS.
+
+    Args:
+      function: fql_parser.Function
+    """
+    name = function.name.value
+    if name not in Fql.FUNCTIONS:
+      raise InvalidFunctionError(name)
+
+    expected_num = Fql.FUNCTIONS[name]
+    actual_num = len(function.params)
+    if actual_num != expected_num:
+      raise ParamMismatchError(name, expected_num, actual_num)
+
+    if name in Fql.PARAM_FUNCTIONS:
+      function.replacement = Fql.PARAM_FUNCTIONS[name]
+    else:
+      assert name in Fql.SQLITE_FUNCTIONS, 'unknown function: %s' % name
+      function.name.value = Fql.SQLITE_FUNCTION_PREFIX + name
+      for param in function.params:
+        self.process(param)
+
+
+# A cached FQL to SQLite translation. Exactly one of sqlite and error is set.
+#
+# Attributes:
+#   table: string FQL table name, or '' if none. starts with # if it's another
+#     query in an fql.multiquery.
+#   sqlite: string SQLite query
+#   error: FqlError
+#   refs: frozenset of the string names of the other queries that this query
+#     refers to in an fql.multiquery
+Translation = collections.namedtuple('Translation',
+                                     ('table', 'sqlite', 'error', 'refs'))
 
 
 class FqlHandler(webapp2.RequestHandler):
   """The FQL request handler.
 
-  Not thread safe!
+  A new instance handles each request, so per-request state is stored in
+  instance attributes. The class attributes are shared and read only.
 
   Class attributes:
-    conn: sqlite3.Connection
+    conn: sqlite3.Connection or schemautil.ThreadLocalConnection
     me: integer, the user id that me() should return
     schema: schemautil.FqlSchema
+    cache: cache.LruCache mapping normalized FQL query string to Translation
+    cache_size: integer, the maximum number of translations to cache. set
+      before calling init().
+    num_threads: integer, the number of threads that run fql.multiquery
+      queries concurrently. only used with a ThreadLocalConnection, since each
+      thread needs its own SQLite connection. set before calling init().
+    executor: executor.LazyExecutor
   """
 
+  cache_size = 1000
+  num_threads = 4
+
   XML_TEMPLATE = """\
 <?xml version="1.0" encoding="UTF-8"?>
 <fql_query_response xmlns="http://api.facebook.com/1.0/" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" list="true">
@@ -243,8 +401,21 @@ class FqlHandler(webapp2.RequestHandler):
 <error_response xmlns="http://api.facebook.com/1.0/" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:schemaLocation="http://api.facebook.com/1.0/ http://api.facebook.com/1.0/facebook.xsd">
 %s
 </error_response>"""
+  MULTIQUERY_XML_TEMPLATE = """\
+<?xml version="1.0" encoding="UTF-8"?>
+<fql_multiquery_response xmlns="http://api.facebook.com/1.0/" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" list="true">
+%s
+</fql_multiquery_response>"""
+  MULTIQUERY_XML_RESULT_TEMPLATE = """\
+<fql_result>
+<name>%s</name>
+<fql_result_set list="true">
+%s
+</fql_result_set>
+</fql_result>"""
 
   ROUTES = [(r'/method/fql.query/?', 'fql.FqlHandler'),
+            (r'/method/fql.multiquery/?', 'fql.FqlHandler'),
             ('/fql', 'fql.FqlHandler'),
             ]
 
@@ -257,53 +428,62 @@ class FqlHandler(webapp2.RequestHandler):
     cls.conn = conn
     cls.me = me
     cls.schema = schemautil.FqlSchema.read()
+    cls.cache = cache.LruCache(cls.cache_size)
+    cls.executor = executor.LazyExecutor(cls.num_threads)
+    Fql.create_functions(conn)
+
+  def get_executor(self):
+    """Returns the executor, starting it if necessary, or None if multiquery
+    queries should run sequentially.
+    """
+    if not isinstance(self.conn, schemautil.ThreadLocalConnection):
+      return None
+    return self.executor.get()
 
   def get(self):
     table = ''
     graph_endpoint = (self.request.path == '/fql')
+    multiquery = self.request.path.startswith('/method/fql.multiquery')
 
     try:
-      query_arg = 'q' if graph_endpoint else 'query'
-
-      # Multiline, multispace support
-      query = self.request.get(query_arg)
-      query = re.sub(' +', ' ', query).replace('\n', '').strip()
+      query_arg = ('q' if graph_endpoint else 'queries' if multiquery
+                   else 'query')
+      query = self.request.get(query_arg).strip()
 
       if not query:
         raise MissingParamError(query_arg)
 
       token = self.request.get('access_token')
-      if token and not oauth.AccessTokenHandler.is_valid_token(self.conn, token):
-        raise InvalidAccessTokenError()
-
-      # Find current me if not provided
-      if not self.me and token:
-          try:
-              sql = 'SELECT user_id FROM oauth_access_tokens WHERE token="%s";' % token
-
-              cursor = self.conn.execute(sql)
-              self.me = cursor.fetchone()[0]
-          except:
-              pass
-
-      logging.debug('Received FQL query: %s' % query)
-
-      fql = Fql(self.schema, query, self.me)
-      # grab the table name before it gets munged
-      table = fql.table_name()
-      sqlite = fql.to_sqlite()
-      logging.debug('Running SQLite query: %s' % sqlite)
-
-      try:
-        cursor = self.conn.execute(sqlite)
-      except sqlite3.OperationalError, e:
-        logging.debug('SQLite error: %s', e)
-        raise SqliteError(unicode(e))
-
-      results = self.schema.sqlite_to_json(cursor, table)
+      if token:
+        user_id = oauth.BaseHandler.tokens.get_user(token)
+        if user_id is None:
+          raise InvalidAccessTokenError()
+        # Find current me if not provided
+        if not self.me:
+          self.me = user_id
+
+      # the Graph API endpoint takes a multiquery as a JSON object in q
+      if graph_endpoint and query.startswith('{'):
+        multiquery = True
+
+      if multiquery:
+        logging.debug('Received FQL multiquery: %s' % query)
+        results = self.run_multiquery(query)
+      else:
+        # Multiline, multispace support
+        query = normalize(query)
+        logging.debug('Received FQL query: %s' % query)
+
+        translation = self.translate(query)
+        table = translation.table
+        if translation.error:
+          raise translation.error
+        colnames, rows = self.execute(translation, {})
+        results = self.schema.rows_to_json(colnames, rows, table)
 
     except FqlError, e:
-      results = self.error(self.request.GET, e.code, e.msg)
+      results = self.error(self.request.GET, e.code, e.msg,
+                           'fql.multiquery' if multiquery else 'fql.query')
 
     # Encapsulate results in a data keyword
     if graph_endpoint:
@@ -311,11 +491,139 @@ class FqlHandler(webapp2.RequestHandler):
 
     if self.request.get('format') == 'json' or graph_endpoint:
       json.dump(results, self.response.out, indent=2)
+    elif multiquery and 'error_code' not in results:
+      self.response.out.write(self.render_multiquery_xml(results))
     else:
       self.response.out.write(self.render_xml(results, table))
 
     self.response.headers['Content-Type'] = 'text/plain; charset=utf-8'
 
+  def execute(self, translation, refs):
+    """Runs a translated query.
+
+    The results of the other queries it refers to are loaded into temporary
+    tables named #name, which only this connection can see, instead of being
+    inlined into the query. They're dropped afterward.
+
+    Args:
+      translation: Translation
+      refs: dict mapping query name to (colnames, rows) results, for the
+        queries in translation.refs
+
+    Returns: (list of string column names, list of row tuples)
+
+    Raises: SqliteError
+    """
+    logging.debug('Running SQLite query: %s' % translation.sqlite)
+    conn = self.conn
+    if isinstance(conn, schemautil.ThreadLocalConnection):
+      # make sure the temp tables and the query use the same connection
+      conn = conn.get()
+
+    try:
+      for name, (colnames, rows) in refs.items():
+        table = '`#%s`' % name
+        conn.execute('CREATE TEMP TABLE %s (%s)' % (
+            table, ', '.join('"%s"' % col.replace('"', '""') for col in colnames)))
+        conn.executemany('INSERT INTO %s VALUES (%s)' %
+                         (table, ', '.join('?' * len(colnames))), rows)
+      cursor = conn.execute(translation.sqlite, Fql.params(self.me))
+      return [d[0] for d in cursor.description], cursor.fetchall()
+    except sqlite3.OperationalError, e:
+      logging.debug('SQLite error: %s', e)
+      raise SqliteError(unicode(e))
+    finally:
+      for name in refs:
+        conn.execute('DROP TABLE IF EXISTS temp.`#%s`' % name)
+
+  def run_multiquery(self, queries):
+    """Runs an fql.multiquery.
+
+    Queries run in rounds. Each round runs the queries whose references have
+    all finished, concurrently if possible, on separate connections.
+
+    Args:
+      queries: string, JSON object mapping query name to FQL query
+
+    Returns: list of {'name': ..., 'fql_result_set': [...]} dicts, in the same
+      order as queries. Also sets self.multiquery_tables to a dict mapping query
+      name to the table its results come from.
+
+    Raises: FqlError
+    """
+    try:
+      queries = json.loads(queries, object_pairs_hook=collections.OrderedDict)
+    except ValueError:
+      raise InvalidQueriesError()
+    if (not isinstance(queries, dict) or not queries or
+        not all(QUERY_NAME_RE.match(name) and isinstance(query, basestring)
+                for name, query in queries.items())):
+      raise InvalidQueriesError()
+
+    translations = collections.OrderedDict()
+    for name, query in queries.items():
+      translation = self.translate(normalize(query))
+      if translation.error:
+        raise translation.error
+      for ref in translation.refs:
+        if ref not in queries:
+          raise UnknownQueryError(ref)
+      translations[name] = translation
+
+    results = {}
+    pending = translations.keys()
+    while pending:
+      ready = [name for name in pending
+               if translations[name].refs.issubset(results)]
+      if not ready:
+        raise CircularQueryError(', '.join('#' + name for name in pending))
+      pending = [name for name in pending if name not in ready]
+
+      args = [(translations[name],
+               dict((ref, results[ref]) for ref in translations[name].refs))
+              for name in ready]
+      executor = self.get_executor() if len(ready) > 1 else None
+      if executor:
+        round_results = executor.map(self.execute, args)
+      else:
+        round_results = [self.execute(*arg) for arg in args]
+      results.update(zip(ready, round_results))
+
+    def result_table(name):
+      # queries on other queries' results use those queries' tables' columns
+      table = translations[name].table
+      return result_table(table[1:]) if table.startswith('#') else table
+
+    self.multiquery_tables = dict((name, result_table(name))
+                                  for name in translations)
+    return [{'name': name,
+             'fql_result_set': self.schema.rows_to_json(
+               results[name][0], results[name][1], self.multiquery_tables[name])}
+            for name in translations]
+
+  def translate(self, query):
+    """Translates an FQL query to SQLite, using the cache if possible.
+
+    Args:
+      query: normalized FQL query string
+
+    Returns: Translation
+    """
+    translation = self.cache.get(query)
+    if translation:
+      return translation
+
+    table = ''
+    try:
+      fql = Fql(self.schema, query)
+      table = fql.table_name()
+      translation = Translation(table, fql.to_sqlite(), None, fql.query_refs())
+    except FqlError, e:
+      translation = Translation(table, None, e, frozenset())
+
+    self.cache.put(query, translation)
+    return translation
+
   def render_xml(self, results, table):
     """Renders a query result into an XML string response.
 
@@ -332,6 +640,20 @@ class FqlHandler(webapp2.RequestHandler):
 
     return template % self.render_xml_part(results)
 
+  def render_multiquery_xml(self, results):
+    """Renders an fql.multiquery result into an XML string response.
+
+    Args:
+      results: list of dicts from run_multiquery()
+    """
+    parts = []
+    for result in results:
+      table = self.multiquery_tables[result['name']]
+      rows = self.render_xml_part([{table: row}
+                                   for row in result['fql_result_set']])
+      parts.append(self.MULTIQUERY_XML_RESULT_TEMPLATE % (result['name'], rows))
+    return self.MULTIQUERY_XML_TEMPLATE % '\n'.join(parts)
+
   def render_xml_part(self, results):
     """Recursively renders part of a query result into an XML string response.
 
@@ -353,17 +675,18 @@ class FqlHandler(webapp2.RequestHandler):
     else:
       return unicode(results)
 
-  def error(self, args, code, msg):
+  def error(self, args, code, msg, method='fql.query'):
     """Renders an error response.
 
     Args:
       args: dict, the parsed URL query string arguments
       code: integer, the error_code
       msg: string, the error_msg
+      method: string, the API method name
 
     Returns: the response string
     """
-    args['method'] = 'fql.query'  # (always)
+    args['method'] = method
     request_args = [{'key': key, 'value': val} for key, val in args.items()]
     return {'error_code': code,
             'error_msg': msg,
@@ -0,0 +1,351 @@
+"""A small tokenizer and parser for FQL.
+
+FQL is a small dialect of SQL: a single SELECT with FROM, WHERE, subselects,
+IN, function calls, ORDER BY, and LIMIT. In fql.multiquery, queries can also
+refer to other queries' results with #name table names. This parses it into a
+shallow AST that fql.Fql validates and rewrites into SQLite.
+
+The AST keeps every token from the query, including whitespace, so rendering an
+unmodified tree with to_sqlite() returns the original query exactly. Rewrites
+only change the nodes they touch, which keeps result column names (which
+SQLite takes from the query text) the same as in the FQL query.
+
+Anything the parser doesn't understand structurally is kept as plain tokens and
+passed through to SQLite, which reports its own errors.
+"""
+
+__author__ = ['Ryan Barrett <mockfacebook@ryanb.org>']
+
+import re
+
+
+# token kinds
+WHITESPACE = 'whitespace'
+STRING = 'string'
+NUMBER = 'number'
+NAME = 'name'
+OPERATOR = 'operator'
+PUNCTUATION = 'punctuation'
+OTHER = 'other'
+
+TOKEN_RE = re.compile(r"""
+  (?P<whitespace>\s+) |
+  (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*') |
+  (?P<number>\d+(?:\.\d*)?) |
+  (?P<name>\#?[A-Za-z_][A-Za-z0-9_]*|`[^`]*`) |
+  (?P<operator><>|!=|<=|>=|==|\|\||[=<>+\-*/%.]) |
+  (?P<punctuation>[(),]) |
+  (?P<unterminated>["'`]) |
+  (?P<other>.)
+  """, re.VERBOSE | re.DOTALL)
+
+# names that start a top level clause in a SELECT statement
+CLAUSE_KEYWORDS = frozenset(('SELECT', 'FROM', 'WHERE', 'ORDER', 'LIMIT',
+                             'OFFSET'))
+
+# names that are never function names, even when followed by (
+KEYWORDS = CLAUSE_KEYWORDS | frozenset((
+    'AND', 'AS', 'ASC', 'BETWEEN', 'BY', 'DESC', 'ESCAPE', 'GLOB', 'IN', 'IS',
+    'LIKE', 'NOT', 'NULL', 'OR'))
+
+
+class ParseError(Exception):
+  """Raised when a query can't be parsed.
+
+  Attributes:
+    token: the unexpected Token, or None if the query ended unexpectedly
+  """
+  def __init__(self, token=None):
+    Exception.__init__(self, token.value if token else 'unexpected end')
+    self.token = token
+
+
+class Token(object):
+  """A single token.
+
+  Attributes:
+    kind: one of the token kind constants above
+    value: string
+  """
+  __slots__ = ('kind', 'value')
+
+  def __init__(self, kind, value):
+    self.kind = kind
+    self.value = value
+
+  def is_keyword(self, *keywords):
+    """Returns True if this is a name that matches one of the given keywords,
+    case insensitively.
+    """
+    return self.kind == NAME and self.value.upper() in keywords
+
+  def to_sqlite(self):
+    return self.value
+
+  def __repr__(self):
+    return 'Token(%s, %r)' % (self.kind, self.value)
+
+
+class Group(object):
+  """A sequence of Tokens and other nodes.
+
+  Attributes:
+    children: list of Tokens and Groups
+  """
+
+  def __init__(self, children=None):
+    self.children = children if children is not None else []
+
+  def tokens(self):
+    """Returns the child Tokens and Groups that aren't whitespace.
+    """
+    return [child for child in self.children
+            if not (isinstance(child, Token) and child.kind == WHITESPACE)]
+
+  def is_empty(self):
+    return not self.tokens()
+
+  def to_sqlite(self):
+    return ''.join(child.to_sqlite() for child in self.children)
+
+  def __repr__(self):
+    return '%s(%r)' % (self.__class__.__name__, self.to_sqlite())
+
+
+class Parens(Group):
+  """A parenthesized expression, list, or subselect.
+
+  The first and last children are the ( and ) tokens.
+  """
+  def inner(self):
+    """Returns the non-whitespace children between the parentheses.
+    """
+    return self.tokens()[1:-1]
+
+
+class Function(Group):
+  """A function call.
+
+  Attributes:
+    name: Token
+    params: list of Groups, one per parameter
+    replacement: string, if set, rendered in place of the whole call
+  """
+
+  def __init__(self, name, children, params):
+    super(Function, self).__init__(children)
+    self.name = name
+    self.params = params
+    self.replacement = None
+
+  def to_sqlite(self):
+    if self.replacement is not None:
+      return self.replacement
+    return super(Function, self).to_sqlite()
+
+
+class Select(Group):
+  """A SELECT statement or subselect.
+
+  The children alternate between clause keyword Tokens and the Groups that hold
+  each clause's contents, e.g. [SELECT, Group, FROM, Group, WHERE, Group].
+
+  Attributes:
+    keyword: the first Token, usually SELECT, or None if the query is empty
+    items: list of Groups, one per item in the SELECT list
+    table: the table name Token, or None
+    where: Group with the WHERE clause's contents, not including WHERE, or None
+  """
+
+  def __init__(self, children):
+    super(Select, self).__init__(children)
+    self.keyword = None
+    self.items = []
+    self.table = None
+    self.where = None
+
+
+def tokenize(query):
+  """Splits a query into Tokens.
+
+  Args:
+    query: string
+
+  Returns: list of Tokens
+
+  Raises: ParseError if a string or quoted name isn't terminated
+  """
+  tokens = []
+  for match in TOKEN_RE.finditer(query):
+    kind = match.lastgroup
+    if kind == 'unterminated':
+      raise ParseError()
+    tokens.append(Token(kind, match.group()))
+  return tokens
+
+
+def parse(query):
+  """Parses an FQL query.
+
+  Args:
+    query: string
+
+  Returns: Select
+
+  Raises: ParseError if the parentheses aren't balanced or a string isn't
+    terminated
+  """
+  tokens = tokenize(query)
+  children, end = _parse_expression(tokens, 0)
+  if end < len(tokens):
+    # only an unmatched ) stops _parse_expression() early
+    raise ParseError(tokens[end])
+  return _make_select(children)
+
+
+def _parse_expression(tokens, start):
+  """Groups function calls and parenthesized expressions.
+
+  Args:
+    tokens: list of Tokens
+    start: integer index into tokens
+
+  Returns: (list of Tokens and Groups, integer index of the first token not
+    consumed), which is either the end of tokens or an unmatched )
+  """
+  children = []
+  i = start
+  while i < len(tokens):
+    tok = tokens[i]
+    if tok.value == ')':
+      break
+    elif tok.value == '(':
+      parens, i = _parse_parens(tokens, i)
+      prev = _last_token(children)
+      if (isinstance(prev, Token) and prev.kind == NAME and
+          not prev.is_keyword(*KEYWORDS)):
+        # function call. include any whitespace between the name and the (.
+        name_index = len(children) - 1 - children[::-1].index(prev)
+        call = children[name_index:] + [parens]
+        params = _split_params(parens)
+        children[name_index:] = [Function(prev, call, params)]
+      else:
+        children.append(parens)
+    else:
+      children.append(tok)
+      i += 1
+  return children, i
+
+
+def _parse_parens(tokens, start):
+  """Parses a parenthesized group. tokens[start] must be (.
+
+  Returns: (Parens, integer index of the first token after the closing ))
+  """
+  inner, end = _parse_expression(tokens, start + 1)
+  if end >= len(tokens):
+    raise ParseError()
+
+  first = _first_token(inner)
+  if isinstance(first, Token) and first.is_keyword('SELECT'):
+    inner = [_make_select(inner)]
+  return Parens([tokens[start]] + inner + [tokens[end]]), end + 1
+
+
+def _split_params(parens):
+  """Splits a function call's parenthesized arguments on top level commas.
+
+  Replaces the children of parens with one Group per parameter, separated by
+  the comma tokens.
+
+  Returns: list of Groups
+  """
+  open, inner, close = (parens.children[0], parens.children[1:-1],
+                        parens.children[-1])
+  params = [Group()]
+  children = [open, params[0]]
+  for child in inner:
+    if isinstance(child, Token) and child.value == ',':
+      params.append(Group())
+      children += [child, params[-1]]
+    else:
+      params[-1].children.append(child)
+  parens.children = children + [close]
+
+  if len(params) == 1 and params[0].is_empty():
+    return []
+  return params
+
+
+def _make_select(children):
+  """Splits a statement's top level nodes into clauses.
+
+  Args:
+    children: list of Tokens and Groups
+
+  Returns: Select
+  """
+  select = Select([])
+  clause = None
+  group = None
+  for child in children:
+    if group is None:
+      # before the first clause. the first token should be SELECT.
+      if isinstance(child, Token) and child.kind == WHITESPACE:
+        select.children.append(child)
+        continue
+      group = Group()
+      if isinstance(child, Token):
+        select.keyword = child
+        clause = child.value.upper()
+        select.children += [child, group]
+        continue
+      select.children.append(group)
+
+    if isinstance(child, Token) and child.is_keyword(*CLAUSE_KEYWORDS):
+      # note that ORDER's BY goes into ORDER's group
+      clause = child.value.upper()
+      group = Group()
+      select.children += [child, group]
+      if clause == 'WHERE' and select.where is None:
+        select.where = group
+    else:
+      group.children.append(child)
+      if (clause == 'FROM' and select.table is None and
+          isinstance(child, Token) and child.kind == NAME):
+        select.table = child
+
+  if select.keyword and select.keyword.is_keyword('SELECT'):
+    select.items = _split_items(select.children[select.children.index(
+          select.keyword) + 1])
+  return select
+
+
+def _split_items(group):
+  """Splits the SELECT list into items on top level commas, in place.
+
+  Args:
+    group: Group, the contents of the SELECT clause
+
+  Returns: list of Groups
+  """
+  items = [Group()]
+  children = [items[0]]
+  for child in group.children:
+    if isinstance(child, Token) and child.value == ',':
+      items.append(Group())
+      children += [child, items[-1]]
+    else:
+      items[-1].children.append(child)
+  group.children = children
+  return [item for item in items if not item.is_empty()]
+
+
+def _first_token(children):
+  for child in children:
+    if not (isinstance(child, Token) and child.kind == WHITESPACE):
+      return child
+
+
+def _last_token(children):
+  return _first_token(reversed(children))
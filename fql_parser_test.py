@@ -0,0 +1,86 @@
+#!/usr/bin/python
+"""Unit tests for fql_parser.py.
+"""
+
+__author__ = ['Ryan Barrett <mockfacebook@ryanb.org>']
+
+import unittest
+
+import fql_parser
+
+
+class FqlParserTest(unittest.TestCase):
+
+  def test_tokenize(self):
+    self.assertEquals(
+      [('name', 'SELECT'), ('whitespace', ' '), ('name', 'x'),
+       ('operator', '<>'), ('string', '"a \\" b"'), ('punctuation', ','),
+       ('number', '1.5')],
+      [(tok.kind, tok.value) for tok in
+       fql_parser.tokenize('SELECT x<>"a \\" b",1.5')])
+
+  def test_tokenize_query_reference(self):
+    self.assertEquals(
+      [('name', 'FROM'), ('whitespace', ' '), ('name', '#query_1'),
+       ('other', '#'), ('number', '2')],
+      [(tok.kind, tok.value) for tok in fql_parser.tokenize('FROM #query_1#2')])
+
+  def test_tokenize_unterminated_string(self):
+    self.assertRaises(fql_parser.ParseError, fql_parser.tokenize, 'x = "foo')
+
+  def test_round_trip(self):
+    for query in ('SELECT a, b FROM t WHERE a = 1',
+                  ' SELECT  strlen( "x" ),me()FROM t WHERE a IN (SELECT b FROM u)',
+                  'SELECT a FROM t WHERE (a = 1 OR b = 2) ORDER BY a DESC LIMIT 5',
+                  'INSERT foo',
+                  ''):
+      self.assertEquals(query, fql_parser.parse(query).to_sqlite())
+
+  def test_clauses(self):
+    select = fql_parser.parse(
+      'SELECT a, f(b, c) FROM `comment` WHERE a = 1 ORDER BY a LIMIT 2')
+    self.assertEquals('SELECT', select.keyword.value)
+    self.assertEquals(['a', 'f(b, c)'],
+                      [item.to_sqlite().strip() for item in select.items])
+    self.assertEquals('`comment`', select.table.value)
+    self.assertEquals('a = 1', select.where.to_sqlite().strip())
+
+  def test_functions(self):
+    select = fql_parser.parse('SELECT f(), g(1, h(2, 3)), x IN (4) FROM t')
+    f, g = [item.tokens()[0] for item in select.items[:2]]
+    self.assertEquals('f', f.name.value)
+    self.assertEquals([], f.params)
+    self.assertEquals(['1', 'h(2, 3)'],
+                      [param.to_sqlite().strip() for param in g.params])
+    self.assertEquals(2, len(g.params[1].tokens()[0].params))
+
+    # IN isn't a function
+    x_in = select.items[2].tokens()
+    self.assertFalse(isinstance(x_in[1], fql_parser.Function))
+    self.assertTrue(isinstance(x_in[2], fql_parser.Parens))
+
+  def test_subselect(self):
+    select = fql_parser.parse('SELECT a FROM t WHERE a IN (SELECT b FROM u)')
+    parens = select.where.tokens()[2]
+    subselect = parens.inner()[0]
+    self.assertTrue(isinstance(subselect, fql_parser.Select))
+    self.assertEquals('u', subselect.table.value)
+    self.assertEquals(None, subselect.where)
+
+  def test_unbalanced_parens(self):
+    for query in ('SELECT f(', 'SELECT (a', 'SELECT a FROM t WHERE (a IN (1)'):
+      try:
+        fql_parser.parse(query)
+        self.fail()
+      except fql_parser.ParseError, e:
+        self.assertEquals(None, e.token)
+
+    try:
+      fql_parser.parse('SELECT a) FROM t')
+      self.fail()
+    except fql_parser.ParseError, e:
+      self.assertEquals(')', e.token.value)
+
+
+if __name__ == '__main__':
+  unittest.main()
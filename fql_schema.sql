@@ -1,6 +1,6 @@
 -- Do not edit! Generated automatically by mockfacebook.
--- http://code.google.com/p/mockfacebook/
--- 2011-11-08 16:25:41.357079
+-- https://github.com/rogerhu/mockfacebook
+-- 2026-10-16 20:35:35.396054
 
 
 CREATE TABLE IF NOT EXISTS `album` (
@@ -23,8 +23,11 @@ CREATE TABLE IF NOT EXISTS `album` (
   can_upload INTEGER,
   photo_count INTEGER,
   video_count INTEGER,
-  UNIQUE (aid, object_id, owner, cover_pid, cover_object_id, name, created, modified, description, location, size, link, visible, modified_major, edit_link, type, can_upload, photo_count, video_count)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `album_aid_index` ON `album` (aid);
+CREATE INDEX IF NOT EXISTS `album_object_id_index` ON `album` (object_id);
+CREATE INDEX IF NOT EXISTS `album_owner_index` ON `album` (owner);
 
 CREATE TABLE IF NOT EXISTS `application` (
   app_id TEXT,
@@ -43,8 +46,11 @@ CREATE TABLE IF NOT EXISTS `application` (
   subcategory TEXT,
   is_facebook_app INTEGER,
   restriction_info ,
-  UNIQUE (app_id, api_key, canvas_name, display_name, icon_url, logo_url, company_name, developers, description, daily_active_users, weekly_active_users, monthly_active_users, category, subcategory, is_facebook_app, restriction_info)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `application_app_id_index` ON `application` (app_id);
+CREATE INDEX IF NOT EXISTS `application_api_key_index` ON `application` (api_key);
+CREATE INDEX IF NOT EXISTS `application_canvas_name_index` ON `application` (canvas_name);
 
 CREATE TABLE IF NOT EXISTS `apprequest` (
   request_id TEXT,
@@ -54,8 +60,11 @@ CREATE TABLE IF NOT EXISTS `apprequest` (
   message TEXT,
   data TEXT,
   created_time INTEGER,
-  UNIQUE (request_id, app_id, recipient_uid, sender_uid, message, data, created_time)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `apprequest_request_id_index` ON `apprequest` (request_id);
+CREATE INDEX IF NOT EXISTS `apprequest_app_id_index` ON `apprequest` (app_id);
+CREATE INDEX IF NOT EXISTS `apprequest_recipient_uid_index` ON `apprequest` (recipient_uid);
 
 CREATE TABLE IF NOT EXISTS `checkin` (
   checkin_id INTEGER,
@@ -67,8 +76,11 @@ CREATE TABLE IF NOT EXISTS `checkin` (
   timestamp INTEGER,
   tagged_uids ,
   message TEXT,
-  UNIQUE (checkin_id, author_uid, page_id, app_id, post_id, coords, timestamp, tagged_uids, message)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `checkin_checkin_id_index` ON `checkin` (checkin_id);
+CREATE INDEX IF NOT EXISTS `checkin_author_uid_index` ON `checkin` (author_uid);
+CREATE INDEX IF NOT EXISTS `checkin_page_id_index` ON `checkin` (page_id);
 
 CREATE TABLE IF NOT EXISTS `comment` (
   xid TEXT,
@@ -86,24 +98,30 @@ CREATE TABLE IF NOT EXISTS `comment` (
   comments ,
   user_likes INTEGER,
   is_private INTEGER,
-  UNIQUE (xid, object_id, post_id, fromid, time, text, id, username, reply_xid, post_fbid, app_id, likes, comments, user_likes, is_private)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `comment_xid_index` ON `comment` (xid);
+CREATE INDEX IF NOT EXISTS `comment_object_id_index` ON `comment` (object_id);
+CREATE INDEX IF NOT EXISTS `comment_post_id_index` ON `comment` (post_id);
 
 CREATE TABLE IF NOT EXISTS `comments_info` (
   app_id TEXT,
   xid TEXT,
   count INTEGER,
   updated_time INTEGER,
-  UNIQUE (app_id, xid, count, updated_time)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `comments_info_app_id_index` ON `comments_info` (app_id);
 
 CREATE TABLE IF NOT EXISTS `connection` (
   source_id INTEGER,
   target_id INTEGER,
   target_type TEXT,
   is_following INTEGER,
-  UNIQUE (source_id, target_id, target_type, is_following)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `connection_source_id_index` ON `connection` (source_id);
+CREATE INDEX IF NOT EXISTS `connection_target_id_index` ON `connection` (target_id);
 
 CREATE TABLE IF NOT EXISTS `cookies` (
   uid TEXT,
@@ -111,26 +129,32 @@ CREATE TABLE IF NOT EXISTS `cookies` (
   value TEXT,
   expires INTEGER,
   path TEXT,
-  UNIQUE (uid, name, value, expires, path)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `cookies_uid_index` ON `cookies` (uid);
 
 CREATE TABLE IF NOT EXISTS `developer` (
   developer_id TEXT,
   application_id TEXT,
-  UNIQUE (developer_id, application_id)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `developer_developer_id_index` ON `developer` (developer_id);
 
 CREATE TABLE IF NOT EXISTS `domain` (
   domain_id INTEGER,
   domain_name TEXT,
-  UNIQUE (domain_id, domain_name)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `domain_domain_id_index` ON `domain` (domain_id);
+CREATE INDEX IF NOT EXISTS `domain_domain_name_index` ON `domain` (domain_name);
 
 CREATE TABLE IF NOT EXISTS `domain_admin` (
   owner_id TEXT,
   domain_id TEXT,
-  UNIQUE (owner_id, domain_id)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `domain_admin_owner_id_index` ON `domain_admin` (owner_id);
+CREATE INDEX IF NOT EXISTS `domain_admin_domain_id_index` ON `domain_admin` (domain_id);
 
 CREATE TABLE IF NOT EXISTS `event` (
   eid INTEGER,
@@ -154,16 +178,19 @@ CREATE TABLE IF NOT EXISTS `event` (
   privacy TEXT,
   hide_guest_list INTEGER,
   can_invite_friends INTEGER,
-  UNIQUE (eid, name, tagline, nid, pic_small, pic_big, pic_square, pic, host, description, event_type, event_subtype, start_time, end_time, creator, update_time, location, venue, privacy, hide_guest_list, can_invite_friends)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `event_eid_index` ON `event` (eid);
 
 CREATE TABLE IF NOT EXISTS `event_member` (
   uid TEXT,
   eid TEXT,
   rsvp_status TEXT,
   start_time INTEGER,
-  UNIQUE (uid, eid, rsvp_status, start_time)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `event_member_uid_eid_index` ON `event_member` (uid, eid);
+CREATE INDEX IF NOT EXISTS `event_member_eid_index` ON `event_member` (eid);
 
 CREATE TABLE IF NOT EXISTS `family` (
   profile_id TEXT,
@@ -171,14 +198,17 @@ CREATE TABLE IF NOT EXISTS `family` (
   name TEXT,
   birthday TEXT,
   relationship TEXT,
-  UNIQUE (profile_id, uid, name, birthday, relationship)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `family_profile_id_index` ON `family` (profile_id);
 
 CREATE TABLE IF NOT EXISTS `friend` (
   uid1 TEXT,
   uid2 TEXT,
-  UNIQUE (uid1, uid2)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `friend_uid1_uid2_index` ON `friend` (uid1, uid2);
+CREATE INDEX IF NOT EXISTS `friend_uid2_index` ON `friend` (uid2);
 
 CREATE TABLE IF NOT EXISTS `friend_request` (
   uid_to TEXT,
@@ -186,21 +216,27 @@ CREATE TABLE IF NOT EXISTS `friend_request` (
   time INTEGER,
   message TEXT,
   unread INTEGER,
-  UNIQUE (uid_to, uid_from, time, message, unread)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `friend_request_uid_to_index` ON `friend_request` (uid_to);
+CREATE INDEX IF NOT EXISTS `friend_request_uid_from_index` ON `friend_request` (uid_from);
 
 CREATE TABLE IF NOT EXISTS `friendlist` (
   owner INTEGER,
   flid TEXT,
   name TEXT,
-  UNIQUE (owner, flid, name)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `friendlist_owner_index` ON `friendlist` (owner);
+CREATE INDEX IF NOT EXISTS `friendlist_flid_index` ON `friendlist` (flid);
 
 CREATE TABLE IF NOT EXISTS `friendlist_member` (
   flid TEXT,
   uid INTEGER,
-  UNIQUE (flid, uid)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `friendlist_member_flid_uid_index` ON `friendlist_member` (flid, uid);
+CREATE INDEX IF NOT EXISTS `friendlist_member_uid_index` ON `friendlist_member` (uid);
 
 CREATE TABLE IF NOT EXISTS `group` (
   gid INTEGER,
@@ -224,8 +260,9 @@ CREATE TABLE IF NOT EXISTS `group` (
   icon68 TEXT,
   email TEXT,
   version INTEGER,
-  UNIQUE (gid, name, nid, pic_small, pic_big, pic, description, group_type, group_subtype, recent_news, creator, update_time, office, website, venue, privacy, icon, icon34, icon68, email, version)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `group_gid_index` ON `group` (gid);
 
 CREATE TABLE IF NOT EXISTS `group_member` (
   uid TEXT,
@@ -234,16 +271,21 @@ CREATE TABLE IF NOT EXISTS `group_member` (
   positions ,
   unread INTEGER,
   bookmark_order INTEGER,
-  UNIQUE (uid, gid, administrator, positions, unread, bookmark_order)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `group_member_uid_gid_index` ON `group_member` (uid, gid);
+CREATE INDEX IF NOT EXISTS `group_member_gid_index` ON `group_member` (gid);
 
 CREATE TABLE IF NOT EXISTS `like` (
   object_id INTEGER,
   post_id TEXT,
   user_id INTEGER,
   object_type TEXT,
-  UNIQUE (object_id, post_id, user_id, object_type)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `like_object_id_index` ON `like` (object_id);
+CREATE INDEX IF NOT EXISTS `like_post_id_index` ON `like` (post_id);
+CREATE INDEX IF NOT EXISTS `like_user_id_index` ON `like` (user_id);
 
 CREATE TABLE IF NOT EXISTS `link` (
   link_id INTEGER,
@@ -255,8 +297,10 @@ CREATE TABLE IF NOT EXISTS `link` (
   url TEXT,
   picture TEXT,
   image_urls ,
-  UNIQUE (link_id, owner, owner_comment, created_time, title, summary, url, picture, image_urls)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `link_link_id_index` ON `link` (link_id);
+CREATE INDEX IF NOT EXISTS `link_owner_index` ON `link` (owner);
 
 CREATE TABLE IF NOT EXISTS `link_stat` (
   url TEXT,
@@ -268,8 +312,9 @@ CREATE TABLE IF NOT EXISTS `link_stat` (
   click_count INTEGER,
   comments_fbid INTEGER,
   commentsbox_count INTEGER,
-  UNIQUE (url, normalized_url, share_count, like_count, comment_count, total_count, click_count, comments_fbid, commentsbox_count)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `link_stat_url_index` ON `link_stat` (url);
 
 CREATE TABLE IF NOT EXISTS `mailbox_folder` (
   folder_id TEXT,
@@ -277,8 +322,10 @@ CREATE TABLE IF NOT EXISTS `mailbox_folder` (
   name TEXT,
   unread_count INTEGER,
   total_count INTEGER,
-  UNIQUE (folder_id, viewer_id, name, unread_count, total_count)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `mailbox_folder_folder_id_index` ON `mailbox_folder` (folder_id);
+CREATE INDEX IF NOT EXISTS `mailbox_folder_viewer_id_index` ON `mailbox_folder` (viewer_id);
 
 CREATE TABLE IF NOT EXISTS `message` (
   message_id TEXT,
@@ -288,8 +335,10 @@ CREATE TABLE IF NOT EXISTS `message` (
   created_time INTEGER,
   attachment ,
   viewer_id TEXT,
-  UNIQUE (message_id, thread_id, author_id, body, created_time, attachment, viewer_id)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `message_message_id_index` ON `message` (message_id);
+CREATE INDEX IF NOT EXISTS `message_thread_id_index` ON `message` (thread_id);
 
 CREATE TABLE IF NOT EXISTS `note` (
   uid INTEGER,
@@ -299,8 +348,10 @@ CREATE TABLE IF NOT EXISTS `note` (
   content TEXT,
   content_html TEXT,
   title TEXT,
-  UNIQUE (uid, note_id, created_time, updated_time, content, content_html, title)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `note_uid_index` ON `note` (uid);
+CREATE INDEX IF NOT EXISTS `note_note_id_index` ON `note` (note_id);
 
 CREATE TABLE IF NOT EXISTS `notification` (
   notification_id TEXT,
@@ -319,16 +370,19 @@ CREATE TABLE IF NOT EXISTS `notification` (
   object_id TEXT,
   object_type TEXT,
   icon_url TEXT,
-  UNIQUE (notification_id, sender_id, recipient_id, created_time, updated_time, title_html, title_text, body_html, body_text, href, app_id, is_unread, is_hidden, object_id, object_type, icon_url)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `notification_recipient_id_index` ON `notification` (recipient_id);
 
 CREATE TABLE IF NOT EXISTS `object_url` (
   url TEXT,
   id INTEGER,
   type TEXT,
   site TEXT,
-  UNIQUE (url, id, type, site)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `object_url_url_index` ON `object_url` (url);
+CREATE INDEX IF NOT EXISTS `object_url_id_index` ON `object_url` (id);
 
 CREATE TABLE IF NOT EXISTS `page` (
   page_id INTEGER,
@@ -397,21 +451,27 @@ CREATE TABLE IF NOT EXISTS `page` (
   built TEXT,
   features TEXT,
   mpg TEXT,
-  UNIQUE (page_id, name, username, description, categories, is_community_page, pic_small, pic_big, pic_square, pic, pic_large, page_url, fan_count, type, website, has_added_app, general_info, can_post, checkins, founded, company_overview, mission, products, location, parking, hours, pharma_safety_info, public_transit, attire, payment_options, culinary_team, general_manager, price_range, restaurant_services, restaurant_specialties, phone, release_date, genre, starring, screenplay_by, directed_by, produced_by, studio, awards, plot_outline, season, network, schedule, written_by, band_members, hometown, current_location, record_label, booking_agent, press_contact, artists_we_like, influences, band_interests, bio, affiliation, birthday, personal_info, personal_interests, built, features, mpg)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `page_page_id_index` ON `page` (page_id);
+CREATE INDEX IF NOT EXISTS `page_name_index` ON `page` (name);
+CREATE INDEX IF NOT EXISTS `page_username_index` ON `page` (username);
 
 CREATE TABLE IF NOT EXISTS `page_admin` (
   uid TEXT,
   page_id TEXT,
   type TEXT,
-  UNIQUE (uid, page_id, type)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `page_admin_uid_page_id_index` ON `page_admin` (uid, page_id);
+CREATE INDEX IF NOT EXISTS `page_admin_page_id_index` ON `page_admin` (page_id);
 
 CREATE TABLE IF NOT EXISTS `page_blocked_user` (
   page_id TEXT,
   uid TEXT,
-  UNIQUE (page_id, uid)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `page_blocked_user_page_id_index` ON `page_blocked_user` (page_id);
 
 CREATE TABLE IF NOT EXISTS `page_fan` (
   uid INTEGER,
@@ -419,15 +479,17 @@ CREATE TABLE IF NOT EXISTS `page_fan` (
   type TEXT,
   profile_section TEXT,
   created_time INTEGER,
-  UNIQUE (uid, page_id, type, profile_section, created_time)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `page_fan_uid_index` ON `page_fan` (uid);
 
 CREATE TABLE IF NOT EXISTS `permissions_info` (
   permission_name TEXT,
   header TEXT,
   summary TEXT,
-  UNIQUE (permission_name, header, summary)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `permissions_info_permission_name_index` ON `permissions_info` (permission_name);
 
 CREATE TABLE IF NOT EXISTS `photo` (
   pid TEXT,
@@ -450,8 +512,12 @@ CREATE TABLE IF NOT EXISTS `photo` (
   object_id INTEGER,
   album_object_id INTEGER,
   images ,
-  UNIQUE (pid, aid, owner, src_small, src_small_width, src_small_height, src_big, src_big_width, src_big_height, src, src_width, src_height, link, caption, created, modified, position, object_id, album_object_id, images)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `photo_pid_index` ON `photo` (pid);
+CREATE INDEX IF NOT EXISTS `photo_aid_index` ON `photo` (aid);
+CREATE INDEX IF NOT EXISTS `photo_object_id_index` ON `photo` (object_id);
+CREATE INDEX IF NOT EXISTS `photo_album_object_id_index` ON `photo` (album_object_id);
 
 CREATE TABLE IF NOT EXISTS `photo_tag` (
   pid TEXT,
@@ -461,8 +527,10 @@ CREATE TABLE IF NOT EXISTS `photo_tag` (
   xcoord REAL,
   ycoord REAL,
   created INTEGER,
-  UNIQUE (pid, subject, object_id, text, xcoord, ycoord, created)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `photo_tag_pid_index` ON `photo_tag` (pid);
+CREATE INDEX IF NOT EXISTS `photo_tag_subject_index` ON `photo_tag` (subject);
 
 CREATE TABLE IF NOT EXISTS `place` (
   page_id INTEGER,
@@ -473,8 +541,9 @@ CREATE TABLE IF NOT EXISTS `place` (
   longitude INTEGER,
   checkin_count INTEGER,
   display_subtext TEXT,
-  UNIQUE (page_id, name, description, geometry, latitude, longitude, checkin_count, display_subtext)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `place_page_id_index` ON `place` (page_id);
 
 CREATE TABLE IF NOT EXISTS `privacy` (
   id INTEGER,
@@ -486,8 +555,10 @@ CREATE TABLE IF NOT EXISTS `privacy` (
   owner_id INTEGER,
   networks INTEGER,
   friends TEXT,
-  UNIQUE (id, object_id, value, description, allow, deny, owner_id, networks, friends)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `privacy_id_index` ON `privacy` (id);
+CREATE INDEX IF NOT EXISTS `privacy_object_id_index` ON `privacy` (object_id);
 
 CREATE TABLE IF NOT EXISTS `privacy_setting` (
   name TEXT,
@@ -497,8 +568,9 @@ CREATE TABLE IF NOT EXISTS `privacy_setting` (
   deny TEXT,
   networks INTEGER,
   friends TEXT,
-  UNIQUE (name, value, description, allow, deny, networks, friends)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `privacy_setting_name_index` ON `privacy_setting` (name);
 
 CREATE TABLE IF NOT EXISTS `profile` (
   id INTEGER,
@@ -512,8 +584,10 @@ CREATE TABLE IF NOT EXISTS `profile` (
   pic_crop ,
   type TEXT,
   username TEXT,
-  UNIQUE (id, can_post, name, url, pic, pic_square, pic_small, pic_big, pic_crop, type, username)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `profile_id_index` ON `profile` (id);
+CREATE INDEX IF NOT EXISTS `profile_username_index` ON `profile` (username);
 
 CREATE TABLE IF NOT EXISTS `question` (
   id INTEGER,
@@ -521,8 +595,10 @@ CREATE TABLE IF NOT EXISTS `question` (
   question TEXT,
   created_time INTEGER,
   updated_time INTEGER,
-  UNIQUE (id, owner, question, created_time, updated_time)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `question_id_index` ON `question` (id);
+CREATE INDEX IF NOT EXISTS `question_owner_index` ON `question` (owner);
 
 CREATE TABLE IF NOT EXISTS `question_option` (
   id INTEGER,
@@ -532,14 +608,17 @@ CREATE TABLE IF NOT EXISTS `question_option` (
   object_id INTEGER,
   owner INTEGER,
   created_time INTEGER,
-  UNIQUE (id, question_id, name, votes, object_id, owner, created_time)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `question_option_id_index` ON `question_option` (id);
+CREATE INDEX IF NOT EXISTS `question_option_question_id_index` ON `question_option` (question_id);
 
 CREATE TABLE IF NOT EXISTS `question_option_votes` (
   option_id INTEGER,
   voter_id INTEGER,
-  UNIQUE (option_id, voter_id)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `question_option_votes_option_id_index` ON `question_option_votes` (option_id);
 
 CREATE TABLE IF NOT EXISTS `review` (
   reviewee_id INTEGER,
@@ -548,14 +627,18 @@ CREATE TABLE IF NOT EXISTS `review` (
   message TEXT,
   created_time INTEGER,
   rating INTEGER,
-  UNIQUE (reviewee_id, reviewer_id, review_id, message, created_time, rating)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `review_reviewee_id_index` ON `review` (reviewee_id);
+CREATE INDEX IF NOT EXISTS `review_reviewer_id_index` ON `review` (reviewer_id);
 
 CREATE TABLE IF NOT EXISTS `standard_friend_info` (
   uid1 INTEGER,
   uid2 INTEGER,
-  UNIQUE (uid1, uid2)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `standard_friend_info_uid1_index` ON `standard_friend_info` (uid1);
+CREATE INDEX IF NOT EXISTS `standard_friend_info_uid2_index` ON `standard_friend_info` (uid2);
 
 CREATE TABLE IF NOT EXISTS `standard_user_info` (
   uid TEXT,
@@ -573,8 +656,12 @@ CREATE TABLE IF NOT EXISTS `standard_user_info` (
   proxied_email TEXT,
   current_location TEXT,
   allowed_restrictions TEXT,
-  UNIQUE (uid, name, username, third_party_id, first_name, last_name, locale, affiliations, profile_url, timezone, birthday, sex, proxied_email, current_location, allowed_restrictions)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `standard_user_info_uid_index` ON `standard_user_info` (uid);
+CREATE INDEX IF NOT EXISTS `standard_user_info_name_index` ON `standard_user_info` (name);
+CREATE INDEX IF NOT EXISTS `standard_user_info_username_index` ON `standard_user_info` (username);
+CREATE INDEX IF NOT EXISTS `standard_user_info_third_party_id_index` ON `standard_user_info` (third_party_id);
 
 CREATE TABLE IF NOT EXISTS `status` (
   uid INTEGER,
@@ -582,8 +669,10 @@ CREATE TABLE IF NOT EXISTS `status` (
   time INTEGER,
   source INTEGER,
   message TEXT,
-  UNIQUE (uid, status_id, time, source, message)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `status_uid_index` ON `status` (uid);
+CREATE INDEX IF NOT EXISTS `status_status_id_index` ON `status` (status_id);
 
 CREATE TABLE IF NOT EXISTS `stream` (
   post_id TEXT,
@@ -610,8 +699,12 @@ CREATE TABLE IF NOT EXISTS `stream` (
   message_tags ,
   description TEXT,
   description_tags ,
-  UNIQUE (post_id, viewer_id, app_id, source_id, updated_time, created_time, filter_key, attribution, actor_id, target_id, message, app_data, action_links, attachment, impressions, comments, likes, privacy, permalink, xid, tagged_ids, message_tags, description, description_tags)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `stream_post_id_index` ON `stream` (post_id);
+CREATE INDEX IF NOT EXISTS `stream_source_id_index` ON `stream` (source_id);
+CREATE INDEX IF NOT EXISTS `stream_filter_key_index` ON `stream` (filter_key);
+CREATE INDEX IF NOT EXISTS `stream_xid_index` ON `stream` (xid);
 
 CREATE TABLE IF NOT EXISTS `stream_filter` (
   uid INTEGER,
@@ -622,15 +715,20 @@ CREATE TABLE IF NOT EXISTS `stream_filter` (
   is_visible INTEGER,
   type TEXT,
   value INTEGER,
-  UNIQUE (uid, filter_key, name, rank, icon_url, is_visible, type, value)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `stream_filter_uid_index` ON `stream_filter` (uid);
+CREATE INDEX IF NOT EXISTS `stream_filter_filter_key_index` ON `stream_filter` (filter_key);
 
 CREATE TABLE IF NOT EXISTS `stream_tag` (
   post_id TEXT,
   actor_id TEXT,
   target_id TEXT,
-  UNIQUE (post_id, actor_id, target_id)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `stream_tag_post_id_index` ON `stream_tag` (post_id);
+CREATE INDEX IF NOT EXISTS `stream_tag_actor_id_index` ON `stream_tag` (actor_id);
+CREATE INDEX IF NOT EXISTS `stream_tag_target_id_index` ON `stream_tag` (target_id);
 
 CREATE TABLE IF NOT EXISTS `thread` (
   thread_id TEXT,
@@ -646,8 +744,10 @@ CREATE TABLE IF NOT EXISTS `thread` (
   object_id INTEGER,
   unread INTEGER,
   viewer_id TEXT,
-  UNIQUE (thread_id, folder_id, subject, recipients, updated_time, parent_message_id, parent_thread_id, message_count, snippet, snippet_author, object_id, unread, viewer_id)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `thread_thread_id_index` ON `thread` (thread_id);
+CREATE INDEX IF NOT EXISTS `thread_folder_id_index` ON `thread` (folder_id);
 
 CREATE TABLE IF NOT EXISTS `translation` (
   locale TEXT,
@@ -658,8 +758,11 @@ CREATE TABLE IF NOT EXISTS `translation` (
   approval_status TEXT,
   pre_hash_string TEXT,
   best_string TEXT,
-  UNIQUE (locale, native_hash, native_string, description, translation, approval_status, pre_hash_string, best_string)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `translation_locale_index` ON `translation` (locale);
+CREATE INDEX IF NOT EXISTS `translation_native_hash_index` ON `translation` (native_hash);
+CREATE INDEX IF NOT EXISTS `translation_pre_hash_string_index` ON `translation` (pre_hash_string);
 
 CREATE TABLE IF NOT EXISTS `unified_message` (
   message_id TEXT,
@@ -678,8 +781,12 @@ CREATE TABLE IF NOT EXISTS `unified_message` (
   attachment_map ,
   shares ,
   share_map ,
-  UNIQUE (message_id, thread_id, subject, body, unread, action_id, timestamp, tags, sender, recipients, object_sender, html_body, attachments, attachment_map, shares, share_map)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `unified_message_message_id_index` ON `unified_message` (message_id);
+CREATE INDEX IF NOT EXISTS `unified_message_thread_id_index` ON `unified_message` (thread_id);
+CREATE INDEX IF NOT EXISTS `unified_message_unread_index` ON `unified_message` (unread);
+CREATE INDEX IF NOT EXISTS `unified_message_timestamp_index` ON `unified_message` (timestamp);
 
 CREATE TABLE IF NOT EXISTS `unified_thread` (
   action_id TEXT,
@@ -706,8 +813,14 @@ CREATE TABLE IF NOT EXISTS `unified_thread` (
   thread_participants ,
   timestamp TEXT,
   unread INTEGER,
-  UNIQUE (action_id, archived, can_reply, folder, former_participants, has_attachments, is_subscribed, last_visible_add_action_id, name, num_messages, num_unread, object_participants, participants, senders, single_recipient, snippet, snippet_sender, snippet_message_has_attachment, subject, tags, thread_id, thread_participants, timestamp, unread)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `unified_thread_archived_index` ON `unified_thread` (archived);
+CREATE INDEX IF NOT EXISTS `unified_thread_folder_index` ON `unified_thread` (folder);
+CREATE INDEX IF NOT EXISTS `unified_thread_single_recipient_index` ON `unified_thread` (single_recipient);
+CREATE INDEX IF NOT EXISTS `unified_thread_thread_id_index` ON `unified_thread` (thread_id);
+CREATE INDEX IF NOT EXISTS `unified_thread_timestamp_index` ON `unified_thread` (timestamp);
+CREATE INDEX IF NOT EXISTS `unified_thread_unread_index` ON `unified_thread` (unread);
 
 CREATE TABLE IF NOT EXISTS `unified_thread_action` (
   action_id TEXT,
@@ -716,8 +829,9 @@ CREATE TABLE IF NOT EXISTS `unified_thread_action` (
   timestamp TEXT,
   type INTEGER,
   users ,
-  UNIQUE (action_id, actor, thread_id, timestamp, type, users)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `unified_thread_action_thread_id_index` ON `unified_thread_action` (thread_id);
 
 CREATE TABLE IF NOT EXISTS `unified_thread_count` (
   folder TEXT,
@@ -726,14 +840,21 @@ CREATE TABLE IF NOT EXISTS `unified_thread_count` (
   last_action_id INTEGER,
   last_seen_time INTEGER,
   total_threads INTEGER,
-  UNIQUE (folder, unread_count, unseen_count, last_action_id, last_seen_time, total_threads)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `unified_thread_count_folder_index` ON `unified_thread_count` (folder);
+CREATE INDEX IF NOT EXISTS `unified_thread_count_unread_count_index` ON `unified_thread_count` (unread_count);
+CREATE INDEX IF NOT EXISTS `unified_thread_count_unseen_count_index` ON `unified_thread_count` (unseen_count);
+CREATE INDEX IF NOT EXISTS `unified_thread_count_last_action_id_index` ON `unified_thread_count` (last_action_id);
+CREATE INDEX IF NOT EXISTS `unified_thread_count_last_seen_time_index` ON `unified_thread_count` (last_seen_time);
+CREATE INDEX IF NOT EXISTS `unified_thread_count_total_threads_index` ON `unified_thread_count` (total_threads);
 
 CREATE TABLE IF NOT EXISTS `url_like` (
   user_id TEXT,
   url TEXT,
-  UNIQUE (user_id, url)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `url_like_user_id_index` ON `url_like` (user_id);
 
 CREATE TABLE IF NOT EXISTS `user` (
   uid INTEGER,
@@ -809,8 +930,12 @@ CREATE TABLE IF NOT EXISTS `user` (
   friend_count INTEGER,
   mutual_friend_count INTEGER,
   can_post INTEGER,
-  UNIQUE (uid, username, first_name, middle_name, last_name, name, pic_small, pic_big, pic_square, pic, affiliations, profile_update_time, timezone, religion, birthday, birthday_date, sex, hometown_location, meeting_sex, meeting_for, relationship_status, significant_other_id, political, current_location, activities, interests, is_app_user, music, tv, movies, books, quotes, about_me, hs_info, education_history, work_history, notes_count, wall_count, status, has_added_app, online_presence, locale, proxied_email, profile_url, email_hashes, pic_small_with_logo, pic_big_with_logo, pic_square_with_logo, pic_with_logo, allowed_restrictions, verified, profile_blurb, family, website, is_blocked, contact_email, email, third_party_id, name_format, video_upload_limits, games, is_minor, work, education, sports, favorite_athletes, favorite_teams, inspirational_people, languages, likes_count, friend_count, mutual_friend_count, can_post)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `user_uid_index` ON `user` (uid);
+CREATE INDEX IF NOT EXISTS `user_username_index` ON `user` (username);
+CREATE INDEX IF NOT EXISTS `user_name_index` ON `user` (name);
+CREATE INDEX IF NOT EXISTS `user_third_party_id_index` ON `user` (third_party_id);
 
 CREATE TABLE IF NOT EXISTS `video` (
   vid INTEGER,
@@ -826,14 +951,19 @@ CREATE TABLE IF NOT EXISTS `video` (
   length REAL,
   src TEXT,
   src_hq TEXT,
-  UNIQUE (vid, owner, album_id, title, description, link, thumbnail_link, embed_html, updated_time, created_time, length, src, src_hq)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `video_vid_index` ON `video` (vid);
+CREATE INDEX IF NOT EXISTS `video_owner_index` ON `video` (owner);
+CREATE INDEX IF NOT EXISTS `video_album_id_index` ON `video` (album_id);
 
 CREATE TABLE IF NOT EXISTS `video_tag` (
   vid TEXT,
   subject INTEGER,
   updated_time INTEGER,
   created_time INTEGER,
-  UNIQUE (vid, subject, updated_time, created_time)
+  _row_hash INTEGER UNIQUE
 );
+CREATE INDEX IF NOT EXISTS `video_tag_vid_index` ON `video_tag` (vid);
+CREATE INDEX IF NOT EXISTS `video_tag_subject_index` ON `video_tag` (subject);
 
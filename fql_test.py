@@ -6,6 +6,7 @@ TODO: test subselects, other advanced features
 
 __author__ = ['Ryan Barrett <mockfacebook@ryanb.org>']
 
+import collections
 import httplib
 import json
 import threading
@@ -15,6 +16,8 @@ import unittest
 import urllib
 
 import fql
+import graph
+import oauth
 import schemautil
 import testutil
 
@@ -36,7 +39,7 @@ class FqlTest(unittest.TestCase):
   schema = schemautil.FqlSchema.read()
 
   def fql(self, query):
-    return fql.Fql(self.schema, query, 1)
+    return fql.Fql(self.schema, query)
 
   def test_table(self):
     self.assertEquals(None, self.fql('SELECT *').table)
@@ -52,8 +55,26 @@ class FqlTest(unittest.TestCase):
 
     for query in ('SELECT * FROM foo WHERE bar', 'SELECT * WHERE bar'):
       where = self.fql(query).where
-      self.assertEquals('WHERE', where.tokens[0].value)
-      self.assertEquals('bar', where.tokens[2].get_name())
+      self.assertEquals(['bar'], [tok.value for tok in where.tokens()])
+
+  def test_to_sqlite_uses_params(self):
+    self.assertEquals(
+      'SELECT name FROM `page` WHERE page_id = :me AND name = :now',
+      self.fql('SELECT name FROM page WHERE page_id = me() AND name = now()'
+               ).to_sqlite())
+
+  def test_to_sqlite_subselect(self):
+    self.assertEquals(
+      'SELECT name FROM `group` WHERE gid IN '
+      '(SELECT gid FROM `group_member` WHERE uid = :me)',
+      self.fql('SELECT name FROM group WHERE gid IN '
+               '(SELECT gid FROM group_member WHERE uid = me())').to_sqlite())
+
+  def test_unbalanced_parens(self):
+    self.assertRaises(fql.UnexpectedEndError, self.fql,
+                      'SELECT id FROM profile WHERE id IN (1, 2')
+    self.assertRaises(fql.UnexpectedError, self.fql,
+                      'SELECT id FROM profile WHERE id = 1)')
 
 
 class FqlHandlerTest(testutil.HandlerTest):
@@ -141,15 +162,19 @@ class FqlHandlerTest(testutil.HandlerTest):
     try:
       time.time = lambda: 3.14
       self.expect_fql('SELECT now() FROM profile WHERE id = me()',
-                      [{'3': 3}])
+                      [{'now()': 3}])
+      self.expect_fql('SELECT me(), strlen(now()) FROM profile WHERE id = me()',
+                      [{'me()': 1, 'strlen(now())': 1}])
     finally:
       time.time = orig_time
 
   def test_strlen_function(self):
     self.expect_fql('SELECT strlen("asdf") FROM profile WHERE id = me()',
-                    [{'length("asdf")': 4}])
+                    [{'strlen("asdf")': 4}])
     self.expect_fql('SELECT strlen(username) FROM profile WHERE id = me()',
-                    [{'length(username)': 5}])
+                    [{'strlen(username)': 5}])
+    self.expect_fql('SELECT id FROM profile WHERE strlen(username) = 5',
+                    [{'id': 1}])
 
     self.expect_error('SELECT strlen() FROM profile WHERE id = me()',
                       fql.ParamMismatchError('strlen', 1, 0))
@@ -158,18 +183,38 @@ class FqlHandlerTest(testutil.HandlerTest):
 
   def test_substr_function(self):
     self.expect_fql('SELECT substr("asdf", 1, 2) FROM profile WHERE id = me()',
-                    [{'substr("asdf", 2, 2)': 'sd'}])
+                    [{'substr("asdf", 1, 2)': 'sd'}])
     self.expect_fql('SELECT substr("asdf", 1, 6) FROM profile WHERE id = me()',
-                    [{'substr("asdf", 2, 6)': 'sdf'}])
+                    [{'substr("asdf", 1, 6)': 'sdf'}])
+    self.expect_fql('SELECT substr(username, 1, 3) FROM profile WHERE id = me()',
+                    [{'substr(username, 1, 3)': 'lic'}])
+    self.expect_fql('SELECT substr(username, strlen("x"), 3) FROM profile '
+                    'WHERE id = me()',
+                    [{'substr(username, strlen("x"), 3)': 'lic'}])
+
+    for start, length, expected in ((0, 2, 'as'), (-3, 2, 'sd'), (-9, 2, 'as'),
+                                    (1, -1, 'sd'), (3, -2, ''), (9, 1, '')):
+      query = 'SELECT substr("asdf", %d, %d) FROM profile WHERE id = me()' % (
+        start, length)
+      self.expect_fql(query, [{query[7:query.index(' FROM')]: expected}])
 
     self.expect_error('SELECT substr("asdf", 0) FROM profile WHERE id = me()',
                       fql.ParamMismatchError('substr', 3, 2))
 
+  def test_sqlite_functions_not_replaced(self):
+    # other queries on the same connection still get SQLite's own functions
+    self.expect_fql('SELECT substr("asdf", 1, 2) FROM profile WHERE id = me()',
+                    [{'substr("asdf", 1, 2)': 'sd'}])
+    self.assertEquals((u'a',), self.conn.execute(
+        "SELECT substr('asdf', 1, 1)").fetchone())
+
   def test_strpos_function(self):
     self.expect_fql('SELECT strpos("asdf", "sd") FROM profile WHERE id = me()',
-                    [{'1': 1}])
+                    [{'strpos("asdf", "sd")': 1}])
     self.expect_fql('SELECT strpos("asdf", "x") FROM profile WHERE id = me()',
-                    [{'-1': -1}])
+                    [{'strpos("asdf", "x")': -1}])
+    self.expect_fql('SELECT strpos(username, "ice") FROM profile WHERE id = me()',
+                    [{'strpos(username, "ice")': 2}])
 
     self.expect_error('SELECT strpos("asdf") FROM profile WHERE id = me()',
                       fql.ParamMismatchError('strpos', 2, 1))
@@ -271,17 +316,154 @@ class FqlHandlerTest(testutil.HandlerTest):
 
   def test_access_token(self):
     self.conn.execute(
-      'INSERT INTO oauth_access_tokens(code, token) VALUES("asdf", "qwert")')
+      'INSERT INTO oauth_access_tokens(user_id, code, token) '
+      'VALUES("1", "asdf", "qwert")')
     self.conn.commit()
     self.expect_fql('SELECT username FROM profile WHERE id = me()',
                     [{'username': 'alice'}],
                     args={'access_token': 'qwert'})
 
+    # the token cache is shared with the other handlers
+    graph.GraphHandler.init(self.conn, self.ME)
+    self.app.get_response('/1?access_token=qwert')
+    tokens = oauth.BaseHandler.tokens.tokens
+    self.assertEquals((1, 1, 1), (len(tokens), tokens.hits, tokens.misses))
+
+  def test_translation_cache(self):
+    cache = fql.FqlHandler.cache
+    query = 'SELECT username FROM profile WHERE id = me()'
+    self.expect_fql(query, [{'username': 'alice'}])
+    self.assertEquals((0, 1), (cache.hits, cache.misses))
+    self.expect_fql(query, [{'username': 'alice'}])
+    self.assertEquals((1, 1), (cache.hits, cache.misses))
+
+    # me() is a parameter, so a different me reuses the same translation
+    fql.FqlHandler.me = int(self.ME) + 1
+    self.expect_fql(query, [])
+    self.assertEquals(2, cache.hits)
+
+    # errors are cached too
+    query = 'SELECT strlen() FROM profile WHERE id = me()'
+    self.expect_error(query, fql.ParamMismatchError('strlen', 1, 0))
+    self.expect_error(query, fql.ParamMismatchError('strlen', 1, 0))
+    self.assertEquals(3, cache.hits)
+
+  def test_indexes(self):
+    self.assertEquals([('uid1', 'uid2'), ('uid2',)],
+                      fql.FqlHandler.schema.indexes('friend'))
+
+    for query, index in (
+        ('SELECT uid1 FROM friend WHERE uid2 = me()', 'friend_uid2_index'),
+        ('SELECT uid2 FROM friend WHERE uid1 = me()', 'friend_uid1_uid2_index'),
+        ('SELECT name FROM user WHERE username = "alice"', 'user_username_index'),
+        ):
+      sqlite = fql.Fql(fql.FqlHandler.schema, query).to_sqlite()
+      plan = self.conn.execute('EXPLAIN QUERY PLAN ' + sqlite,
+                               fql.Fql.params(self.ME)).fetchall()
+      self.assertIn(index, ' '.join(row[-1] for row in plan))
+
   def test_invalid_access_token(self):
     self.expect_error('SELECT username FROM profile WHERE id = me()',
                       fql.InvalidAccessTokenError(),
                       args={'access_token': 'bad'})
 
+  def multiquery(self, queries, path='/method/fql.multiquery', **args):
+    """Runs an fql.multiquery and returns the decoded JSON response.
+    """
+    args.setdefault('format', 'json')
+    args['q' if path == '/fql' else 'queries'] = json.dumps(queries)
+    return json.loads(self.get_response(path, args=args).body)
+
+  def test_multiquery(self):
+    self.conn.execute("INSERT INTO profile(id, username) VALUES(2, 'bob')")
+    self.conn.commit()
+    queries = collections.OrderedDict((
+        ('names', 'SELECT username FROM profile WHERE id IN (SELECT id FROM #ids)'),
+        ('ids', 'SELECT id FROM profile WHERE username = "alice" OR id = 2'),
+        ('crops', 'SELECT pic_crop FROM #all WHERE id IN (SELECT id FROM #ids)'),
+        ('all', 'SELECT id, pic_crop FROM profile WHERE id = me()'),
+        ))
+    expected = [
+      {'name': 'names', 'fql_result_set': [{'username': 'alice'},
+                                           {'username': 'bob'}]},
+      {'name': 'ids', 'fql_result_set': [{'id': 1}, {'id': 2}]},
+      # pic_crop is decoded, since #all's results are from profile
+      {'name': 'crops', 'fql_result_set': [{'pic_crop': {
+          'right': 1, 'bottom': 2, 'uri': 'http://picture/url'}}]},
+      {'name': 'all', 'fql_result_set': [{'id': 1, 'pic_crop': {
+          'right': 1, 'bottom': 2, 'uri': 'http://picture/url'}}]},
+      ]
+    resp = self.multiquery(queries)
+    self.assertEquals(expected, resp)
+    self.assertEquals({'data': expected}, self.multiquery(queries, path='/fql'))
+
+    # the temp tables are gone
+    self.assertEquals([], self.conn.execute(
+        "SELECT name FROM sqlite_temp_master WHERE type = 'table'").fetchall())
+
+  def test_multiquery_xml(self):
+    resp = self.get_response('/method/fql.multiquery', args={'queries': json.dumps(
+          {'q': 'SELECT username FROM profile WHERE id = me()'})})
+    self.assertEquals("""<?xml version="1.0" encoding="UTF-8"?>
+<fql_multiquery_response xmlns="http://api.facebook.com/1.0/" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" list="true">
+<fql_result>
+<name>q</name>
+<fql_result_set list="true">
+<profile>
+<username>alice</username>
+</profile>
+</fql_result_set>
+</fql_result>
+</fql_multiquery_response>""", resp.body)
+
+  def test_multiquery_errors(self):
+    for queries, error in (
+        ('foo', fql.InvalidQueriesError()),
+        ('[]', fql.InvalidQueriesError()),
+        ('{}', fql.InvalidQueriesError()),
+        ('{"a b": "SELECT id FROM profile WHERE id = 1"}',
+         fql.InvalidQueriesError()),
+        ('{"a": "SELECT id FROM #b WHERE id = 1"}', fql.UnknownQueryError('b')),
+        ('{"a": "SELECT id FROM #b WHERE id = 1", '
+         '"b": "SELECT id FROM #a WHERE id = 1"}',
+         fql.CircularQueryError('#a, #b')),
+        ('{"a": "SELECT strlen() FROM profile WHERE id = 1"}',
+         fql.ParamMismatchError('strlen', 1, 0)),
+        ('{"a": "SELECT foo FROM profile WHERE id = 1"}',
+         fql.SqliteError('no such column: foo')),
+        ):
+      resp = json.loads(self.get_response('/method/fql.multiquery', args={
+            'format': 'json', 'queries': queries}).body)
+      self.assertEquals((error.code, error.msg),
+                        (resp['error_code'], resp['error_msg']), queries)
+      self.assertIn({'key': 'method', 'value': 'fql.multiquery'},
+                    resp['request_args'])
+
+
+class ConcurrentFqlHandlerTest(testutil.ThreadLocalDbTest):
+  """Runs multiqueries with a ThreadLocalConnection, so queries run
+  concurrently.
+  """
+
+  def setUp(self):
+    super(ConcurrentFqlHandlerTest, self).setUp(fql.FqlHandler)
+
+  def insert_test_data(self, conn):
+    insert_test_data(conn)
+
+  def test_multiquery_concurrent(self):
+    queries = dict(('q%d' % i, 'SELECT username FROM profile WHERE id = %d' % i)
+                   for i in range(5))
+    queries['all'] = 'SELECT id FROM profile WHERE id IN (SELECT id FROM #q1)'
+    resp = json.loads(self.get_response('/method/fql.multiquery', args={
+          'format': 'json', 'queries': json.dumps(queries)}).body)
+    resp = dict((result['name'], result['fql_result_set']) for result in resp)
+
+    self.assertIsNotNone(fql.FqlHandler.executor.executor)
+    self.assertEquals([{'username': 'alice'}], resp['q1'])
+    self.assertEquals([], resp['q2'])
+    self.assertEquals([{'id': 1}], resp['all'])
+
 
 if __name__ == '__main__':
   unittest.main()
@@ -8,6 +8,9 @@ or an alias.
 
 __author__ = ['Ryan Barrett <mockfacebook@ryanb.org>']
 
+import base64
+import collections
+import copy
 import json
 import os
 import sqlite3
@@ -19,11 +22,17 @@ from urllib import unquote
 import datetime
 import random
 import sys
+import threading
 
 import webapp2
+import cache
 import oauth
 import schemautil
 
+# SQLite's default limit on the number of parameters in a single query.
+# http://www.sqlite.org/limits.html#max_variable_number
+MAX_SQL_VARIABLES = 999
+
 # the one connection that returns an HTTP 302 redirect instead of a normal
 # 200 with response data.
 # http://developers.facebook.com/docs/reference/api/#pictures
@@ -115,12 +124,58 @@ class NoNodeError(JsonError):
   message = 'No node specified'
   type = 'Exception'
 
+class TooManyIdsError(JsonError):
+  message = '(#100) Too many IDs. Maximum: %d. Provided: %d.'
+
+class CursorError(JsonError):
+  message = '(#100) Invalid cursor: %s'
+
+class ParamRangeError(JsonError):
+  message = '(#100) Param %s must be between %d and %d.'
+
 class InternalError(JsonError):
   status = 500
   message = '%s'
   type = 'InternalError'
 
 
+# the paging query parameters for a connection request. limit and offset are
+# integers or None, after and before are decoded cursor keys or None, since and
+# until are Unix timestamps or None.
+Paging = collections.namedtuple('Paging', ('limit', 'offset', 'after', 'before',
+                                           'since', 'until'))
+
+
+# SQLite integers are signed 64 bit. binding anything outside this range raises
+# OverflowError.
+SQLITE_MIN_INT = -2 ** 63
+SQLITE_MAX_INT = 2 ** 63 - 1
+
+
+def encode_cursor(key):
+  """Returns an opaque cursor string for a connection item's sort key.
+
+  Keys are graph_connections rows' (position, rowid). Cursors are keyset based,
+  so a page after or before a cursor costs the same however deep it is.
+  """
+  return base64.urlsafe_b64encode(json.dumps(key, separators=(',', ':')))
+
+
+def decode_cursor(cursor):
+  """Returns the sort key in a cursor string.
+
+  Raises: CursorError if the cursor is malformed
+  """
+  try:
+    key = tuple(json.loads(base64.urlsafe_b64decode(str(cursor))))
+    assert len(key) == 2
+    assert all(isinstance(val, (int, long)) and
+               SQLITE_MIN_INT <= val <= SQLITE_MAX_INT for val in key)
+    return key
+  except (TypeError, ValueError, AssertionError, IndexError, UnicodeError):
+    raise CursorError(cursor)
+
+
 class NameDict(dict):
   """Maps ids map to the names (eiter id or alias) they were requested by.
 
@@ -131,6 +186,122 @@ class NameDict(dict):
   pass
 
 
+# SQL expression template that evaluates to a JSON object with just some of the
+# fields in a JSON object column. Takes the column name and a placeholder per
+# field name. json_each() returns booleans as 1 and 0 and nested objects and
+# arrays as text, so this converts them back to JSON.
+JSON_FIELDS_SQL = """\
+(SELECT json_group_object(key, CASE type WHEN 'true' THEN json('true')
+                                         WHEN 'false' THEN json('false')
+                                         WHEN 'object' THEN json(value)
+                                         WHEN 'array' THEN json(value)
+                                         ELSE value END)
+ FROM json_each(%s) WHERE key IN (%s))"""
+
+
+def json_fields_sql(column, fields):
+  """Returns a JSON_FIELDS_SQL expression for the given column and fields.
+
+  Args:
+    column: string column name
+    fields: sequence of field names. bind them as the expression's parameters.
+  """
+  return JSON_FIELDS_SQL % (column, ','.join('?' * len(fields)))
+
+
+def has_json1(conn):
+  """Returns True if the given SQLite connection supports the JSON1 functions.
+  """
+  try:
+    conn.execute("SELECT json_group_object('a', json('{}'))").fetchall()
+    return True
+  except sqlite3.OperationalError:
+    return False
+
+
+def filter_fields(object, fields):
+  """Returns a copy of a JSON dict with only the given fields.
+
+  Args:
+    object: dict
+    fields: sequence of field names. if empty, all fields are included.
+  """
+  return dict([[key, value] for key, value in object.items() if key in fields or not fields])
+
+
+class CachedObject(dict):
+  """A decoded graph object in GraphHandler.object_cache.
+
+  Attributes:
+    json_size: integer, the length of the object's stored JSON
+    signature: (rowid, length of data) tuple of the object's graph_objects row
+      when it was loaded. if the row has a different signature, the object is
+      stale.
+  """
+  json_size = 0
+  signature = None
+
+
+class StoredJson(unicode):
+  """A graph object's JSON text, as stored in graph_objects.data.
+
+  Written to the response as is, without decoding and re-encoding it.
+  """
+  pass
+
+
+class NameIndex(object):
+  """An in-memory map of graph object ids and aliases.
+
+  Resolves names without querying SQLite. Names that aren't in the index are
+  still looked up in SQLite and then added, since other processes may add
+  objects, e.g. test users. Entries are never removed, since the server never
+  deletes graph_objects rows. Objects deleted from SQLite directly keep their
+  entries until the server restarts.
+
+  Attributes:
+    aliases: dict mapping id to alias, or None if the object has no alias
+    ids: dict mapping alias to id
+  """
+
+  def __init__(self):
+    self.aliases = {}
+    self.ids = {}
+
+  @classmethod
+  def load(cls, conn):
+    """Factory method. Loads all of the graph objects' ids and aliases.
+
+    Args:
+      conn: sqlite3.Connection
+    """
+    index = cls()
+    for id, alias in conn.execute('SELECT id, alias FROM graph_objects'):
+      index.add(id, alias)
+    return index
+
+  def add(self, id, alias=None):
+    self.aliases[id] = alias
+    if alias is not None:
+      self.ids[alias] = id
+
+  def lookup(self, names):
+    """Returns the (id, alias) pairs for objects whose id or alias is in names.
+
+    Args:
+      names: set of string ids and aliases
+
+    Returns: set of (id, alias) tuples
+    """
+    found = set()
+    for name in names:
+      if name in self.aliases:
+        found.add((name, self.aliases[name]))
+      if name in self.ids:
+        found.add((self.ids[name], name))
+    return found
+
+
 def is_int(str):
   """Returns True if str is an integer, False otherwise."""
   try:
@@ -233,7 +404,7 @@ def get_application(*args, **kwargs):
   return {"name": "TestApp", "canvas_name": "test", "namespace": "test", "id":"1234567890"}
 
 def get_time(*args, **kwargs):
-  return datetime.datetime.now(utctz).strftime("%Y-%m-%dT%H:%S:%M%z")
+  return datetime.datetime.now(utctz).strftime("%Y-%m-%dT%H:%M:%S%z")
 
 # TODO: support posting of events (attending, maybe, declined), albums (photos), and checkins
 # Note: the order of the fields matter because the default values of some fields depend on the value of other fields.
@@ -312,8 +483,30 @@ class GraphHandler(webapp2.RequestHandler):
     me: integer, the user id that /me should use
     schema: schemautil.GraphSchema
     all_connections: set of all string connection names
+    lock: RLock, must be held while modifying POSTed objects, since requests
+      may be handled concurrently
+    object_cache: cache.LruCache mapping id to decoded graph_objects data.
+      Doesn't include POSTed objects, which are stored in the
+      posted_graph_objects table and overlaid on top.
+    object_cache_size: integer, the object cache's budget, measured in bytes
+      of the objects' stored JSON. 0 turns the cache off. set before calling
+      init().
+    json1: boolean, whether SQLite has the JSON1 extension. if so, the fields
+      query parameter is applied inside SQLite.
+    name_index: NameIndex of graph objects, or None to look up names in SQLite.
+      POSTed objects are always looked up in SQLite.
+    use_name_index: boolean, whether to load name_index. set before calling
+      init().
+    max_ids: integer, the maximum number of names in a ?ids= request
+    default_limit: integer, the page size for connection requests without a
+      limit query parameter, or None to return the whole connection
   """
 
+  object_cache_size = 32 * 1024 * 1024
+  use_name_index = False
+  max_ids = 5000
+  default_limit = None
+
   ROUTES = [webapp2.Route('<id:(/[^/]*)?><connection:(/[^/]*)?/?>', 'graph.GraphHandler')]
 
   @classmethod
@@ -326,10 +519,22 @@ class GraphHandler(webapp2.RequestHandler):
     cls.me = me
     cls.schema = schemautil.GraphSchema.read()
     cls.all_connections = reduce(set.union, cls.schema.connections.values(), set())
-    cls.posted_graph_objects = {}
-    cls.posted_connections = {}  # maps id -> connection -> list of elements
+    cls.lock = threading.RLock()
+    cls.object_cache = cache.LruCache(cls.object_cache_size,
+                                      sizeof=lambda obj: obj.json_size)
+    cls.json1 = has_json1(conn)
+    cls.name_index = NameIndex.load(conn) if cls.use_name_index else None
+
+  def _get(self, id, connection, stored=False):
+    """Returns the objects or connections for a request.
 
-  def _get(self, id, connection):
+    Args:
+      id: string id or alias, or None
+      connection: string, or None
+      stored: boolean. if True, an unfiltered /<id> request for an object
+        that hasn't been modified by a POST returns its StoredJson instead of
+        decoding it.
+    """
     if id in self.all_connections and not connection:
       connection = id
       id = None
@@ -337,25 +542,20 @@ class GraphHandler(webapp2.RequestHandler):
     try:
       token = self.request.get('access_token')
 
-      if token and not oauth.AccessTokenHandler.is_valid_token(self.conn, token):
-        raise ValidationError()
-
-      # Find current me if not provided
-      if not self.me and token:
-          try:
-              sql = 'SELECT user_id FROM oauth_access_tokens WHERE token="%s";' % token
-
-              cursor = self.conn.execute(sql)
-              self.me = cursor.fetchone()[0]
-          except:
-              pass
+      if token:
+        user_id = oauth.BaseHandler.tokens.get_user(token)
+        if user_id is None:
+          raise ValidationError()
+        # Find current me if not provided
+        if not self.me:
+          self.me = user_id
 
       namedict = self.prepare_ids(id)
 
       if connection:
         resp = self.get_connections(namedict, connection)
       else:
-        resp = self.get_objects(namedict)
+        resp = self.get_objects(namedict, stored=stored)
 
       if namedict.single:
         if not resp:
@@ -384,8 +584,11 @@ class GraphHandler(webapp2.RequestHandler):
       id = id.strip("/")
 
     try:
-      resp = self._get(id, connection)
-      json.dump(resp, self.response.out, indent=2)
+      resp = self._get(id, connection, stored=True)
+      if isinstance(resp, StoredJson):
+        self.response.out.write(resp)
+      else:
+        json.dump(resp, self.response.out, indent=2)
     except GraphError, e:
       # i don't use webapp2's handle_exception() because there's no way to get
       # the original exception's traceback, which makes testing difficult.
@@ -405,6 +608,11 @@ class GraphHandler(webapp2.RequestHandler):
       self.response.set_status(e.status)
       return
 
+    # the object is modified in place below, e.g. to add comments, but objects
+    # from SQLite may be in the object cache, so copy it first.
+    graph_obj = copy.deepcopy(dict(graph_obj))
+    parent_id = graph_obj.get('id', id)
+
     # validate the object type and connection
     try:
       obj_type = graph_obj.get("type")
@@ -426,19 +634,25 @@ class GraphHandler(webapp2.RequestHandler):
     #fields = self.schema.tables.get(obj_type)
     fields = []
 
-    if self.update_graph_object(id, connection, graph_obj):
-      resp = True
-    else:
-      # The connection determines what type of object to create
-      try:
-        graph_obj = self.create_graph_object(fields, self.request.POST, id, connection, graph_obj)
-        obj_id = graph_obj["id"]
-        GraphHandler.posted_graph_objects[obj_id] = graph_obj
-        resp = {"id": obj_id}
-      except GraphError as e:
-        self.response.write(e.message)
-        self.response.set_status(e.status)
-        return
+    with self.lock:
+      if self.update_graph_object(parent_id, connection, graph_obj):
+        resp = True
+      else:
+        # The connection determines what type of object to create
+        try:
+          # only POSTed parents are modified, e.g. comments on a POSTed status
+          parent_posted = self.load_posted_objects([parent_id])
+          blob = self.create_graph_object(fields, self.request.POST, id, connection, graph_obj)
+          if parent_posted:
+            self.put_posted_object(parent_id, graph_obj)
+          self.put_posted_object(blob["id"], blob)
+          resp = {"id": blob["id"]}
+        except GraphError as e:
+          self.conn.rollback()
+          self.response.write(e.message)
+          self.response.set_status(e.status)
+          return
+      self.conn.commit()
 
     # check the arguments
 
@@ -453,8 +667,11 @@ class GraphHandler(webapp2.RequestHandler):
 
   def delete(self, id, connection):
     if id == "/clear":
-      GraphHandler.posted_graph_objects = {}
-      GraphHandler.posted_connections = {}
+      with self.lock:
+        self.conn.execute('DELETE FROM graph_connections WHERE position < 0')
+        self.conn.execute('DELETE FROM posted_graph_objects')
+        self.conn.commit()
+        self.object_cache.clear()
       response_code = "ok"
     else:
       response_code = "fail"
@@ -462,30 +679,189 @@ class GraphHandler(webapp2.RequestHandler):
     resp = {"response": response_code}
     json.dump(resp, self.response.out, indent=2)
 
-  def get_objects(self, namedict):
+  def get_objects(self, namedict, stored=False):
+    """Returns the objects for some ids, overlaid with POSTed objects.
+
+    Args:
+      namedict: NameDict
+      stored: boolean. if True and this is an unfiltered /<id> request, the
+        object's StoredJson is returned instead of decoding it.
+
+    Returns: dict mapping id to JSON dict or StoredJson
+    """
     if not namedict:
       raise BadGetError()
 
     ids = namedict.keys()
+    fields = self.get_fields()
+
+    if stored and namedict.single and not fields:
+      filtered_data = self.load_stored_json(ids)
+    elif not fields:
+      filtered_data = self.load_objects(ids)
+    elif self.json1:
+      filtered_data = self.load_object_fields(ids, fields)
+    else:
+      filtered_data = {}
+      for user_id, object in self.load_objects(ids).items():
+        filtered_data[user_id] = filter_fields(object, fields)
 
+    # Anything in the published graph objects overwrite the normal results
+    for obj_id, object in self.load_posted_objects(ids).items():
+      filtered_data[obj_id] = filter_fields(object, fields)
 
-    cursor = self.conn.execute(
-      'SELECT DISTINCT id, data FROM graph_objects WHERE id IN (%s)' % self.qmarks(ids),
-      ids)
+    return filtered_data
 
-    # List of fields to filter
-    fields = unquote(self.request.get('fields'))
-    fields = fields.split(',') if fields else []
-    filtered_data = {}
-    for user_id, data in cursor.fetchall():
-        filtered_data[user_id] = dict([[key, value] for key, value in json.loads(data).items() if key in fields or not fields])
+  def load_posted_objects(self, ids):
+    """Returns the POSTed objects, and objects modified by POSTs, for some ids.
 
-    # Anything in the published graph objects overwrite the normal results
-    for obj_id in ids:
-      if obj_id in GraphHandler.posted_graph_objects:
-        filtered_data[obj_id] = GraphHandler.posted_graph_objects[obj_id]
+    Args:
+      ids: sequence of string ids
 
-    return filtered_data
+    Returns: dict mapping id to decoded JSON dict. ids that aren't found are
+      omitted.
+    """
+    rows = self.execute_chunked(
+      'SELECT id, data FROM posted_graph_objects WHERE id IN (%s)', list(ids))
+    return dict((id, json.loads(data)) for id, data in rows)
+
+  def put_posted_object(self, id, object):
+    """Stores a POSTed or modified object. Doesn't commit.
+
+    Args:
+      id: string id
+      object: JSON dict
+    """
+    self.conn.execute(
+      'INSERT OR REPLACE INTO posted_graph_objects (id, data) VALUES (?, ?)',
+      (id, json.dumps(object)))
+    self.object_cache.pop(id)
+
+  def add_posted_connection(self, id, connection, object):
+    """Adds a POSTed object to the beginning of a connection. Doesn't commit.
+
+    The new row's position is one less than the connection's first row, which
+    SQLite finds with the (id, connection, position) index, so adding to a
+    connection costs the same however long it is.
+
+    Args:
+      id: string id
+      connection: string
+      object: JSON dict
+    """
+    self.conn.execute(
+      'INSERT INTO graph_connections (id, connection, data, position, time) '
+      'SELECT ?, ?, ?, MIN(IFNULL(MIN(position), 0), 0) - 1, ? '
+      'FROM graph_connections WHERE id = ? AND connection = ?',
+      (id, connection, json.dumps(object), schemautil.connection_time(object),
+       id, connection))
+
+  def load_objects(self, ids):
+    """Returns the decoded graph_objects rows for the given ids.
+
+    Uses the object cache, and adds the objects it loads from SQLite to it.
+    The returned CachedObjects are shared with the cache, so don't modify them!
+
+    Args:
+      ids: sequence of string ids
+
+    Returns: dict mapping id to decoded JSON dict. ids that aren't found are
+      omitted.
+    """
+    objects = self.get_cached_objects(ids)
+    missing = [id for id in ids if id not in objects]
+
+    if missing:
+      rows = self.execute_chunked(
+        'SELECT DISTINCT id, rowid, data FROM graph_objects WHERE id IN (%s)',
+        missing)
+      for id, rowid, data in rows:
+        object = CachedObject(json.loads(data))
+        object.json_size = len(data)
+        object.signature = (rowid, len(data))
+        self.object_cache.put(id, object)
+        objects[id] = object
+
+    return objects
+
+  def load_stored_json(self, ids):
+    """Returns the stored JSON text of the graph_objects rows for some ids.
+
+    Doesn't decode the JSON or use the object cache.
+
+    Args:
+      ids: sequence of string ids
+
+    Returns: dict mapping id to StoredJson. ids that aren't found are omitted.
+    """
+    rows = self.execute_chunked(
+      'SELECT DISTINCT id, data FROM graph_objects WHERE id IN (%s)', list(ids))
+    return dict((id, StoredJson(data)) for id, data in rows)
+
+  def get_cached_objects(self, ids):
+    """Returns the objects in the object cache for some ids that aren't stale.
+
+    Objects may be edited directly in SQLite, or by other --workers, while
+    they're cached. Each cached object's graph_objects rowid and data length
+    are checked, which SQLite reads from the primary key index and the row
+    without any JSON decoding. Stale objects are removed from the cache. (An
+    edit that replaces data in place with the same length isn't noticed.)
+
+    Args:
+      ids: sequence of string ids
+
+    Returns: dict mapping id to CachedObject
+    """
+    cached = [id for id in ids if id in self.object_cache]
+    signatures = {}
+    if cached:
+      signatures = dict((id, (rowid, length)) for id, rowid, length in
+                        self.execute_chunked(
+          'SELECT id, rowid, length(data) FROM graph_objects WHERE id IN (%s)',
+          cached))
+
+    objects = {}
+    for id in ids:
+      signature = signatures.get(id)
+      object = self.object_cache.get(
+        id, valid=lambda object: object.signature == signature)
+      if object is not None:
+        objects[id] = object
+      elif id in self.object_cache:
+        self.object_cache.pop(id)
+    return objects
+
+  def load_object_fields(self, ids, fields):
+    """Returns just the given fields of the graph_objects rows for some ids.
+
+    Cached objects are filtered in Python. The rest are filtered inside SQLite
+    with JSON1, so only the requested fields are decoded. Those aren't cached.
+
+    Args:
+      ids: sequence of string ids
+      fields: sequence of string field names
+
+    Returns: dict mapping id to JSON dict. ids that aren't found are omitted.
+    """
+    objects = dict((id, filter_fields(object, fields)) for id, object in
+                   self.get_cached_objects(ids).items())
+    missing = [id for id in ids if id not in objects]
+
+    if missing:
+      rows = self.execute_chunked(
+        'SELECT DISTINCT id, %s FROM graph_objects WHERE id IN (%%s)' %
+          json_fields_sql('data', fields),
+        missing, before=fields)
+      for id, data in rows:
+        objects[id] = json.loads(data)
+
+    return objects
+
+  def get_fields(self):
+    """Returns the list of field names in the fields query parameter, if any.
+    """
+    fields = unquote(self.request.get('fields'))
+    return fields.split(',') if fields else []
 
   def get_connections(self, namedict, connection):
     if not namedict:
@@ -494,35 +870,241 @@ class GraphHandler(webapp2.RequestHandler):
       raise UnknownPathError(connection)
 
     ids = namedict.keys()
-    query = ('SELECT DISTINCT id, data FROM graph_connections '
-               'WHERE id IN (%s) AND connection = ?' % self.qmarks(ids))
-    cursor = self.conn.execute(query, ids + [connection])
-    rows = cursor.fetchall()
+    fields = self.get_fields()
+    pushdown = fields and self.json1 and connection != REDIRECT_CONNECTION
+    if pushdown:
+      # filter inside SQLite
+      data_sql = json_fields_sql('data', fields)
+      params = list(fields)
+    else:
+      data_sql = 'data'
+      params = []
+
+    paging = self.get_paging()
+    if paging is None or connection == REDIRECT_CONNECTION:
+      # the (id, connection, position) index returns the rows in order, so
+      # this doesn't need a sort.
+      query = ('SELECT id, %s FROM graph_connections '
+               'WHERE id IN (%%s) AND connection = ? '
+               'ORDER BY id, position, rowid' % data_sql)
+      rows = self.execute_chunked(query, ids, before=params, after=[connection])
+    else:
+      return dict((name, self.get_connection_page(id, name, connection, paging,
+                                                  data_sql, params, pushdown))
+                  for id, name in namedict.items())
 
     if connection == REDIRECT_CONNECTION and rows:
       self.redirect(json.loads(rows[0][1]), abort=True)  # this raises
 
-    resp = {}
-    # add posted data first b/c it must be newer
-    for name in namedict.values():
-      posted_data = GraphHandler.posted_connections.get(name, {}).get(connection, [])
-      resp[name] = {"data": posted_data}
+    # POSTed objects have negative positions, so they come first, newest first
+    resp = dict((name, {'data': []}) for name in namedict.values())
+    for user_id, data in rows:
+        filtered_data = json.loads(data)
+        if not pushdown:
+          filtered_data = filter_fields(filtered_data, fields)
+        resp[namedict[user_id]]['data'].append(filtered_data)
 
-    # Anything in the published graph objects overwrite the normal results
-    for obj_id in ids:
-      if obj_id in GraphHandler.posted_graph_objects:
-        filtered_data[obj_id] = GraphHandler.posted_graph_objects[obj_id]
+    return resp
 
+  def get_connection_page(self, id, name, connection, paging, data_sql, params,
+                          pushdown):
+    """Returns one page of a connection, with a paging block.
 
-    # List of fields to filter
-    fields = unquote(self.request.get('fields'))
-    fields = fields.split(',') if fields else []
-    for user_id, data in rows:
-        filtered_data = dict([[key, value] for key, value in json.loads(data).items() if key in fields or not fields])
-        resp[namedict[user_id]]['data'].append(filtered_data)
+    Rows are read with the (id, connection, position) index, starting at the
+    after or before cursor, so SQLite only reads the rows on the page plus one
+    more to tell whether there's a next or previous page. since and until are
+    range scans on the (id, connection, time) index, plus the rows with a
+    NULL time, which match any since and until (see connection_query()).
+    POSTed objects have negative positions, so they come first, newest first.
 
+    Args:
+      id: string id
+      name: string, the name the id was requested by
+      connection: string
+      paging: Paging
+      data_sql: string SQL expression for the data column
+      params: list of parameters for the placeholders in data_sql
+      pushdown: boolean, whether data_sql applies the fields query parameter
+
+    Returns: dict with data and, if data isn't empty, paging
+    """
+    fields = self.get_fields()
+    limit = paging.limit
+    # the number of items to read, including one extra to look past the page
+    want = limit + 1 if limit is not None else None
+
+    if paging.before:
+      items = self.read_connection(id, connection, data_sql, params, paging,
+                                   want, before=paging.before)[::-1]
+      has_previous = want is not None and len(items) >= want
+      if limit is not None:
+        items = items[max(len(items) - limit, 0):] if limit else []
+      has_next = True
+    else:
+      items = self.read_connection(
+        id, connection, data_sql, params, paging, want, after=paging.after,
+        offset=0 if paging.after else paging.offset or 0)
+      has_next = want is not None and len(items) >= want
+      items = items[:limit]
+      has_previous = bool(paging.after or paging.offset)
+
+    data = []
+    for key, object in items:
+      object = json.loads(object)
+      if not pushdown:
+        object = filter_fields(object, fields)
+      data.append(object)
+
+    resp = {'data': data}
+    if items:
+      before = encode_cursor(items[0][0])
+      after = encode_cursor(items[-1][0])
+      resp['paging'] = {'cursors': {'before': before, 'after': after}}
+      if has_previous:
+        resp['paging']['previous'] = self.page_url(name, connection, limit,
+                                                   before=before)
+      if has_next:
+        resp['paging']['next'] = self.page_url(name, connection, limit,
+                                               after=after)
     return resp
 
+  def read_connection(self, id, connection, data_sql, params, paging, limit,
+                      after=None, before=None, offset=0):
+    """Reads graph_connections rows in order, using the position index.
+
+    Args:
+      id: string id
+      connection: string
+      data_sql: string SQL expression for the data column
+      params: list of parameters for the placeholders in data_sql
+      paging: Paging. only since and until are used.
+      limit: integer or None
+      after: (position, rowid) key. if provided, reads the rows after it.
+      before: (position, rowid) key. if provided, reads the rows before it,
+        in reverse order.
+      offset: integer, the number of rows to skip
+
+    Returns: list of ((position, rowid), data string) tuples
+    """
+    query, args = self.connection_query(id, connection, data_sql, params,
+                                        paging, limit, after=after,
+                                        before=before, offset=offset)
+    return [((position, rowid), data) for position, rowid, data in
+            self.conn.execute(query, args)]
+
+  @staticmethod
+  def connection_query(id, connection, data_sql, params, paging, limit,
+                       after=None, before=None, offset=0):
+    """Returns the SQL query and parameters for read_connection().
+
+    Takes the same arguments as read_connection().
+
+    Without since or until, SQLite reads the rows in order from the (id,
+    connection, position) index. With them, rows in the time window are a
+    range scan on the (id, connection, time) index. Rows without a time,
+    e.g. inserted directly into SQLite, or objects without created_time or
+    updated_time, are in every time window. They're read separately, with
+    time IS NULL on the same index, since an OR of the two can't use it.
+
+    Returns: (string query, list of parameters) tuple
+    """
+    # SQLite's planner prefers the position index, since it's already in
+    # order, even when the time window is a small part of the connection.
+    if paging.since is not None or paging.until is not None:
+      index = 'INDEXED BY graph_connections_time_index '
+    else:
+      index = ''
+    query = ('SELECT position, rowid, %s FROM graph_connections %s'
+             'WHERE id = ? AND connection = ?' % (data_sql, index))
+    args = list(params) + [id, connection]
+    if after:
+      query += ' AND position >= ? AND (position > ? OR rowid > ?)'
+      args += [after[0], after[0], after[1]]
+      order = ''
+    elif before:
+      query += ' AND position <= ? AND (position < ? OR rowid < ?)'
+      args += [before[0], before[0], before[1]]
+      order = ' DESC'
+    else:
+      order = ''
+
+    if paging.since is not None or paging.until is not None:
+      window = query
+      window_args = list(args)
+      if paging.since is not None:
+        window += ' AND time >= ?'
+        window_args.append(paging.since)
+      if paging.until is not None:
+        window += ' AND time <= ?'
+        window_args.append(paging.until)
+      query = '%s UNION ALL %s AND time IS NULL' % (window, query)
+      args = window_args + args
+
+    query += ' ORDER BY position%s, rowid%s LIMIT ? OFFSET ?' % (order, order)
+    args += [limit if limit is not None else -1, offset]
+    return query, args
+
+  def page_url(self, name, connection, limit, **cursor):
+    """Returns the URL for another page of a connection.
+
+    Keeps the request's other query parameters, e.g. fields and access_token.
+
+    Args:
+      name: string id or alias
+      connection: string
+      limit: integer or None
+      cursor: after or before, string cursor
+    """
+    # since and until are kept, so that the pages stay in the time window
+    args = [(key, val.encode('utf-8')) for key, val in self.request.GET.items()
+            if key not in ('ids', 'limit', 'offset', 'after', 'before')]
+    if limit is not None:
+      args.append(('limit', limit))
+    args += cursor.items()
+    return '%s/%s/%s?%s' % (self.request.host_url, urllib.quote(name),
+                            connection, urllib.urlencode(args))
+
+  def get_paging(self):
+    """Returns the paging query parameters as a Paging.
+
+    limit and offset are ignored if they aren't non-negative integers. since
+    and until are ignored if they aren't Unix timestamps or ISO 8601 times.
+    All of them have to fit in SQLite's 64 bit integers. limit is one less,
+    since get_connection_page() reads one extra row.
+
+    Returns: Paging, or None if none of the paging query parameters are
+      provided and default_limit is None.
+
+    Raises: CursorError if after or before is malformed, ParamRangeError if
+      limit, offset, since, or until is too large
+    """
+    args = {}
+    for arg in 'limit', 'offset':
+      try:
+        args[arg] = int(self.request.get(arg))
+        if args[arg] < 0:
+          args[arg] = None
+      except ValueError:
+        args[arg] = None
+    for arg in 'after', 'before':
+      cursor = self.request.get(arg)
+      args[arg] = decode_cursor(cursor) if cursor else None
+    for arg in 'since', 'until':
+      args[arg] = schemautil.parse_time(self.request.get(arg))
+
+    for arg, min, max in (('limit', 0, SQLITE_MAX_INT - 1),
+                          ('offset', 0, SQLITE_MAX_INT),
+                          ('since', SQLITE_MIN_INT, SQLITE_MAX_INT),
+                          ('until', SQLITE_MIN_INT, SQLITE_MAX_INT)):
+      if args[arg] is not None and not min <= args[arg] <= max:
+        raise ParamRangeError(arg, min, max)
+
+    if args['limit'] is None:
+      args['limit'] = self.default_limit
+    if not any(val is not None for val in args.values()):
+      return None
+    return Paging(**args)
+
   def prepare_ids(self, path_id):
     """Returns the id(s) for this request.
 
@@ -548,28 +1130,43 @@ class GraphHandler(webapp2.RequestHandler):
 
     if not all(name and name != '0' for name in names):
       raise EmptyIdentifierError()
+    elif len(names) > self.max_ids:
+      raise TooManyIdsError(self.max_ids, len(names))
 
     me = 'me' in names
     if me:
       names.remove('me')
       names.add(self.me)
 
-    qmarks = self.qmarks(names)
-    cursor = self.conn.execute(
-      'SELECT DISTINCT id, alias FROM graph_objects WHERE id IN (%s) OR alias IN (%s)' %
-        (qmarks, qmarks),
-      tuple(names) * 2)
+    lookup = names
+    found = set()
+    if self.name_index:
+      found = self.name_index.lookup(names)
+      # objects added by other processes, e.g. test users, aren't in this
+      # process's index yet, so look up misses in SQLite.
+      lookup = names - set(name for pair in found for name in pair)
+    if lookup:
+      rows = self.execute_chunked(
+        'SELECT DISTINCT id, alias FROM graph_objects WHERE id IN (%s) OR alias IN (%s)',
+        list(lookup), repeat=2)
+      if self.name_index:
+        for id, alias in rows:
+          self.name_index.add(id, alias)
+      found.update(rows)
 
     namedict = NameDict()
     namedict.single = bool(path_id)
-    for id, alias in cursor.fetchall():
+    for id, alias in found:
       assert id in names or alias in names
       namedict[id] = 'me' if me else alias if alias in names else id
-    for name in names:
-      if name in GraphHandler.posted_graph_objects:
-        namedict[name] = name
 
     not_found = names - set(namedict.values() + namedict.keys())
+    if not_found:
+      for id, in self.execute_chunked(
+          'SELECT id FROM posted_graph_objects WHERE id IN (%s)',
+          list(not_found)):
+        namedict[id] = id
+      not_found -= set(namedict.keys())
     if not_found:
       # the error message depends on whether any of the not found names are
       # aliases and whether this was ?ids= or /id.
@@ -588,6 +1185,31 @@ class GraphHandler(webapp2.RequestHandler):
     """
     return ','.join('?' * len(values))
 
+  def execute_chunked(self, query, values, before=(), after=(), repeat=1):
+    """Runs a query with a placeholder per value and returns all result rows.
+
+    SQLite limits the number of parameters per query to MAX_SQL_VARIABLES, so
+    this splits values into chunks and runs the query once per chunk.
+
+    Args:
+      query: string SQL query with repeat %s's, each of which is replaced with
+        a placeholder per value in the chunk
+      values: list of parameter values
+      before: sequence of parameters for placeholders before the %s's
+      after: sequence of parameters for placeholders after the %s's
+      repeat: integer, the number of %s's. the chunk is bound once for each.
+
+    Returns: list of rows
+    """
+    size = max((MAX_SQL_VARIABLES - len(before) - len(after)) / repeat, 1)
+    rows = []
+    for i in range(0, len(values), size):
+      chunk = values[i:i + size]
+      cursor = self.conn.execute(query % ((self.qmarks(chunk),) * repeat),
+                                 list(before) + chunk * repeat + list(after))
+      rows.extend(cursor.fetchall())
+    return rows
+
   def update_graph_object(self, id, connection, graph_object):
     if connection == "likes":
       liker = id  # TODO: get the the user performing the like
@@ -596,7 +1218,7 @@ class GraphHandler(webapp2.RequestHandler):
         if data["id"] == liker:
           return True  # probably should be False, but Facebook returns True
       like_data.append({"id": liker, "name":"Test", "category": "Test"})
-      GraphHandler.posted_graph_objects[id] = graph_object  # keep a copy the graph object to modify it
+      self.put_posted_object(id, graph_object)
       return True
     return False
 
@@ -644,6 +1266,8 @@ class GraphHandler(webapp2.RequestHandler):
 
 
   def create_graph_object(self, fields, arguments, id, connection, parent_obj):
+    # connection rows are stored under the parent's id, not the alias or me
+    parent_id = parent_obj.get("id", id) if parent_obj is not None else id
     argument_spec = CONNECTION_POST_ARGUMENTS.get(connection)
     if argument_spec is None:
       raise InternalError("Connection: %s is not supported. You can add it yourself. :)")
@@ -657,18 +1281,16 @@ class GraphHandler(webapp2.RequestHandler):
         if YOUTUBE_LINK_RE.search(blob.get("link", "")):
           blob["type"] = "swf"
 
-        connections = GraphHandler.posted_connections.setdefault(id, {})
-        connections.setdefault(connection, []).insert(0,blob)
+        self.add_posted_connection(parent_id, connection, blob)
         if connection == "feed":
-          connections.setdefault("posts", []).insert(0,blob)  # posts mirror feed
+          self.add_posted_connection(parent_id, "posts", blob)  # posts mirror feed
         return blob
       for c in argument_spec.connections:
         try:
           blob = self.create_blob_from_args(id, fields, CONNECTION_POST_ARGUMENTS.get(c), arguments)
-          connections = GraphHandler.posted_connections.setdefault(id, {})
-          connections.setdefault(connection, []).insert(0,blob)
+          self.add_posted_connection(parent_id, connection, blob)
           if connection == "feed":
-            connections.setdefault("posts", []).insert(0,blob)  # posts mirror feed
+            self.add_posted_connection(parent_id, "posts", blob)  # posts mirror feed
           return blob
         except GraphError as e:
           last_exception = e
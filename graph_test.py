@@ -4,6 +4,7 @@
 
 __author__ = ['Ryan Barrett <mockfacebook@ryanb.org>']
 
+import json
 import re
 import traceback
 import unittest
@@ -21,11 +22,11 @@ def insert_test_data(conn):
 INSERT INTO graph_objects VALUES('1', 'alice', '{"id": "1", "foo": "bar"}');
 INSERT INTO graph_objects VALUES('2', 'bob', '{"id": "2", "inner": {"foo": "baz"}}');
 INSERT INTO graph_objects VALUES('3', null, '{"id": "3", "type": "page", "inner": {"foo": "baz"}}');
-INSERT INTO graph_connections VALUES('1', 'albums', '{"id": "3"}');
-INSERT INTO graph_connections VALUES('1', 'albums', '{"id": "4"}');
-INSERT INTO graph_connections VALUES('2', 'albums', '{"id": "5"}');
-INSERT INTO graph_connections VALUES('1', 'picture', '"http://alice/picture"');
-INSERT INTO graph_connections VALUES('2', 'picture', '"http://bob/picture"');
+INSERT INTO graph_connections (id, connection, data) VALUES('1', 'albums', '{"id": "3"}');
+INSERT INTO graph_connections (id, connection, data) VALUES('1', 'albums', '{"id": "4"}');
+INSERT INTO graph_connections (id, connection, data) VALUES('2', 'albums', '{"id": "5"}');
+INSERT INTO graph_connections (id, connection, data) VALUES('1', 'picture', '"http://alice/picture"');
+INSERT INTO graph_connections (id, connection, data) VALUES('2', 'picture', '"http://bob/picture"');
 """)
   conn.commit()
 
@@ -123,13 +124,192 @@ class ObjectTest(TestBase):
 
   def test_access_token(self):
     self.conn.execute(
-      'INSERT INTO oauth_access_tokens(code, token) VALUES("asdf", "qwert")')
+      'INSERT INTO oauth_access_tokens(user_id, code, token) '
+      'VALUES("1", "asdf", "qwert")')
     self.conn.commit()
 
     token = {'access_token': 'qwert'}
     self.expect('/alice', self.alice, args=token)
     self.expect('/alice/albums', self.alice_albums, args=token)
 
+  def test_object_cache(self):
+    cache = graph.GraphHandler.object_cache
+    self.expect('/?ids=1', {'1': self.alice})
+    self.assertEquals((0, 1), (cache.hits, cache.misses))
+    self.expect('/?ids=1', {'1': self.alice})
+    self.expect('/1?fields=foo', {'foo': 'bar'})
+    self.assertEquals((2, 1), (cache.hits, cache.misses))
+    self.assertEquals(len('{"id": "1", "foo": "bar"}'), cache.size)
+
+    # filtering shouldn't modify the cached object
+    self.expect('/1?fields=id', {'id': '1'})
+    self.expect('/?ids=1', {'1': self.alice})
+
+  def test_many_ids(self):
+    ids = [str(i) for i in range(100, 2600)]
+    self.conn.executemany('INSERT INTO graph_objects VALUES(?, null, ?)',
+                          [(id, '{"id": "%s"}' % id) for id in ids])
+    self.conn.executemany("INSERT INTO graph_connections (id, connection, data) "
+                          "VALUES(?, 'albums', ?)",
+                          [(id, '{"id": "a%s"}' % id) for id in ids])
+    self.conn.commit()
+
+    query = {'ids': ','.join(ids)}
+    resp = json.loads(self.get_response('/', args=query).body)
+    self.assertEquals(dict((id, {'id': id}) for id in ids), resp)
+
+    # exercise chunking with uneven chunks
+    orig_max = graph.MAX_SQL_VARIABLES
+    graph.MAX_SQL_VARIABLES = 7
+    try:
+      graph.GraphHandler.object_cache.clear()
+      query['fields'] = 'id'
+      resp = json.loads(self.get_response('/', args=query).body)
+      self.assertEquals(dict((id, {'id': id}) for id in ids), resp)
+
+      resp = json.loads(self.get_response('/albums', args=query).body)
+      self.assertEquals(dict((id, {'data': [{'id': 'a' + id}]}) for id in ids),
+                        resp)
+    finally:
+      graph.MAX_SQL_VARIABLES = orig_max
+
+  def test_too_many_ids(self):
+    orig_max = graph.GraphHandler.max_ids
+    graph.GraphHandler.max_ids = 2
+    try:
+      self.expect_error('/?ids=1,2,3', graph.TooManyIdsError(2, 3))
+      self.expect('/?ids=1,2', {'1': self.alice, '2': self.bob})
+    finally:
+      graph.GraphHandler.max_ids = orig_max
+
+  def test_alias_index(self):
+    plan = self.conn.execute(
+      'EXPLAIN QUERY PLAN SELECT id FROM graph_objects WHERE alias = ?',
+      ('alice',)).fetchall()
+    self.assertIn('graph_objects_alias_index', ' '.join(row[-1] for row in plan))
+
+  def test_name_index(self):
+    graph.GraphHandler.use_name_index = True
+    try:
+      graph.GraphHandler.init(self.conn, self.ME)
+    finally:
+      graph.GraphHandler.use_name_index = False
+
+    index = graph.GraphHandler.name_index
+    self.assertEquals(set([('1', 'alice'), ('2', 'bob')]),
+                      index.lookup(set(['1', 'bob', 'foo'])))
+
+    self.expect('/1', self.alice)
+    self.expect('/alice', self.alice)
+    self.expect('/me', self.alice)
+    self.expect('/bob/albums', self.bob_albums)
+    self.expect('/9', 'false')
+    self.expect_error('/foo', graph.AliasNotFoundError('foo'))
+
+    # objects added by other processes are looked up in SQLite
+    self.conn.execute("""INSERT INTO graph_objects VALUES('7', 'carol',
+      '{"id": "7"}')""")
+    self.conn.commit()
+    self.expect('/carol', {'id': '7'})
+    self.expect('/?ids=1,7', {'1': self.alice, '7': {'id': '7'}})
+    self.assertEquals('carol', index.aliases['7'])
+
+    # POSTed objects are found in SQLite, and removed by /clear
+    resp = json.loads(self.app.get_response('/3/feed', method='POST').body)
+    self.assertNotIn(resp['id'], index.aliases)
+    self.assertEquals(resp['id'], json.loads(self.get_response('/' + resp['id']).body)['id'])
+    self.app.get_response('/clear', method='DELETE')
+    self.expect_error('/' + resp['id'], graph.AliasNotFoundError(resp['id']))
+    self.expect('/3', {'id': '3', 'type': 'page', 'inner': {'foo': 'baz'}})
+
+  def test_stored_passthrough(self):
+    stored = '{"id": "1", "foo": "bar"}'
+    for cache_size in graph.GraphHandler.object_cache_size, 0:
+      orig_size = graph.GraphHandler.object_cache_size
+      graph.GraphHandler.object_cache_size = cache_size
+      try:
+        graph.GraphHandler.init(self.conn, self.ME)
+      finally:
+        graph.GraphHandler.object_cache_size = orig_size
+
+      # the stored JSON is written as is, without decoding or caching it
+      cache = graph.GraphHandler.object_cache
+      for path in '/1', '/alice', '/me':
+        self.expect(path, stored)
+      self.assertEquals((0, 0, 0), (len(cache), cache.hits, cache.misses))
+
+      # ...but not for filtered or multiple id requests
+      self.expect('/1?fields=foo', {'foo': 'bar'})
+      self.expect('/?ids=1', {'1': self.alice})
+
+    # ...or objects modified by POSTs
+    self.conn.execute("""INSERT INTO graph_objects VALUES('4', null,
+      '{"id": "4", "type": "photo"}')""")
+    self.conn.commit()
+    self.expect('/4', '{"id": "4", "type": "photo"}')
+    self.app.get_response('/4/likes', method='POST')
+    self.expect('/4', {'id': '4', 'type': 'photo', 'likes': {'data': [
+          {'id': '4', 'name': 'Test', 'category': 'Test'}]}})
+
+  def test_fields(self):
+    self.conn.execute("""INSERT INTO graph_objects VALUES('6', null,
+      '{"id": "6", "verified": true, "likes": 0, "tags": ["a"], "x": null}')""")
+    self.conn.commit()
+
+    for json1 in (True, False):
+      graph.GraphHandler.json1 = json1
+      graph.GraphHandler.object_cache.clear()
+      self.expect('/bob?fields=inner', {'inner': {'foo': 'baz'}})
+      self.expect('/3?fields=type,inner,missing',
+                  {'type': 'page', 'inner': {'foo': 'baz'}})
+      resp = json.loads(self.get_response('/6?fields=verified,tags').body)
+      self.assertEquals({'verified': True, 'tags': ['a']}, resp)
+      self.assertIs(True, resp['verified'])
+      self.assertEquals({'x': None},
+                        json.loads(self.get_response('/6?fields=x').body))
+
+      # with JSON1, only the fields are decoded, so the object isn't cached
+      self.assertEquals(not json1, '2' in graph.GraphHandler.object_cache)
+
+  def test_object_cache_invalidation(self):
+    self.conn.execute("""INSERT INTO graph_objects VALUES('4', null,
+      '{"id": "4", "type": "photo", "likes": {"data": [{"id": "5"}]}}')""")
+    self.conn.commit()
+    photo = {'id': '4', 'type': 'photo', 'likes': {'data': [{'id': '5'}]}}
+    self.expect('/4', photo)
+
+    resp = self.app.get_response('/4/likes', method='POST')
+    self.assertEquals('true', resp.body)
+    self.assertNotIn('4', graph.GraphHandler.object_cache)
+    self.expect('/4', {'id': '4', 'type': 'photo', 'likes': {'data': [
+          {'id': '5'}, {'id': '4', 'name': 'Test', 'category': 'Test'}]}})
+
+    # the like shouldn't leak into the cached object
+    self.app.get_response('/clear', method='DELETE')
+    self.expect('/4', photo)
+
+  def test_object_cache_stale(self):
+    cache = graph.GraphHandler.object_cache
+    self.expect('/?ids=1', {'1': self.alice})
+    self.assertIn('1', cache)
+
+    # edited directly in SQLite
+    self.conn.execute("""UPDATE graph_objects SET data = '{"id": "1"}'
+      WHERE id = '1'""")
+    self.conn.commit()
+    self.expect('/?ids=1', {'1': {'id': '1'}})
+
+    # replaced with the same length
+    self.conn.execute("""INSERT OR REPLACE INTO graph_objects
+      VALUES('1', 'alice', '{"id": "9"}')""")
+    self.conn.commit()
+    self.expect('/?ids=1', {'1': {'id': '9'}})
+
+    # deleted
+    self.conn.execute("DELETE FROM graph_objects WHERE id = '1'")
+    self.conn.commit()
+    self.expect_error('/1', graph.ObjectNotFoundError())
+
   def test_invalid_access_token(self):
     for path in '/alice', '/alice/albums':
       self.expect_error(path, graph.ValidationError(),
@@ -175,6 +355,245 @@ class ConnectionTest(TestBase):
     self.expect('/albums?ids=alice,bob',
                 {'alice': self.alice_albums, 'bob': self.bob_albums})
 
+  def test_fields(self):
+    self.conn.execute("""
+      INSERT INTO graph_connections (id, connection, data) VALUES('2', 'albums',
+      '{"id": "6", "name": "pics", "public": false}')""")
+    self.conn.commit()
+
+    for json1 in (True, False):
+      graph.GraphHandler.json1 = json1
+      self.expect('/alice/albums?fields=id', self.alice_albums)
+      resp = json.loads(self.get_response('/bob/albums?fields=name,public').body)
+      self.assertEquals([{}, {'name': 'pics', 'public': False}],
+                        sorted(resp['data']))
+      self.assertIs(False, sorted(resp['data'])[1]['public'])
+
+  def test_order(self):
+    self.conn.executemany(
+      "INSERT INTO graph_connections (id, connection, data, position) "
+      "VALUES('2', 'albums', ?, ?)",
+      [('{"id": "6"}', 2), ('{"id": "7"}', -1), ('{"id": "8"}', 2)])
+    self.conn.commit()
+    # ties are in insert order
+    self.expect('/bob/albums',
+                {'data': [{'id': '7'}, {'id': '5'}, {'id': '6'}, {'id': '8'}]})
+
+  def get_data(self, path):
+    """Returns the data list from a connection response.
+    """
+    return json.loads(self.get_response(path).body)['data']
+
+  def test_limit(self):
+    self.assertEquals([{'id': '3'}], self.get_data('/alice/albums?limit=1'))
+    self.assertEquals([], self.get_data('/alice/albums?limit=0'))
+    self.assertEquals(self.alice_albums['data'],
+                      self.get_data('/alice/albums?limit=5'))
+    self.expect('/alice/albums?limit=foo', self.alice_albums)
+    resp = json.loads(self.get_response('/albums?ids=alice,bob&limit=1').body)
+    self.assertEquals([{'id': '3'}], resp['alice']['data'])
+    self.assertEquals(self.bob_albums['data'], resp['bob']['data'])
+
+    # posted data comes first and counts toward the limit
+    self.conn.execute("INSERT INTO graph_connections (id, connection, data, position) "
+                      "VALUES('1', 'albums', '{\"id\": \"9\"}', -1)")
+    self.conn.commit()
+    self.assertEquals([{'id': '9'}, {'id': '3'}],
+                      self.get_data('/alice/albums?limit=2'))
+    self.assertEquals([{'id': '9'}], self.get_data('/alice/albums?limit=1'))
+
+  def test_paging(self):
+    self.conn.executemany(
+      "INSERT INTO graph_connections (id, connection, data, position) "
+      "VALUES('1', 'albums', ?, 1)",
+      [('{"id": "%d"}' % i,) for i in range(10, 15)])
+    self.conn.executemany(
+      "INSERT INTO graph_connections (id, connection, data, position) "
+      "VALUES('1', 'albums', ?, ?)",
+      [('{"id": "20"}', -1), ('{"id": "21"}', -2)])
+    self.conn.commit()
+    all_ids = ['21', '20', '3', '4', '10', '11', '12', '13', '14']
+
+    # forward
+    ids = []
+    url = '/alice/albums?limit=2&fields=id'
+    while url:
+      resp = json.loads(self.get_response(url).body)
+      self.assertTrue(1 <= len(resp['data']) <= 2)
+      ids += [obj['id'] for obj in resp['data']]
+      url = resp['paging'].get('next')
+      if url:
+        self.assertIn('fields=id', url)
+        url = url[len('http://localhost'):]
+    self.assertEquals(all_ids, ids)
+
+    # and backward
+    ids = []
+    url = resp['paging']['previous'][len('http://localhost'):]
+    while url:
+      resp = json.loads(self.get_response(url).body)
+      ids = [obj['id'] for obj in resp['data']] + ids
+      url = resp['paging'].get('previous')
+      if url:
+        url = url[len('http://localhost'):]
+    self.assertEquals(all_ids[:-1], ids)
+    self.assertIn('next', resp['paging'])
+
+    # a backward page with fewer than limit rows before the cursor
+    resp = json.loads(self.get_response('/alice/albums?limit=2&offset=3').body)
+    resp = json.loads(self.get_response(
+        '/alice/albums?limit=4&before=' + resp['paging']['cursors']['before']).body)
+    self.assertEquals(all_ids[:3], [obj['id'] for obj in resp['data']])
+    self.assertNotIn('previous', resp['paging'])
+
+    # offset
+    self.assertEquals([{'id': '4'}, {'id': '10'}],
+                      self.get_data('/alice/albums?limit=2&offset=3'))
+    self.assertEquals([{'id': '20'}, {'id': '3'}],
+                      self.get_data('/alice/albums?limit=2&offset=1'))
+
+    # cursors past the end
+    resp = json.loads(self.get_response('/alice/albums?after=%s' %
+                                        graph.encode_cursor((1, 999))).body)
+    self.assertEquals({'data': []}, resp)
+
+  def test_since_until(self):
+    self.conn.executemany(
+      "INSERT INTO graph_connections VALUES('1', 'feed', ?, 0, ?)",
+      [('{"id": "%d", "created_time": "%s"}' % (i, time),
+        schemautil.parse_time(time))
+       for i, time in ((10, '2012-01-01T00:00:00+0000'),
+                       (11, '2012-02-01T00:00:00+0000'),
+                       (12, '2012-03-01T00:00:00+0000'))])
+    self.conn.commit()
+    # a POSTed object
+    self.conn.execute(
+      "INSERT INTO graph_connections VALUES('1', 'feed', ?, -1, ?)",
+      ('{"id": "20", "created_time": "2012-02-15T00:00:00+0000"}',
+       schemautil.parse_time('2012-02-15T00:00:00+0000')))
+    self.conn.commit()
+
+    def ids(query):
+      return [obj['id'] for obj in self.get_data('/alice/feed?' + query)]
+
+    feb = schemautil.parse_time('2012-02-01')
+    self.assertEquals(['20', '11', '12'], ids('since=%d' % feb))
+    self.assertEquals(['10', '11'], ids('until=%d' % feb))
+    self.assertEquals(['20', '11'], ids('since=2012-02-01&until=2012-02-20'))
+    self.assertEquals(['20', '10', '11', '12'], ids('since=foo'))
+
+    # the time window is kept in paging links
+    resp = json.loads(self.get_response(
+        '/alice/feed?since=2012-02-01&until=2012-02-20&limit=1').body)
+    self.assertEquals([{'id': '20', 'created_time': '2012-02-15T00:00:00+0000'}],
+                      resp['data'])
+    resp = json.loads(self.get_response(
+        resp['paging']['next'][len('http://localhost'):]).body)
+    self.assertEquals([{'id': '11', 'created_time': '2012-02-01T00:00:00+0000'}],
+                      resp['data'])
+    self.assertNotIn('next', resp['paging'])
+
+    # rows without a time are in every window
+    self.conn.execute("""INSERT INTO graph_connections (id, connection, data)
+      VALUES('1', 'feed', '{"id": "30"}')""")
+    self.conn.commit()
+    self.assertEquals(['20', '11', '12', '30'], ids('since=%d' % feb))
+    self.assertEquals(['10', '11', '30'], ids('until=%d' % feb))
+
+  def test_paging_bad_cursor(self):
+    for cursor in ('foo', graph.encode_cursor(('x', 1)), graph.encode_cursor((1, 1, 2))):
+      self.expect_error('/alice/albums?after=' + cursor,
+                        graph.CursorError(cursor))
+
+  def test_paging_out_of_range(self):
+    for key in (2 ** 63, 1), (1, -2 ** 63 - 1):
+      cursor = graph.encode_cursor(key)
+      self.expect_error('/alice/albums?before=' + cursor,
+                        graph.CursorError(cursor))
+
+    big = '99999999999999999999'
+    for arg, min in ('limit', 0), ('offset', 0), ('since', -2 ** 63), \
+          ('until', -2 ** 63):
+      max = 2 ** 63 - (2 if arg == 'limit' else 1)
+      self.expect_error('/alice/albums?%s=%s' % (arg, big),
+                        graph.ParamRangeError(arg, min, max))
+
+    self.assertEquals(self.alice_albums['data'],
+                      self.get_data('/alice/albums?limit=%d' % (2 ** 63 - 2)))
+
+  def test_default_limit(self):
+    graph.GraphHandler.default_limit = 1
+    try:
+      resp = json.loads(self.get_response('/alice/albums').body)
+      self.assertEquals([{'id': '3'}], resp['data'])
+      self.assertIn('limit=1', resp['paging']['next'])
+      self.assertEquals(self.alice_albums['data'],
+                        self.get_data('/alice/albums?limit=2'))
+    finally:
+      graph.GraphHandler.default_limit = None
+
+  def test_posted_connections(self):
+    before = self.get_data('/3/feed')
+    ids = [json.loads(self.app.get_response(
+          '/3/feed', method='POST', POST={'message': msg}).body)['id']
+           for msg in ('a', 'b')]
+    ids.reverse()
+
+    def check():
+      self.assertEquals(ids, [obj['id'] for obj in self.get_data('/3/feed')][:2])
+      self.assertEquals(ids, [obj['id'] for obj in self.get_data('/3/posts')])
+      self.assertEquals(ids[1:], [obj['id'] for obj in
+                                  self.get_data('/3/feed?limit=1&offset=1')])
+      self.assertEquals('a', json.loads(self.get_response('/' + ids[1]).body)
+                        ['message'])
+    check()
+
+    # POSTed objects are stored in SQLite, so they survive a restart
+    graph.GraphHandler.init(self.conn, self.ME)
+    check()
+
+    self.app.get_response('/clear', method='DELETE')
+    self.assertEquals(before, self.get_data('/3/feed'))
+    self.assertEquals(0, self.conn.execute(
+        'SELECT COUNT(*) FROM posted_graph_objects').fetchone()[0])
+
+  def test_query_plan(self):
+    for query in ('SELECT id, data FROM graph_connections '
+                    "WHERE id IN ('1', '2') AND connection = 'albums' "
+                    'ORDER BY id, position, rowid',
+                  'SELECT id, data FROM graph_connections '
+                    "WHERE id = '1' AND connection = 'albums' "
+                    'ORDER BY position, rowid LIMIT 1',
+                  'SELECT data FROM graph_connections '
+                    "WHERE id = '1' AND connection = 'albums' "
+                    'AND position <= 5 AND (position < 5 OR rowid < 9) '
+                    'ORDER BY position DESC, rowid DESC LIMIT 1',
+                  # POSTing to a connection
+                  'SELECT MIN(position) FROM graph_connections '
+                    "WHERE id = '1' AND connection = 'feed'",
+                  # /clear
+                  'DELETE FROM graph_connections WHERE position < 0'):
+      plan = ' '.join(row[-1] for row in
+                      self.conn.execute('EXPLAIN QUERY PLAN ' + query))
+      self.assertRegexpMatches(plan, 'USING (COVERING )?INDEX graph_connections_')
+      self.assertNotIn('TEMP B-TREE', plan)
+
+    # time windows are sorted, but only the rows in the window, and the rows
+    # without a time, are read
+    for since, until in (5, 9), (5, None), (None, 9):
+      query, args = graph.GraphHandler.connection_query(
+        '1', 'feed', 'data', [], graph.Paging(1, 0, None, None, since, until),
+        1, after=(0, 1))
+      plan = [row[-1] for row in
+              self.conn.execute('EXPLAIN QUERY PLAN ' + query, args)]
+      time_scans = [step for step in plan
+                    if 'graph_connections_time_index' in step]
+      self.assertEquals(2, len(time_scans), plan)
+      self.assertTrue(any('time IS NULL' in step or 'time=?' in step
+                          for step in time_scans), plan)
+      self.assertTrue(any('time>' in step or 'time<' in step
+                          for step in time_scans), plan)
+
   def test_picture_redirect(self):
     for path in ('/alice/picture',
                  '/picture?ids=alice',
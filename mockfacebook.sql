@@ -14,15 +14,46 @@ CREATE TABLE IF NOT EXISTS oauth_access_tokens (
   FOREIGN KEY(code) REFERENCES auth_codes(code)
 );
 
+CREATE INDEX IF NOT EXISTS oauth_access_tokens_token_index
+  ON oauth_access_tokens (token);
+-- lets new test user ids be allocated without scanning the table
+CREATE INDEX IF NOT EXISTS oauth_access_tokens_int_user_id_index
+  ON oauth_access_tokens (CAST(user_id AS INTEGER));
+
 CREATE TABLE IF NOT EXISTS graph_objects (
   id TEXT NOT NULL PRIMARY KEY,
   alias TEXT,         -- optional
   data TEXT NOT NULL  -- JSON dict
 );
 
+CREATE INDEX IF NOT EXISTS graph_objects_alias_index ON graph_objects (alias);
+-- lets new test user ids be allocated without scanning the table
+CREATE INDEX IF NOT EXISTS graph_objects_int_id_index
+  ON graph_objects (CAST(id AS INTEGER));
+
 CREATE TABLE IF NOT EXISTS graph_connections (
   id TEXT NOT NULL,
   connection TEXT NOT NULL,
   data TEXT NOT NULL,  -- JSON dict
-  UNIQUE(id, connection, data)
+  position INTEGER NOT NULL DEFAULT 0,  -- order in the connection. ties are
+                                        -- returned in insert order. POSTed
+                                        -- objects are negative, newest first.
+  time INTEGER  -- Unix timestamp from data's updated_time or created_time, if
+                -- any. used for since and until. NULL matches any since and
+                -- until.
+);
+
+CREATE INDEX IF NOT EXISTS graph_connections_position_index
+  ON graph_connections (id, connection, position);
+CREATE INDEX IF NOT EXISTS graph_connections_time_index
+  ON graph_connections (id, connection, time);
+-- POSTed connection rows have negative positions. this lets /clear find them.
+CREATE INDEX IF NOT EXISTS graph_connections_posted_index
+  ON graph_connections (position) WHERE position < 0;
+
+-- POSTed objects, and objects modified by POSTs, e.g. likes. Overlaid on top of
+-- graph_objects.
+CREATE TABLE IF NOT EXISTS posted_graph_objects (
+  id TEXT NOT NULL PRIMARY KEY,
+  data TEXT NOT NULL  -- JSON dict
 );
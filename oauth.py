@@ -6,20 +6,33 @@ Based on http://developers.facebook.com/docs/authentication/ .
 __author__ = ['Ryan Barrett <mockfacebook@ryanb.org>']
 
 import base64
+import hashlib
+import hmac
+import json
 import logging
 import os
+import time
 import urllib
 import urlparse
 
 from webob import exc
 import webapp2
 
+import cache
+
 
 AUTH_CODE_PATH = '/dialog/oauth'
 ACCESS_TOKEN_PATH = '/oauth/access_token'
 EXPIRES = '999999'
 RANDOM_BYTES = 16
 
+# the maximum number of access tokens that TokenCache remembers
+TOKEN_CACHE_SIZE = 100000
+# how long TokenCache remembers that an access token is valid, in seconds
+VALID_TOKEN_TTL = 60
+# how long TokenCache remembers that an access token is invalid, in seconds
+INVALID_TOKEN_TTL = 60
+
 ERROR_TEXT = """
 mockfacebook
 
@@ -32,17 +45,137 @@ nicely formatted HTML.)
 ERROR_JSON = '{"error":{"type":"OAuthException","message":"%s."}}'
 
 
+def _b64encode(value):
+  return base64.urlsafe_b64encode(value).rstrip('=')
+
+
+def _b64decode(value):
+  return base64.urlsafe_b64decode(str(value) + '=' * (-len(value) % 4))
+
+
+def sign_token(secret, user_id, app_id, expires):
+  """Returns a signed access token.
+
+  Signed tokens are <payload>.<signature>, where payload is the base64 encoded
+  JSON object {"user_id": ..., "app_id": ..., "expires": ...} and signature is
+  the base64 encoded HMAC-SHA256 of payload. They can be validated without
+  SQLite. Opaque tokens may contain '.' too, e.g. real Facebook tokens saved by
+  download.py, so tokens that don't verify are still looked up in SQLite.
+
+  Args:
+    secret: string
+    user_id: string
+    app_id: string, the client_id the token was issued to
+    expires: integer Unix timestamp
+  """
+  payload = _b64encode(json.dumps(
+      {'user_id': user_id, 'app_id': app_id, 'expires': expires},
+      separators=(',', ':'), sort_keys=True))
+  signature = hmac.new(secret, payload, hashlib.sha256).digest()
+  return '%s.%s' % (payload, _b64encode(signature))
+
+
+def verify_token(secret, access_token):
+  """Returns the decoded payload of a signed access token.
+
+  Args:
+    secret: string
+    access_token: string
+
+  Returns: dict with user_id, app_id, and expires, or None if the token isn't
+    signed, its signature doesn't match, or it has expired
+  """
+  try:
+    payload, signature = str(access_token).split('.')
+    expected = hmac.new(secret, payload, hashlib.sha256).digest()
+    if not hmac.compare_digest(expected, _b64decode(signature)):
+      return None
+    data = json.loads(_b64decode(payload))
+  except (ValueError, TypeError, UnicodeError):
+    return None
+  if not isinstance(data, dict) or data.get('expires', 0) < time.time():
+    return None
+  return data
+
+
+class TokenCache(object):
+  """Maps access tokens to the user ids they were issued to.
+
+  Signed tokens (see sign_token()) are verified directly, without SQLite or
+  the cache. Other tokens, including ones that look signed but don't verify,
+  are looked up in SQLite. Valid ones are cached for VALID_TOKEN_TTL seconds,
+  so that a token deleted directly from SQLite stops working soon after.
+  Invalid ones are cached for INVALID_TOKEN_TTL seconds, so that a token
+  inserted directly into SQLite, e.g. by download.py, starts working soon
+  after.
+
+  Attributes:
+    conn: sqlite3.Connection
+    secret: string, the secret that signed tokens are signed with, or None if
+      they aren't accepted
+    tokens: cache.LruCache mapping token to (user id, expiration) tuple. user
+      id is None for invalid tokens. expiration is a Unix timestamp.
+  """
+
+  def __init__(self, conn, secret=None, max_size=TOKEN_CACHE_SIZE):
+    self.conn = conn
+    self.secret = secret
+    self.tokens = cache.LruCache(max_size)
+
+  def get_user(self, access_token):
+    """Returns the user id for an access token, or None if it's invalid.
+    """
+    if self.secret and '.' in access_token:
+      data = verify_token(self.secret, access_token)
+      if data:
+        return data.get('user_id')
+
+    now = time.time()
+    entry = self.tokens.get(access_token, valid=lambda entry: entry[1] > now)
+    if entry is None:
+      row = self.conn.execute(
+        'SELECT user_id FROM oauth_access_tokens WHERE token = ? LIMIT 1',
+        (access_token,)).fetchone()
+      if row:
+        entry = (row[0], now + VALID_TOKEN_TTL)
+      else:
+        entry = (None, now + INVALID_TOKEN_TTL)
+      self.tokens.put(access_token, entry)
+    return entry[0]
+
+  def is_valid(self, access_token):
+    return self.get_user(access_token) is not None
+
+
 class BaseHandler(webapp2.RequestHandler):
   """Base handler class for OAuth handlers.
 
   Attributes:
     conn: sqlite3.Connection
+    me: string, the user id that new access tokens are issued to
+    token_secret: string. if set, new access tokens are signed with it and
+      validated without SQLite. opaque tokens are still accepted. set before
+      calling init_tokens().
+    tokens: TokenCache, shared by all of the request handlers that check
+      access tokens. set by init_tokens().
   """
 
+  token_secret = None
+  tokens = None
+
   @classmethod
   def init(cls, conn, me=None):
-    # me is unused
     cls.conn = conn
+    cls.me = me
+
+  @classmethod
+  def init_tokens(cls, conn):
+    """Creates the shared TokenCache. Call before the handlers' init().
+
+    Args:
+      conn: sqlite3.Connection
+    """
+    BaseHandler.tokens = TokenCache(conn, BaseHandler.token_secret)
 
   def get_required_args(self, *args):
     """Checks that one or more args are in the query args.
@@ -60,6 +193,23 @@ class BaseHandler(webapp2.RequestHandler):
       assert val, arg
     return values
 
+  @classmethod
+  def make_token(cls, user_id, client_id):
+    """Generates and returns a new access token. Doesn't store it.
+
+    Signed if token_secret is set, otherwise random.
+
+    Args:
+      user_id: string
+      client_id: string
+
+    Returns: string access token
+    """
+    if cls.token_secret:
+      return sign_token(cls.token_secret, user_id, client_id,
+                        int(time.time()) + int(EXPIRES))
+    return base64.urlsafe_b64encode(os.urandom(RANDOM_BYTES))
+
   def create_auth_code(self, client_id, redirect_uri):
     """Generates, stores, and returns an auth code using the given parameters.
 
@@ -99,9 +249,11 @@ class BaseHandler(webapp2.RequestHandler):
         'mismatched %s values: %s received %s, %s received %s' %
         (name, AUTH_CODE_PATH, code_arg, ACCESS_TOKEN_PATH, arg))
 
-    token = base64.urlsafe_b64encode(os.urandom(RANDOM_BYTES))
-    self.conn.execute('INSERT INTO oauth_access_tokens(code, token) VALUES(?, ?)',
-                      (code, token))
+    token = self.make_token(self.me or '', client_id)
+    # signed tokens are stored too, so that they're listed as test users
+    self.conn.execute(
+      'INSERT INTO oauth_access_tokens(user_id, code, token) VALUES(?, ?, ?)',
+      (self.me or '', code, token))
     self.conn.commit()
 
     return token
@@ -163,7 +315,13 @@ class AccessTokenHandler(BaseHandler):
 
   @staticmethod
   def is_valid_token(conn, access_token):
-    """Returns True if the given access token is valid, False otherwise."""
+    """Returns True if the given access token is valid, False otherwise.
+
+    Uncached. Request handlers use TokenCache instead.
+    """
+    if (BaseHandler.token_secret and '.' in access_token and
+        verify_token(BaseHandler.token_secret, access_token) is not None):
+      return True
     cursor = conn.execute('SELECT token FROM oauth_access_tokens WHERE token = ?',
                           (access_token,))
     return cursor.fetchone() is not None
@@ -116,6 +116,83 @@ class OAuthHandlerTest(testutil.HandlerTest):
       args={'response_type': 'token'})
     assert oauth.AccessTokenHandler.is_valid_token(self.conn, token)
 
+  def test_token_cache(self):
+    cache = oauth.TokenCache(self.conn)
+    code = self.expect_oauth_redirect()
+    self.access_token_args['code'] = code
+    resp = self.get_response('/oauth/access_token', args=self.access_token_args)
+    token = urlparse.parse_qs(resp.body)['access_token'][0]
+
+    # tokens are issued to me
+    self.assertEquals(self.ME, cache.get_user(token))
+    self.assertEquals(self.ME, cache.get_user(token))
+    self.assertEquals(1, cache.tokens.hits)
+
+    # invalid tokens are remembered for a while
+    self.assertFalse(cache.is_valid('xyz'))
+    self.conn.execute('INSERT INTO oauth_access_tokens(user_id, code, token) '
+                      'VALUES("2", "asdf", "xyz")')
+    self.assertFalse(cache.is_valid('xyz'))
+    cache.tokens.put('xyz', (None, time.time() - 1))
+    self.assertEquals('2', cache.get_user('xyz'))
+
+    # ...and so are valid tokens
+    self.conn.execute('DELETE FROM oauth_access_tokens WHERE token = "xyz"')
+    self.assertEquals('2', cache.get_user('xyz'))
+    cache.tokens.put('xyz', ('2', time.time() - 1))
+    self.assertIsNone(cache.get_user('xyz'))
+
+  def test_signed_token(self):
+    self.conn.execute('INSERT INTO oauth_access_tokens(user_id, code, token) '
+                      'VALUES("2", "asdf", "opaque")')
+    oauth.BaseHandler.token_secret = 'sekrit'
+    try:
+      code = self.expect_oauth_redirect()
+      self.access_token_args['code'] = code
+      resp = self.get_response('/oauth/access_token', args=self.access_token_args)
+      token = urlparse.parse_qs(resp.body)['access_token'][0]
+      assert oauth.AccessTokenHandler.is_valid_token(self.conn, token)
+    finally:
+      oauth.BaseHandler.token_secret = None
+
+    data = oauth.verify_token('sekrit', token)
+    self.assertEquals(self.ME, data['user_id'])
+    self.assertEquals('123', data['app_id'])
+
+    # signed tokens are validated without SQLite
+    self.conn.execute('DELETE FROM oauth_access_tokens WHERE token = ?', (token,))
+    cache = oauth.TokenCache(self.conn, secret='sekrit')
+    self.assertEquals(self.ME, cache.get_user(token))
+    self.assertEquals(0, len(cache.tokens))
+    self.assertEquals('2', cache.get_user('opaque'))
+
+    payload, signature = token.split('.')
+    for bad in (token + 'x', 'x' + token, payload + '.', '.', 'a.b.c',
+                oauth.sign_token('other', self.ME, '123', time.time() + 60),
+                oauth.sign_token('sekrit', self.ME, '123', time.time() - 1)):
+      self.assertIsNone(cache.get_user(bad), bad)
+    self.assertIsNone(oauth.TokenCache(self.conn).get_user(token))
+
+  def test_dotted_opaque_token_with_secret(self):
+    # e.g. a real Facebook token saved by download.py
+    token = 'AAA.real.fb|token'
+    self.conn.execute('INSERT INTO oauth_access_tokens(user_id, code, token) '
+                      'VALUES("5", "asdf", ?)', (token,))
+    self.assertEquals('5', oauth.TokenCache(self.conn, secret='sekrit')
+                      .get_user(token))
+
+    oauth.BaseHandler.token_secret = 'sekrit'
+    try:
+      assert oauth.AccessTokenHandler.is_valid_token(self.conn, token)
+      assert not oauth.AccessTokenHandler.is_valid_token(self.conn, 'x.y')
+    finally:
+      oauth.BaseHandler.token_secret = None
+
+  def test_token_index(self):
+    plan = self.conn.execute('EXPLAIN QUERY PLAN SELECT user_id FROM '
+                             'oauth_access_tokens WHERE token = "x"').fetchall()
+    self.assertIn('oauth_access_tokens_token_index', plan[0][-1])
+
 
 if __name__ == '__main__':
   unittest.main()
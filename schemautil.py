@@ -3,14 +3,18 @@
 
 __author__ = ['Ryan Barrett <mockfacebook@ryanb.org>']
 
+import calendar
 import collections
 import copy
 import datetime
+import hashlib
 import json
 import os
 import pprint
 import re
 import sqlite3
+import struct
+import threading
 
 def thisdir(filename):
   return os.path.join(os.path.dirname(__file__), filename)
@@ -39,21 +43,261 @@ ALIAS_FIELD = 'username'
 
 DEFAULT_DB_FILE = thisdir('mockfacebook.db')
 
-def get_db(filename):
+# the number of prepared statements each connection caches. sqlite3's default
+# is 100, but the FQL and Graph API handlers generate more distinct queries.
+DEFAULT_CACHED_STATEMENTS = 500
+
+# the column in each FQL table that holds row_hash() of the other columns. it's
+# UNIQUE, which dedupes rows.
+ROW_HASH_COLUMN = '_row_hash'
+
+def get_db(filename, cached_statements=DEFAULT_CACHED_STATEMENTS):
   """Returns a SQLite db connection to the given file.
 
-  Also creates the mockfacebook and FQL schemas if they don't already exist.
+  Also creates the mockfacebook and FQL schemas and indexes if they don't
+  already exist, which upgrades db files created before the indexes were added.
+  Tables from older versions of the schemas are migrated:
+  - FQL tables without ROW_HASH_COLUMN
+  - graph_connections without the position or time columns
 
   Args:
     filename: the SQLite database file
+    cached_statements: integer, the size of the prepared statement cache
   """
-  conn = sqlite3.connect(filename)
-  for schema in MOCKFACEBOOK_SCHEMA_SQL_FILE, FQL_SCHEMA_SQL_FILE:
-    with open(schema) as f:
+  conn = sqlite3.connect(filename, cached_statements=cached_statements)
+
+  # move old tables out of the way, along with their indexes, since index names
+  # are global.
+  unhashed = unhashed_tables(conn)
+  graph_cols = (column_names(conn, 'graph_connections')
+                if 'graph_connections' in table_names(conn) else None)
+  unordered = graph_cols is not None and 'position' not in graph_cols
+  untimed = (graph_cols is not None and not unordered and
+             'time' not in graph_cols)
+  if untimed:
+    # add it now, since the schema's time index needs it
+    conn.execute('ALTER TABLE graph_connections ADD COLUMN time INTEGER')
+  for table in unhashed + (['graph_connections'] if unordered else []):
+    for (index,) in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index' "
+        "AND tbl_name = ? AND sql IS NOT NULL", (table,)).fetchall():
+      conn.execute('DROP INDEX `%s`' % index)
+    conn.execute('ALTER TABLE `%s` RENAME TO `%s_old`' % (table, table))
+
+  for schema_file in MOCKFACEBOOK_SCHEMA_SQL_FILE, FQL_SCHEMA_SQL_FILE:
+    with open(schema_file) as f:
       conn.executescript(f.read())
+
+  if unhashed:
+    schema = FqlSchema.read()
+    conn.create_function('row_hash', -1, row_hash)
+    for table in unhashed:
+      old_cols = column_names(conn, '%s_old' % table)
+      cols = schema.tables[table]
+      values = ', '.join(c.name if c.name in old_cols else "''" for c in cols)
+      conn.execute("""
+INSERT OR IGNORE INTO `%s` (%s, %s) SELECT %s, row_hash(%s) FROM `%s_old`
+""" % (table, ', '.join(c.name for c in cols), ROW_HASH_COLUMN, values, values,
+       table))
+      conn.execute('DROP TABLE `%s_old`' % table)
+
+  conn.create_function('connection_time', 1, connection_time)
+  if unordered:
+    # keep the existing rows' order
+    conn.execute("""
+INSERT INTO graph_connections (id, connection, data, position, time)
+  SELECT id, connection, data, 0, connection_time(data)
+  FROM graph_connections_old ORDER BY rowid""")
+    conn.execute('DROP TABLE graph_connections_old')
+  elif untimed:
+    conn.execute('UPDATE graph_connections SET time = connection_time(data)')
+
+  if unhashed or unordered or untimed:
+    conn.commit()
+    # reclaim the space from the old tables and their indexes
+    conn.execute('VACUUM')
+
   return conn
 
 
+def table_names(conn):
+  """Returns the names of the tables in a database.
+
+  Args:
+    conn: sqlite3.Connection
+  """
+  return [row[0] for row in
+          conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+
+
+def column_names(conn, table):
+  """Returns the names of a table's columns.
+
+  Args:
+    conn: sqlite3.Connection
+    table: string
+  """
+  return [row[1] for row in conn.execute('PRAGMA table_info(`%s`)' % table)]
+
+
+def unhashed_tables(conn):
+  """Returns the names of the FQL tables that don't have ROW_HASH_COLUMN.
+
+  Args:
+    conn: sqlite3.Connection
+  """
+  # the graph and oauth tables never have it
+  with open(MOCKFACEBOOK_SCHEMA_SQL_FILE) as f:
+    mockfacebook_tables = re.findall(r'CREATE TABLE IF NOT EXISTS (\w+)',
+                                     f.read())
+
+  candidates = [row[0] for row in conn.execute(
+      "SELECT name FROM sqlite_master WHERE type = 'table' AND instr(sql, ?) = 0 "
+      "AND name NOT LIKE 'sqlite_%%' AND name NOT IN (%s)" %
+        ','.join('?' * len(mockfacebook_tables)),
+      [ROW_HASH_COLUMN] + mockfacebook_tables)]
+  if not candidates:
+    # e.g. a new db. don't bother reading the schema.
+    return []
+
+  schema_tables = FqlSchema.read().tables
+  return [table for table in candidates if table in schema_tables]
+
+
+TIME_RE = re.compile(r"""
+  ^(\d{4})-(\d\d)-(\d\d)
+  (?:[T\ ](\d\d):(\d\d)(?::(\d\d))?)?
+  (?:Z|([+-])(\d\d):?(\d\d))?$
+  """, re.VERBOSE)
+
+def parse_time(value):
+  """Converts a Graph API time to a Unix timestamp.
+
+  Args:
+    value: ISO 8601 string, e.g. '2012-03-29T18:41:52+0000', or Unix timestamp
+      integer or string, e.g. from ?date_format=U
+
+  Returns: integer, or None if value isn't a time
+  """
+  if isinstance(value, (int, long)) and not isinstance(value, bool):
+    return value
+  elif not isinstance(value, basestring):
+    return None
+
+  value = value.strip()
+  if value.isdigit():
+    return int(value)
+
+  match = TIME_RE.match(value)
+  if not match:
+    return None
+  year, month, day, hour, minute, second, sign, tz_hour, tz_minute = \
+      match.groups()
+  timestamp = calendar.timegm([int(val or 0) for val in
+                               (year, month, day, hour, minute, second)])
+  if sign:
+    offset = int(tz_hour) * 3600 + int(tz_minute) * 60
+    timestamp += -offset if sign == '+' else offset
+  return timestamp
+
+
+def connection_time(data):
+  """Returns the time for a graph_connections row's time column.
+
+  That's its updated_time if it has one, otherwise its created_time.
+
+  Args:
+    data: JSON dict or string
+
+  Returns: integer Unix timestamp, or None
+  """
+  if isinstance(data, basestring):
+    try:
+      data = json.loads(data)
+    except ValueError:
+      return None
+  if not isinstance(data, dict):
+    return None
+
+  for field in 'updated_time', 'created_time':
+    time = parse_time(data.get(field))
+    if time is not None:
+      return time
+  return None
+
+
+def row_hash(*values):
+  """Returns a signed 64 bit integer hash of a row's column values.
+
+  Values are hashed as text, so that the hash doesn't change when SQLite's
+  column type affinity converts a value, e.g. 1 to '1' in a TEXT column.
+  """
+  parts = []
+  for val in values:
+    if val is None:
+      val = u'\x01'
+    elif isinstance(val, str):
+      val = val.decode('utf-8')
+    elif isinstance(val, bool):
+      val = int(val)
+    elif isinstance(val, float) and val.is_integer():
+      val = int(val)
+    parts.append(unicode(val))
+
+  digest = hashlib.sha1(u'\x00'.join(parts).encode('utf-8')).digest()
+  return struct.unpack('<q', digest[:8])[0]
+
+
+class ThreadLocalConnection(object):
+  """A sqlite3.Connection stand-in that uses a separate connection per thread.
+
+  sqlite3 connections can't be shared across threads or forked processes, so
+  this opens a new connection to the db file the first time each thread in
+  each process uses it. Everything else is delegated to that connection, so it
+  can be passed to the request handlers' init() methods in place of a normal
+  connection. Functions registered with create_function() are registered on
+  every connection, including ones opened later.
+
+  The schemas must already exist, e.g. via get_db(). Doesn't work with
+  :memory: databases, since each connection would get its own empty db.
+
+  Attributes:
+    filename: the SQLite database file
+    cached_statements: integer, the size of each connection's prepared
+      statement cache
+    local: threading.local that holds each thread's connection and the pid of
+      the process that opened it
+    functions: list of (name, num_params, func) tuples passed to
+      create_function()
+  """
+
+  def __init__(self, filename, cached_statements=DEFAULT_CACHED_STATEMENTS):
+    self.filename = filename
+    self.cached_statements = cached_statements
+    self.local = threading.local()
+    self.functions = []
+
+  def get(self):
+    """Returns the current thread's sqlite3.Connection, opening it if necessary.
+    """
+    # a forked child inherits the parent's threading.local, but it shouldn't
+    # use the parent's connection.
+    if getattr(self.local, 'pid', None) != os.getpid():
+      self.local.conn = sqlite3.connect(
+        self.filename, cached_statements=self.cached_statements)
+      self.local.pid = os.getpid()
+      for function in self.functions:
+        self.local.conn.create_function(*function)
+    return self.local.conn
+
+  def create_function(self, name, num_params, func):
+    self.functions.append((name, num_params, func))
+    self.get().create_function(name, num_params, func)
+
+  def __getattr__(self, attr):
+    return getattr(self.get(), attr)
+
+
 def values_to_sqlite(input):
   """Serializes Python values into a comma separated SQLite value string.
 
@@ -156,8 +400,13 @@ class Schema(PySqlFiles):
 
   Attributes:
     tables: dict mapping string table name to tuple of Column
+
+  Class attributes:
+    composite_indexes: dict mapping string table name to sequence of tuples of
+      indexable column names that are often queried together
   """
   py_attrs = ('tables',)
+  composite_indexes = {}
 
   def __init__(self, *args, **kwargs):
     super(Schema, self).__init__(*args, **kwargs)
@@ -178,25 +427,53 @@ class Schema(PySqlFiles):
         return col
 
   def to_sql(self):
-    """Returns the SQL CREATE TABLE statements for this schema.
+    """Returns the SQL CREATE TABLE and CREATE INDEX statements for this schema.
+
+    Rows are deduped by ROW_HASH_COLUMN instead of a UNIQUE constraint on all
+    columns, whose index would be as big as the table itself.
     """
     tables = []
 
     # order tables alphabetically
     for table, cols in sorted(self.tables.items()):
       col_defs = ',\n'.join('  %s %s' % (c.name, c.sqlite_type) for c in cols)
-      col_names = ', '.join(c.name for c in cols)
       tables.append("""
 CREATE TABLE IF NOT EXISTS `%s` (
 %s,
-  UNIQUE (%s)
+  %s INTEGER UNIQUE
 );
-""" % (table, col_defs, col_names))
+""" % (table, col_defs, ROW_HASH_COLUMN))
+      tables.extend(self.index_sql(table))
 
     return ''.join(tables)
 
-  def json_to_sqlite(self, object, table):
-    """Serializes a JSON object into a comma separated SQLite value string.
+  def indexes(self, table):
+    """Returns the indexes to create for a table.
+
+    Includes each composite index and each indexable column that isn't already
+    the leading column of a composite index.
+
+    Args:
+      table: string
+
+    Returns: list of tuples of string column names
+    """
+    composites = [tuple(cols) for cols in self.composite_indexes.get(table, ())]
+    leading = set(cols[0] for cols in composites)
+    return composites + [(c.name,) for c in self.tables[table]
+                         if c.indexable and c.name not in leading]
+
+  def index_sql(self, table):
+    """Returns a list of CREATE INDEX statements for a table.
+
+    They use IF NOT EXISTS, so get_db() adds them to existing databases.
+    """
+    return ['CREATE INDEX IF NOT EXISTS `%s_%s_index` ON `%s` (%s);\n' %
+            (table, '_'.join(cols), table, ', '.join(cols))
+            for cols in self.indexes(table)]
+
+  def json_to_values(self, object, table):
+    """Converts a JSON object into a list of SQLite column values.
   
     The order of the values will match the order of the columns in the schema.
 
@@ -204,7 +481,7 @@ CREATE TABLE IF NOT EXISTS `%s` (
       object: decoded JSON dict
       table: string
   
-    Returns: string
+    Returns: list
     """
     columns = self.tables[table]
     values = []
@@ -216,7 +493,20 @@ CREATE TABLE IF NOT EXISTS `%s` (
         val = json.dumps(val)
       values.append(val)
   
-    return values_to_sqlite(values)
+    return values
+
+  def json_to_sqlite(self, object, table):
+    """Serializes a JSON object into a comma separated SQLite value string.
+  
+    The order of the values will match the order of the columns in the schema.
+
+    Args:
+      object: decoded JSON dict
+      table: string
+  
+    Returns: string
+    """
+    return values_to_sqlite(self.json_to_values(object, table))
 
   def sqlite_to_json(self, cursor, table):
     """Converts SQLite query results to JSON result objects.
@@ -230,11 +520,24 @@ CREATE TABLE IF NOT EXISTS `%s` (
     Returns:
       list of dicts representing JSON result objects
     """
-    colnames = [d[0] for d in cursor.description]
+    return self.rows_to_json([d[0] for d in cursor.description],
+                             cursor.fetchall(), table)
+
+  def rows_to_json(self, colnames, rows, table):
+    """Converts SQLite result rows to JSON result objects.
+
+    Args:
+      colnames: sequence of string column names
+      rows: sequence of row tuples
+      table: string
+
+    Returns:
+      list of dicts representing JSON result objects
+    """
     columns = [self.get_column(table, name) for name in colnames]
     objects = []
 
-    for row in cursor.fetchall():
+    for row in rows:
       object = {}
       for colname, column, val in zip(colnames, columns, row):
         # by default, use the SQLite type
@@ -255,6 +558,14 @@ CREATE TABLE IF NOT EXISTS `%s` (
 class FqlSchema(Schema):
   """The FQL schema.
   """
+  composite_indexes = {
+    'event_member': [('uid', 'eid')],
+    'friend': [('uid1', 'uid2')],
+    'friendlist_member': [('flid', 'uid')],
+    'group_member': [('uid', 'gid')],
+    'page_admin': [('uid', 'page_id')],
+    }
+
   def __init__(self):
     super(FqlSchema, self).__init__(FQL_SCHEMA_PY_FILE, FQL_SCHEMA_SQL_FILE)
 
@@ -335,12 +646,14 @@ class FqlDataset(Dataset):
 -- %s
 """ % (table, data.query))
 
-      columns_str = ', '.join('`%s`' % col.name
-                              for col in self.schema.tables[table])
+      columns_str = ', '.join(['`%s`' % col.name
+                               for col in self.schema.tables[table]] +
+                              [ROW_HASH_COLUMN])
       for object in data.data:
         # order columns to match schema (which is the order in FQL docs)
         try:
-            values_str = self.schema.json_to_sqlite(object, table)
+            values = self.schema.json_to_values(object, table)
+            values_str = values_to_sqlite(values + [row_hash(*values)])
         except:
             continue
         output.append("""\
@@ -385,11 +698,17 @@ class GraphDataset(Dataset):
       output.append(self.make_insert('graph_objects',
                                      id, alias, json.dumps(data.data)))
 
-    # connections
+    # connections. replace each one's rows, so that loading the same data again
+    # doesn't duplicate them. POSTed rows have negative positions and are kept.
     for conn in self.connections.values():
-      for object in conn.data['data']:
-        output.append(self.make_insert('graph_connections',
-                                       conn.id, conn.name, json.dumps(object)))
+      output.append(
+        'DELETE FROM graph_connections WHERE id = %s AND connection = %s '
+        'AND position >= 0;' %
+        (values_to_sqlite([conn.id]), values_to_sqlite([conn.name])))
+      for position, object in enumerate(conn.data['data']):
+        output.append(self.make_insert('graph_connections', conn.id, conn.name,
+                                       json.dumps(object), position,
+                                       connection_time(object)))
 
     output.append('COMMIT;')
     return '\n'.join(output)
@@ -0,0 +1,153 @@
+#!/usr/bin/python
+"""Unit tests for schemautil.py.
+"""
+
+__author__ = ['Ryan Barrett <mockfacebook@ryanb.org>']
+
+import sqlite3
+import unittest
+
+import schemautil
+import testutil
+
+
+class SchemaUtilTest(unittest.TestCase):
+
+  def test_row_hash(self):
+    self.assertEquals(schemautil.row_hash(1, 'x', True),
+                      schemautil.row_hash('1', u'x', 1.0))
+    self.assertNotEquals(schemautil.row_hash(None), schemautil.row_hash(''))
+    self.assertNotEquals(schemautil.row_hash('a', 'b'),
+                         schemautil.row_hash('ab', ''))
+
+  def test_parse_time(self):
+    self.assertEquals(1333046512,
+                      schemautil.parse_time('2012-03-29T18:41:52+0000'))
+    self.assertEquals(1333046512,
+                      schemautil.parse_time('2012-03-29T11:41:52-07:00'))
+    self.assertEquals(1333046512, schemautil.parse_time('1333046512'))
+    self.assertEquals(1333046512, schemautil.parse_time(1333046512))
+    self.assertEquals(1332979200, schemautil.parse_time('2012-03-29'))
+    for value in None, '', 'yesterday', True, {}:
+      self.assertIsNone(schemautil.parse_time(value))
+
+    self.assertEquals(1332979200, schemautil.connection_time(
+        {'created_time': '2012-03-29', 'updated_time': 'x'}))
+    self.assertEquals(1333046512, schemautil.connection_time(
+        '{"created_time": "2012-03-29", "updated_time": 1333046512}'))
+    self.assertIsNone(schemautil.connection_time('"http://picture"'))
+
+  def test_dataset_dedupes_rows(self):
+    dataset = schemautil.FqlDataset()
+    dataset.data['profile'] = schemautil.Data(
+      table='profile', query='SELECT ...',
+      data=[{'id': 1, 'username': 'alice', 'can_post': True},
+            {'id': 1, 'username': 'alice', 'can_post': True},
+            {'id': 2, 'username': 'bob', 'pic_crop': {'uri': 'x'}}])
+
+    conn = schemautil.get_db(':memory:')
+    conn.executescript(dataset.to_sql())
+    conn.executescript(dataset.to_sql())
+    self.assertEquals([(1, 'alice'), (2, 'bob')], conn.execute(
+        'SELECT id, username FROM profile ORDER BY id').fetchall())
+
+
+  def test_graph_dataset_replaces_connections(self):
+    dataset = schemautil.GraphDataset()
+    dataset.connections['1 albums'] = schemautil.Connection(
+      table=None, id='1', name='albums', data={'data': [{'id': '4'}, {'id': '3'}]})
+
+    conn = schemautil.get_db(':memory:')
+    conn.executescript(dataset.to_sql())
+    conn.executescript(dataset.to_sql())
+    self.assertEquals([('{"id": "4"}', 0), ('{"id": "3"}', 1)], conn.execute(
+        'SELECT data, position FROM graph_connections ORDER BY rowid').fetchall())
+
+
+class MigrationTest(testutil.TempDbTest):
+  """Opens db files created with old schemas.
+  """
+
+  def test_current_db_doesnt_read_fql_schema(self):
+    schemautil.get_db(self.db_filename).close()
+
+    orig_read = schemautil.FqlSchema.read
+    def read():
+      self.fail('FqlSchema.read() called')
+    schemautil.FqlSchema.read = staticmethod(read)
+    try:
+      conn = schemautil.get_db(self.db_filename)
+      self.assertEquals([], schemautil.unhashed_tables(conn))
+    finally:
+      schemautil.FqlSchema.read = orig_read
+
+  def test_migrate_unhashed_tables(self):
+    conn = sqlite3.connect(self.db_filename)
+    conn.executescript("""
+CREATE TABLE profile (id INTEGER, username TEXT, pic_crop,
+                      UNIQUE (id, username, pic_crop));
+CREATE INDEX profile_id_index ON profile (id);
+INSERT INTO profile VALUES (1, 'alice', '{"uri": "x"}');
+INSERT INTO profile VALUES (2, 'bob', NULL);
+INSERT INTO profile VALUES (2, 'bob', NULL);
+""")
+    conn.commit()
+    conn.close()
+
+    conn = schemautil.get_db(self.db_filename)
+    cols = [row[1] for row in conn.execute('PRAGMA table_info(profile)')]
+    self.assertIn(schemautil.ROW_HASH_COLUMN, cols)
+    self.assertEquals([(1, 'alice'), (2, 'bob')], conn.execute(
+        'SELECT id, username FROM profile ORDER BY id').fetchall())
+    self.assertEquals([], schemautil.unhashed_tables(conn))
+
+    # loading the same row from a dataset is deduped against migrated rows
+    dataset = schemautil.FqlDataset()
+    dataset.data['profile'] = schemautil.Data(
+      table='profile', query='SELECT ...',
+      data=[{'id': 1, 'username': 'alice', 'pic_crop': {'uri': 'x'}}])
+    conn.executescript(dataset.to_sql())
+    self.assertEquals(2, conn.execute('SELECT COUNT(*) FROM profile').fetchone()[0])
+    conn.close()
+
+  def test_migrate_unordered_graph_connections(self):
+    conn = sqlite3.connect(self.db_filename)
+    conn.executescript("""
+CREATE TABLE graph_connections (id TEXT NOT NULL, connection TEXT NOT NULL,
+                                data TEXT NOT NULL,
+                                UNIQUE(id, connection, data));
+INSERT INTO graph_connections VALUES ('1', 'albums', '{"id": "4"}');
+INSERT INTO graph_connections VALUES ('1', 'albums',
+  '{"id": "3", "created_time": 1333046512}');
+""")
+    conn.commit()
+    conn.close()
+
+    conn = schemautil.get_db(self.db_filename)
+    self.assertEquals([('{"id": "4"}', 0, None),
+                       ('{"id": "3", "created_time": 1333046512}', 0, 1333046512)],
+                      conn.execute('SELECT data, position, time '
+                                   'FROM graph_connections ORDER BY rowid').fetchall())
+    self.assertNotIn('graph_connections_old', schemautil.table_names(conn))
+    conn.close()
+
+  def test_migrate_untimed_graph_connections(self):
+    conn = sqlite3.connect(self.db_filename)
+    conn.executescript("""
+CREATE TABLE graph_connections (id TEXT NOT NULL, connection TEXT NOT NULL,
+                                data TEXT NOT NULL,
+                                position INTEGER NOT NULL DEFAULT 0);
+INSERT INTO graph_connections VALUES ('1', 'feed',
+  '{"id": "3", "updated_time": "2012-03-29T18:41:52+0000"}', 5);
+""")
+    conn.commit()
+    conn.close()
+
+    conn = schemautil.get_db(self.db_filename)
+    self.assertEquals([(5, 1333046512)], conn.execute(
+        'SELECT position, time FROM graph_connections').fetchall())
+    conn.close()
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -4,20 +4,31 @@
 https://github.com/rogerhu/mockfacebook
 
 Top-level HTTP server:
-  server.py [--port PORT] [--me USER_ID] [--file SQLITE_DB_FILE]
+  server.py [--port PORT] [--me USER_ID] [--file SQLITE_DB_FILE] [--threads N]
+            [--workers N] [--async] [--keep_alive]
 """
 
 __author__ = ['Ryan Barrett <mockfacebook@ryanb.org>']
 
+import errno
 import itertools
+import json
 import logging
 import optparse
+import os
+import Queue
+import signal
+import socket
+import SocketServer
 import sqlite3
 import sys
+import threading
 import wsgiref.simple_server
 
 import webapp2
 
+import asyncserver
+import batch
 import fql
 import app
 import graph
@@ -33,6 +44,9 @@ options = None
 # if there are fewer than this many FQL or Graph API rows, print a warning.
 ROW_COUNT_WARNING_THRESHOLD = 10
 
+# how long to wait for the next request on a keep-alive connection, in seconds
+KEEP_ALIVE_TIMEOUT = 15
+
 
 # order matters here! the first handler with a matching route is used.
 HANDLER_CLASSES = (
@@ -40,15 +54,325 @@ HANDLER_CLASSES = (
   oauth.AuthCodeHandler,
   oauth.AccessTokenHandler,
   fql.FqlHandler,
+  # before GraphHandler, since it handles POST /
+  batch.BatchHandler,
   # note that this also includes the front page
   graph.GraphHandler,
   )
 
 
+class ThreadPoolMixIn(SocketServer.ThreadingMixIn):
+  """Mix-in class that handles requests with a fixed pool of worker threads.
+
+  SocketServer.ThreadingMixIn starts a new thread for every request. This
+  reuses the same threads instead, which also means that each thread's SQLite
+  connection (see schemautil.ThreadLocalConnection) is reused.
+
+  Attributes:
+    num_threads: integer
+    requests: Queue of (request, client_address) tuples waiting to be handled
+  """
+  num_threads = 1
+  requests = None
+
+  def start_threads(self):
+    self.requests = Queue.Queue()
+    for i in range(self.num_threads):
+      thread = threading.Thread(target=self.process_requests,
+                                name='worker %d' % i)
+      thread.daemon = True
+      thread.start()
+
+  def process_request(self, request, client_address):
+    if self.requests is None:
+      self.start_threads()
+    self.requests.put((request, client_address))
+
+  def process_requests(self):
+    """Worker thread loop. Runs forever.
+    """
+    while True:
+      self.process_request_thread(*self.requests.get())
+
+
+class ThreadPoolWSGIServer(ThreadPoolMixIn, wsgiref.simple_server.WSGIServer):
+  pass
+
+
+class PreforkServer(object):
+  """Runs a server in several forked worker processes.
+
+  The listening socket is bound before forking, so all of the workers accept
+  connections on the same port. Workers that die are restarted. Supports the
+  serve_forever(), shutdown(), and server_close() methods from
+  SocketServer.BaseServer.
+
+  Attributes:
+    server: the SocketServer.BaseServer that each worker runs
+    num_workers: integer
+    pids: list of integer worker process ids
+    stopping: Event, set when shutdown() is called
+    stopped: Event, set when the workers have been stopped
+  """
+
+  def __init__(self, server, num_workers):
+    self.server = server
+    self.num_workers = num_workers
+    self.pids = []
+    self.stopping = threading.Event()
+    self.stopped = threading.Event()
+
+  def serve_forever(self, poll_interval=SERVER_POLL_INTERVAL):
+    # the workers all wake up when a connection arrives, but only one accepts
+    # it. the others shouldn't block in accept().
+    self.server.socket.setblocking(False)
+
+    try:
+      while not self.stopping.is_set():
+        while len(self.pids) < self.num_workers:
+          self.fork_worker(poll_interval)
+        self.reap_workers()
+        self.stopping.wait(poll_interval)
+    finally:
+      for pid in self.pids:
+        try:
+          os.kill(pid, signal.SIGTERM)
+          os.waitpid(pid, 0)
+        except OSError, e:
+          # the worker already exited and was reaped
+          if e.errno not in (errno.ECHILD, errno.ESRCH):
+            raise
+      self.pids = []
+      self.stopped.set()
+
+  def reap_workers(self):
+    """Removes workers that have exited from pids. Doesn't block.
+
+    Only waits on the workers, not any other children of this process.
+    """
+    for pid in list(self.pids):
+      try:
+        exited, status = os.waitpid(pid, os.WNOHANG)
+      except OSError, e:
+        if e.errno != errno.ECHILD:
+          raise
+        # already reaped, e.g. by a SIGCHLD handler
+        exited, status = pid, 0
+      if exited:
+        logging.warning('Worker %d exited with status %d. Restarting.' %
+                        (pid, status))
+        self.pids.remove(pid)
+
+  def fork_worker(self, poll_interval):
+    """Forks a worker process that serves until it's killed.
+    """
+    pid = os.fork()
+    if pid:
+      self.pids.append(pid)
+      return
+
+    try:
+      signal.signal(signal.SIGTERM, signal.SIG_DFL)
+      self.server.serve_forever(poll_interval=poll_interval)
+    except:
+      logging.exception('Worker %d failed.' % os.getpid())
+    finally:
+      # never return into the parent's code
+      os._exit(1)
+
+  def shutdown(self):
+    self.stopping.set()
+    self.stopped.wait()
+
+  def server_close(self):
+    self.server.server_close()
+
+
+class RequestBody(object):
+  """A wsgi.input file object that reads at most a given number of bytes.
+
+  On a persistent connection, the request body must be fully consumed, and
+  only the body, so that the next request can be read. The application may
+  not read it all, so the server calls drain() once the response is done.
+
+  Attributes:
+    file: file object
+    remaining: integer, number of body bytes not yet read
+  """
+
+  def __init__(self, file, length):
+    self.file = file
+    self.remaining = length
+
+  def read(self, size=-1):
+    if size < 0 or size > self.remaining:
+      size = self.remaining
+    data = self.file.read(size)
+    self.remaining -= len(data)
+    return data
+
+  def readline(self, size=-1):
+    if size < 0 or size > self.remaining:
+      size = self.remaining
+    data = self.file.readline(size)
+    self.remaining -= len(data)
+    return data
+
+  def readlines(self, hint=None):
+    return list(self)
+
+  def __iter__(self):
+    return iter(self.readline, '')
+
+  def drain(self):
+    while self.read(8192):
+      pass
+
+
+class KeepAliveServerHandler(wsgiref.simple_server.ServerHandler):
+  """Writes HTTP/1.1 responses with Content-Length or chunked framing.
+
+  If the response length isn't known up front, HTTP/1.1 clients get a chunked
+  response. HTTP/1.0 clients get the response unframed, and the connection
+  is closed afterward.
+
+  Responses to HEAD requests have headers, including Content-Length if the
+  application sets it, but no body.
+
+  Attributes:
+    chunked: boolean, whether the response body is chunked
+  """
+  http_version = '1.1'
+  chunked = False
+
+  def cleanup_headers(self):
+    wsgiref.simple_server.ServerHandler.cleanup_headers(self)
+
+    if self.environ['REQUEST_METHOD'] == 'HEAD':
+      pass  # no body, so no framing
+    elif ('Content-Length' not in self.headers and
+        self.request_handler.request_version == 'HTTP/1.1'):
+      self.headers['Transfer-Encoding'] = 'chunked'
+      self.chunked = True
+    elif 'Content-Length' not in self.headers:
+      self.request_handler.close_connection = 1
+
+    if self.request_handler.close_connection:
+      self.headers['Connection'] = 'close'
+
+  def write(self, data):
+    if self.status and not self.headers_sent:
+      # send the headers first so that we know whether to chunk
+      self.bytes_sent = len(data)
+      self.send_headers()
+      self.bytes_sent = 0
+
+    if self.environ['REQUEST_METHOD'] == 'HEAD':
+      return
+    elif self.chunked:
+      if not data:
+        return  # an empty chunk would end the response
+      data = '%x\r\n%s\r\n' % (len(data), data)
+
+    wsgiref.simple_server.ServerHandler.write(self, data)
+
+  def finish_content(self):
+    wsgiref.simple_server.ServerHandler.finish_content(self)
+    if self.chunked:
+      self._write('0\r\n\r\n')
+      self._flush()
+
+
+class KeepAliveRequestHandler(wsgiref.simple_server.WSGIRequestHandler):
+  """Speaks HTTP/1.1 and serves multiple requests per connection.
+
+  Pipelined requests are read from the connection's input buffer in order.
+  Idle connections are closed after KEEP_ALIVE_TIMEOUT seconds.
+  """
+  protocol_version = 'HTTP/1.1'
+  timeout = KEEP_ALIVE_TIMEOUT
+
+  def handle(self):
+    self.close_connection = 1
+    self.handle_one_request()
+    while not self.close_connection:
+      self.handle_one_request()
+
+  def handle_one_request(self):
+    try:
+      self.raw_requestline = self.rfile.readline(65537)
+    except socket.timeout:
+      self.close_connection = 1
+      return
+
+    if not self.raw_requestline:
+      self.close_connection = 1
+      return
+    elif len(self.raw_requestline) > 65536:
+      self.requestline = self.request_version = self.command = ''
+      self.send_error(414)
+      self.close_connection = 1
+      return
+    elif not self.parse_request():
+      return
+
+    if 'chunked' in self.headers.get('Transfer-Encoding', '').lower():
+      # we don't support chunked request bodies
+      self.send_error(411)
+      self.close_connection = 1
+      return
+
+    try:
+      length = int(self.headers.get('Content-Length') or 0)
+    except ValueError:
+      self.send_error(400)
+      self.close_connection = 1
+      return
+
+    expect = self.headers.get('Expect', '').lower()
+    if expect and expect != '100-continue':
+      self.send_error(417)
+      self.close_connection = 1
+      return
+    elif expect and length > 0 and self.request_version == 'HTTP/1.1':
+      # the client waits for this before it sends the body
+      self.wfile.write('HTTP/1.1 100 Continue\r\n\r\n')
+      self.wfile.flush()
+
+    body = RequestBody(self.rfile, length)
+    handler = KeepAliveServerHandler(body, self.wfile, self.get_stderr(),
+                                     self.get_environ())
+    handler.request_handler = self
+    handler.run(self.server.get_app())
+    body.drain()
+
+
+class CacheStatsHandler(webapp2.RequestHandler):
+  """Serves the in-memory caches' sizes and hit and miss counts, for debugging.
+
+  With --workers, each worker process has its own caches, so this only shows
+  the stats for the worker that handles the request.
+  """
+
+  def get(self):
+    self.response.headers['Content-Type'] = 'text/plain; charset=utf-8'
+    self.response.write(json.dumps(cache_stats(), indent=2))
+
+
+def cache_stats():
+  """Returns a dict mapping cache name to its LruCache.stats() dict.
+  """
+  return {'fql_translations': fql.FqlHandler.cache.stats(),
+          'graph_objects': graph.GraphHandler.object_cache.stats(),
+          }
+
+
 def application():
   """Returns the WSGIApplication to run.
   """
-  routes = list(itertools.chain(*[cls.ROUTES for cls in HANDLER_CLASSES]))
+  # before GraphHandler, which would treat the path as an object id
+  routes = [('/_cache_stats', CacheStatsHandler)]
+  routes += itertools.chain(*[cls.ROUTES for cls in HANDLER_CLASSES])
   return webapp2.WSGIApplication(routes, debug=True)
 
 
@@ -63,6 +387,68 @@ def parse_args(argv):
                     help='SQLite database file (default %default)')
   parser.add_option('--me', type='str', default='',
                     help='user id that me() should return (default %default)')
+  parser.add_option('--threads', type='int', default=0,
+                    help='number of worker threads. if 0, requests are handled '
+                    'one at a time in the main thread. (default %default)')
+  parser.add_option('--workers', type='int', default=0,
+                    help='number of worker processes to fork. if 0, requests '
+                    'are handled in this process. can be combined with '
+                    '--threads. (default %default)')
+  parser.add_option('--async', action='store_true', dest='use_async',
+                    default=False,
+                    help='use an event driven server that handles all '
+                    'connections in one thread and runs requests in a pool '
+                    'of --threads threads (default %d).' %
+                    asyncserver.AsyncWSGIServer.num_threads)
+  parser.add_option('--fql_cache_size', type='int',
+                    default=fql.FqlHandler.cache_size,
+                    help='number of translated FQL queries to cache. '
+                    '(default %default)')
+  parser.add_option('--graph_cache_size', type='int',
+                    default=graph.GraphHandler.object_cache_size,
+                    help='memory budget for caching decoded Graph API objects, '
+                    'in bytes of the objects\' JSON. 0 turns it off. cached '
+                    'objects are checked against SQLite\'s rowid and data '
+                    'length on each request, so an object edited directly in '
+                    'SQLite without changing its length stays stale until it\'s '
+                    'evicted or the server restarts. (default %default)')
+  parser.add_option('--name_index', action='store_true', default=False,
+                    help='load all Graph API object ids and aliases into '
+                    'memory at startup, so that names can be resolved without '
+                    'querying SQLite. names that aren\'t in memory, e.g. added '
+                    'by other --workers, are still looked up in SQLite.')
+  parser.add_option('--max_ids', type='int',
+                    default=graph.GraphHandler.max_ids,
+                    help='maximum number of ids in a Graph API ?ids= request. '
+                    '(default %default)')
+  parser.add_option('--multiquery_threads', type='int',
+                    default=fql.FqlHandler.num_threads,
+                    help='number of threads that run the queries in an FQL '
+                    'multiquery concurrently. only used with --threads, '
+                    '--workers, or --async. (default %default)')
+  parser.add_option('--batch_threads', type='int',
+                    default=batch.BatchHandler.num_threads,
+                    help='number of threads that run the requests in a Graph '
+                    'API batch concurrently. only used with --threads, '
+                    '--workers, or --async, since each thread needs its own '
+                    'SQLite connection. (default %default)')
+  parser.add_option('--default_limit', type='int',
+                    help='page size for Graph API connection requests without '
+                    'a limit query parameter. (default: return the whole '
+                    'connection)')
+  parser.add_option('--token_secret',
+                    help='sign new OAuth access tokens with this secret, so '
+                    'that they can be validated without querying SQLite. '
+                    'unsigned tokens still work. (default: issue unsigned '
+                    'tokens)')
+  parser.add_option('--cached_statements', type='int',
+                    default=schemautil.DEFAULT_CACHED_STATEMENTS,
+                    help='number of prepared statements each SQLite connection '
+                    'caches. (default %default)')
+  parser.add_option('--keep_alive', action='store_true', default=False,
+                    help='speak HTTP/1.1 and keep connections open for more '
+                    'requests. best with --threads, since each open connection '
+                    'ties up a thread. (--async always does this.)')
 
   options, args = parser.parse_args(args=argv)
   logging.debug('Command line options: %s' % options)
@@ -89,7 +475,32 @@ def main(args, started=None):
   parse_args(args)
   print 'Options: %s' % options
 
-  conn = schemautil.get_db(options.db_file)
+  conn = schemautil.get_db(options.db_file,
+                           cached_statements=options.cached_statements)
+  if options.workers > 0:
+    # lets readers in each worker run concurrently with a writer, and makes
+    # each commit visible to the other workers' connections right away
+    conn.execute('PRAGMA journal_mode=WAL')
+
+  server_class = wsgiref.simple_server.WSGIServer
+  if options.threads > 0:
+    server_class = ThreadPoolWSGIServer
+
+  if options.threads > 0 or options.workers > 0 or options.use_async:
+    # each worker thread and process gets its own connection
+    conn.close()
+    conn = schemautil.ThreadLocalConnection(
+      options.db_file, cached_statements=options.cached_statements)
+
+  fql.FqlHandler.cache_size = options.fql_cache_size
+  fql.FqlHandler.num_threads = options.multiquery_threads
+  graph.GraphHandler.object_cache_size = options.graph_cache_size
+  graph.GraphHandler.use_name_index = options.name_index
+  graph.GraphHandler.max_ids = options.max_ids
+  graph.GraphHandler.default_limit = options.default_limit
+  batch.BatchHandler.num_threads = options.batch_threads
+  oauth.BaseHandler.token_secret = options.token_secret
+  oauth.BaseHandler.init_tokens(conn)
   for cls in HANDLER_CLASSES:
     cls.init(conn, options.me)
 
@@ -97,7 +508,20 @@ def main(args, started=None):
   warn_if_no_data(conn)
 
   global server  # for server_test.ServerTest
-  server = wsgiref.simple_server.make_server('', options.port, application())
+  if options.use_async:
+    server = asyncserver.AsyncWSGIServer(('', options.port), application())
+    server.idle_timeout = KEEP_ALIVE_TIMEOUT
+  else:
+    handler_class = wsgiref.simple_server.WSGIRequestHandler
+    if options.keep_alive:
+      handler_class = KeepAliveRequestHandler
+    server = wsgiref.simple_server.make_server('', options.port, application(),
+                                               server_class=server_class,
+                                               handler_class=handler_class)
+  if options.threads > 0:
+    server.num_threads = options.threads
+  if options.workers > 0:
+    server = PreforkServer(server, options.workers)
 
   print 'Serving on port %d...' % options.port
   if started:
@@ -4,9 +4,14 @@
 
 __author__ = ['Ryan Barrett <mockfacebook@ryanb.org>']
 
+import httplib
 import json
+import logging
 import os
 import re
+import socket
+import StringIO
+import subprocess
 import threading
 import unittest
 import urllib
@@ -14,6 +19,7 @@ import urllib2
 import urlparse
 import warnings
 
+import asyncserver
 import fql_test
 import graph_test
 import schemautil
@@ -52,6 +58,7 @@ class ServerTest(unittest.TestCase):
   """
 
   PORT = 60000
+  ARGS = []  # extra command line args for server.main()
   db_filename = None
   thread = None
 
@@ -70,13 +77,14 @@ class ServerTest(unittest.TestCase):
       args=(['--db_file', self.db_filename,
              '--port', str(self.PORT),
              '--me', '1',
-             ],),
+             ] + self.ARGS,),
       kwargs={'started': started})
     self.thread.start()
     started.wait()
 
   def tearDown(self):
     server.server.shutdown()
+    server.server.server_close()
     self.thread.join()
 
     try:
@@ -190,6 +198,299 @@ class ServerTest(unittest.TestCase):
     except urllib2.HTTPError, e:
       self.assertEquals(404, e.code)
 
+  def _test_cache_stats(self):
+    # unfiltered /<id> requests don't use the object cache, but ?ids= does
+    for i in range(2):
+      get_data(self.PORT, '/', {'ids': '1'})
+    stats = json.loads(get_data(self.PORT, '/_cache_stats', {}))
+    self.assertEquals(set(['fql_translations', 'graph_objects']), set(stats))
+    self.assertEquals(set(['entries', 'size', 'max_size', 'hits', 'misses']),
+                      set(stats['fql_translations']))
+    self.assertTrue(stats['graph_objects']['hits'] > 0, stats)
+
+  def _test_keep_alive(self):
+    conn = httplib.HTTPConnection('localhost', self.PORT)
+    for i in range(3):
+      conn.request('GET', '/1')
+      resp = conn.getresponse()
+      self.assertEquals(200, resp.status)
+      self.assertEquals({'foo': 'bar', 'id': '1'}, json.loads(resp.read()))
+
+    # the handler doesn't read this request's body, but the server should
+    conn.request('DELETE', '/clear', 'unused body')
+    self.assertEquals({'response': 'ok'}, json.loads(conn.getresponse().read()))
+    conn.request('GET', '/1')
+    self.assertEquals({'foo': 'bar', 'id': '1'},
+                      json.loads(conn.getresponse().read()))
+    conn.close()
+
+  def _test_pipelining(self):
+    sock = socket.create_connection(('localhost', self.PORT))
+    sock.sendall('GET /1 HTTP/1.1\r\nHost: localhost\r\n\r\n'
+                 'GET /bob/albums HTTP/1.1\r\nHost: localhost\r\n'
+                 'Connection: close\r\n\r\n')
+    resp = ''
+    while True:
+      data = sock.recv(4096)
+      if not data:
+        break
+      resp += data
+    sock.close()
+
+    bodies = [part.split('\r\n\r\n', 1)[1]
+              for part in resp.split('HTTP/1.1 200 OK\r\n')[1:]]
+    self.assertEquals([{'foo': 'bar', 'id': '1'}, {'data': [{'id': '5'}]}],
+                      [json.loads(body) for body in bodies])
+
+  def _test_idle_timeout(self):
+    server.server.idle_timeout = 0.2  # async server
+    timeout = server.KeepAliveRequestHandler.timeout
+    server.KeepAliveRequestHandler.timeout = 0.2
+    try:
+      sock = socket.create_connection(('localhost', self.PORT))
+      sock.settimeout(10)
+      self.assertEquals('', sock.recv(4096))
+      sock.close()
+    finally:
+      server.KeepAliveRequestHandler.timeout = timeout
+
+  def send_raw(self, *requests):
+    """Sends raw request data and returns everything the server sends back
+    before it closes the connection.
+
+    Args:
+      requests: strings. each one is sent after the server responds to the
+        previous one.
+    """
+    sock = socket.create_connection(('localhost', self.PORT))
+    sock.settimeout(10)
+    resp = ''
+    for request in requests:
+      sock.sendall(request)
+      if request is not requests[-1]:
+        resp += sock.recv(4096)
+    while True:
+      data = sock.recv(4096)
+      if not data:
+        break
+      resp += data
+    sock.close()
+    return resp
+
+  def _test_bad_content_length(self):
+    resp = self.send_raw('POST /1 HTTP/1.1\r\nHost: localhost\r\n'
+                         'Content-Length: abc\r\n\r\n')
+    self.assertTrue(resp.startswith('HTTP/1.1 400 Bad Request\r\n'), resp)
+
+  def _test_chunked_request(self):
+    # the chunk shouldn't be read as another request
+    resp = self.send_raw('POST /3/feed HTTP/1.1\r\nHost: localhost\r\n'
+                         'Transfer-Encoding: chunked\r\n\r\n'
+                         '11\r\nGET /1 HTTP/1.1\r\n\r\n\r\n0\r\n\r\n')
+    self.assertTrue(resp.startswith('HTTP/1.1 411 Length Required\r\n'), resp)
+    self.assertEquals(1, resp.count('HTTP/1.1'), resp)
+
+  def _test_expect_continue(self):
+    resp = self.send_raw('DELETE /clear HTTP/1.1\r\nHost: localhost\r\n'
+                         'Expect: 100-continue\r\nContent-Length: 1\r\n'
+                         'Connection: close\r\n\r\n',
+                         'x')
+    self.assertTrue(resp.startswith('HTTP/1.1 100 Continue\r\n\r\n'
+                                    'HTTP/1.1 200 OK\r\n'), resp)
+
+    resp = self.send_raw('GET /1 HTTP/1.1\r\nHost: localhost\r\n'
+                         'Expect: something-else\r\n\r\n')
+    self.assertTrue(resp.startswith('HTTP/1.1 417 Expectation Failed\r\n'),
+                    resp)
+
+
+  def _test_head(self):
+    # the second request shows where the HEAD response ended
+    resp = self.send_raw('HEAD /1 HTTP/1.1\r\nHost: localhost\r\n\r\n',
+                         'GET /1 HTTP/1.1\r\nHost: localhost\r\n'
+                         'Connection: close\r\n\r\n')
+    head, get = resp.split('\r\n\r\n', 1)
+    self.assertTrue(head.startswith('HTTP/1.1 '), head)
+    self.assertIn('Content-Length: ', head)
+    self.assertTrue(get.startswith('HTTP/1.1 200 OK\r\n'), resp)
+
+
+class ThreadedServerTest(ServerTest):
+  """Runs the server with a thread pool and makes concurrent requests.
+  """
+
+  ARGS = ['--threads', '4']
+
+  def test_all(self):
+    self._test_post_and_delete()
+
+    errors = []
+    def test_graph():
+      try:
+        for i in range(10):
+          self._test_graph()
+      except Exception, e:
+        errors.append(e)
+
+    threads = [threading.Thread(target=test_graph) for i in range(8)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEquals([], errors)
+
+    self._test_404()
+    self._test_cache_stats()
+
+
+class PreforkServerTest(ServerTest):
+  """Runs the server in multiple worker processes.
+  """
+
+  ARGS = ['--workers', '3', '--threads', '2']
+
+  def test_all(self):
+    for i in range(10):
+      self._test_graph()
+    self._test_404()
+
+  def test_reap_workers(self):
+    prefork = server.PreforkServer(None, 2)
+    for status in 0, 3:
+      pid = os.fork()
+      if not pid:
+        os._exit(status)
+      prefork.pids.append(pid)
+    os.waitpid(prefork.pids[0], 0)  # reaped by someone else
+
+    # a child that isn't a worker
+    other = subprocess.Popen(['true'])
+    other_pid = other.pid
+    while prefork.pids:
+      prefork.reap_workers()
+    self.assertEquals(other_pid, os.waitpid(other_pid, 0)[0])
+
+
+class AsyncServerTest(ServerTest):
+  """Runs the event driven server.
+  """
+
+  ARGS = ['--async', '--threads', '4']
+
+  def test_all(self):
+    self._test_post_and_delete()
+    self._test_graph()
+    self._test_404()
+    self._test_keep_alive()
+    self._test_pipelining()
+    self._test_bad_content_length()
+    self._test_chunked_request()
+    self._test_expect_continue()
+    self._test_head()
+    self._test_idle_timeout()
+
+
+class AsyncChannelTest(unittest.TestCase):
+  """Unit tests for asyncserver.Channel.
+  """
+
+  def test_app_without_start_response(self):
+    responses = []
+
+    class FakeTrigger(object):
+      def call_soon(self, fn, *args):
+        responses.append(args)
+
+    class FakeServer(object):
+      app = staticmethod(lambda environ, start_response: ['foo'])
+      server_address = ('localhost', 0)
+      trigger = FakeTrigger()
+
+    class FakeChannel(asyncserver.Channel):
+      def __init__(self):
+        self.server = FakeServer()
+        self.client_address = ('127.0.0.1', 0)
+
+    channel = FakeChannel()
+    request = asyncserver.Request('GET', '/', 'HTTP/1.1', [])
+
+    logging.disable(logging.ERROR)
+    try:
+      channel.run_app(request)
+    finally:
+      logging.disable(logging.NOTSET)
+
+    self.assertEquals([(request, '500 Internal Server Error',
+                        [('Content-Type', 'text/plain')],
+                        'Internal Server Error')],
+                      responses)
+
+  def test_malformed_header(self):
+    errors = []
+
+    class FakeChannel(asyncserver.Channel):
+      def __init__(self):
+        self.buffer = ['GET / HTTP/1.1\r\nHost: localhost\r\nBogus']
+        self.request = None
+
+      def send_error(self, status):
+        errors.append(status)
+
+    FakeChannel().found_terminator()
+    self.assertEquals(['400 Bad Request'], errors)
+
+
+
+class KeepAliveServerTest(AsyncServerTest):
+  """Runs the HTTP/1.1 keep-alive server.
+  """
+
+  ARGS = ['--keep_alive', '--threads', '4']
+
+
+class KeepAliveServerHandlerTest(unittest.TestCase):
+  """Unit tests for server.KeepAliveServerHandler.
+  """
+
+  def run_app(self, method, app):
+    """Runs a WSGI app on an HTTP/1.1 request and returns the response.
+    """
+    class FakeRequestHandler(object):
+      request_version = 'HTTP/1.1'
+      close_connection = 0
+
+      def log_request(self, *args):
+        pass
+
+    output = StringIO.StringIO()
+    handler = server.KeepAliveServerHandler(
+      StringIO.StringIO(), output, StringIO.StringIO(),
+      {'REQUEST_METHOD': method, 'SERVER_PROTOCOL': 'HTTP/1.1'})
+    handler.request_handler = FakeRequestHandler()
+    handler.run(app)
+    return output.getvalue()
+
+  def test_head_without_content_length(self):
+    def app(environ, start_response):
+      start_response('200 OK', [('Content-Type', 'text/plain')])
+      return iter(['foo'])  # not a list, so wsgiref can't set Content-Length
+
+    self.assertTrue(self.run_app('GET', app).endswith(
+        '\r\n\r\n3\r\nfoo\r\n0\r\n\r\n'))
+    resp = self.run_app('HEAD', app)
+    self.assertTrue(resp.endswith('\r\n\r\n'), resp)
+    self.assertNotIn('foo', resp)
+    self.assertNotIn('chunked', resp)
+
+  def test_head_with_content_length(self):
+    def app(environ, start_response):
+      start_response('200 OK', [('Content-Type', 'text/plain'),
+                                ('Content-Length', '3')])
+      return ['foo']
+
+    resp = self.run_app('HEAD', app)
+    self.assertTrue(resp.endswith('Content-Length: 3\r\n\r\n'), resp)
+
 
 if __name__ == '__main__':
   unittest.main()
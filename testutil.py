@@ -5,14 +5,17 @@ __author__ = ['Ryan Barrett <mockfacebook@ryanb.org>']
 
 import cStringIO
 import json
+import os
 import re
 import sqlite3
 import sys
+import tempfile
 import unittest
 import urllib
 
 import webapp2
 
+import oauth
 import schemautil
 import server
 
@@ -27,6 +30,23 @@ def maybe_read(dataset_cls):
     return None
 
 
+class TempDbTest(unittest.TestCase):
+  """Base test class that provides an empty SQLite db file.
+
+  Attributes:
+    db_filename: string, removed after each test
+  """
+
+  def setUp(self):
+    super(TempDbTest, self).setUp()
+    handle, self.db_filename = tempfile.mkstemp()
+    os.close(handle)
+
+  def tearDown(self):
+    os.remove(self.db_filename)
+    super(TempDbTest, self).tearDown()
+
+
 class HandlerTest(unittest.TestCase):
   """Base test class for webapp2 request handlers.
 
@@ -45,6 +65,7 @@ class HandlerTest(unittest.TestCase):
     super(HandlerTest, self).setUp()
 
     self.conn = schemautil.get_db(':memory:')
+    oauth.BaseHandler.init_tokens(self.conn)
     for cls in handler_classes:
       cls.init(self.conn, self.ME)
 
@@ -110,3 +131,34 @@ class HandlerTest(unittest.TestCase):
         expected.sort()
         actual.sort()
       self.assertEquals(expected, actual)
+
+
+class ThreadLocalDbTest(HandlerTest, TempDbTest):
+  """Base test class for handlers that run work concurrently.
+
+  Uses a ThreadLocalConnection to a db file instead of an in-memory db, so the
+  handlers can query it from other threads and forked processes.
+  """
+
+  def setUp(self, *handler_classes):
+    """Args:
+    handler_classes: RequestHandlers to initialize
+    """
+    super(ThreadLocalDbTest, self).setUp()
+
+    conn = schemautil.get_db(self.db_filename)
+    self.insert_test_data(conn)
+    conn.close()
+
+    self.conn = schemautil.ThreadLocalConnection(self.db_filename)
+    oauth.BaseHandler.init_tokens(self.conn)
+    for cls in handler_classes:
+      cls.init(self.conn, self.ME)
+
+  def insert_test_data(self, conn):
+    """Populates the db before the handlers are initialized. Optional.
+
+    Args:
+      conn: sqlite3.Connection
+    """
+    pass